@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# Convert animated GIF/WebP/APNG or a folder of png frames to LVGL images,
+# one image per frame and an index with the timing of every frame.
+#
+# usage:
+#   python LVGLAnimation.py [--cf RGB565A8] [--ofmt BIN|C|PNG|PACK] [--delta]
+#       [--keyframe N] [--size WxH] [-o output] <animation file or folder>
+import os
+import json
+import logging
+import argparse
+from os import path
+from pathlib import Path
+
+import numpy as np
+
+from LVGLImage import (LVGLImage, ColorFormat, CompressMethod, OutputFormat,
+                       AssetPack, ParameterError, mask_bbox,
+                       write_c_index_file)
+
+try:
+    from PIL import Image, ImageSequence
+except ImportError:
+    raise ImportError("Need pillow package, do `pip3 install pillow`")
+
+
+def _to_rgba(img, size=None) -> np.ndarray:
+    img = img.convert("RGBA")
+    if size and img.size != tuple(size):
+        img = img.resize(tuple(size), Image.Resampling.LANCZOS)
+    return np.asarray(img)
+
+
+def open_frames(source, size=None, delay: int = 100):
+    """
+    Return (loop, generator of (rgba, duration in ms)). source is an animated
+    image file or a folder of png files played in name order, `delay` is
+    used for frames without timing. loop is 0 for forever, otherwise the
+    number of times to play. Frames are decoded one at a time, the whole
+    animation is never held in memory. Without size, png frames of a
+    folder that differ in size raise ParameterError.
+    """
+    if path.isdir(source):
+        files = sorted(Path(source).glob("*.[pP][nN][gG]"))
+        if not files:
+            raise ParameterError(f"no png frames in {source}")
+
+        def folder_frames():
+            first = None
+            for f in files:
+                with Image.open(f) as img:
+                    # frames are diffed pixel by pixel, without a target
+                    # size they must all match the first one
+                    if first is None:
+                        first = img.size
+                    elif size is None and img.size != first:
+                        raise ParameterError(
+                            f"{f.name} is {img.width}x{img.height}, other frames "
+                            f"are {first[0]}x{first[1]}; resize them or pass a size")
+                    yield _to_rgba(img, size), delay
+
+        return 0, folder_frames()
+
+    img = Image.open(source)
+    # GIF without the loop extension is played once
+    loop = img.info.get("loop", 1)
+
+    def file_frames():
+        try:
+            for frame in ImageSequence.Iterator(img):
+                yield _to_rgba(frame, size), frame.info.get("duration") or delay
+        finally:
+            img.close()
+
+    return loop, file_frames()
+
+
+def changed_rect(prev: np.ndarray, cur: np.ndarray):
+    """
+    Bounding box (x, y, w, h) of the pixels that differ between two frames,
+    None if the frames are the same
+    """
+    return mask_bbox((prev != cur).any(axis=2))
+
+
+def delta_frames(frames, delta=True, keyframe=0):
+    """
+    Turn (rgba, duration) frames into (rgba, x, y, duration, key).
+    With delta, frames other than key frames only hold the rectangle that
+    changed since the previous frame, placed at x, y, and frames without
+    any change extend the duration of the previous one. keyframe N makes
+    every Nth source frame a full frame, 0 only the first.
+    """
+    prev = pending = None
+    for i, (rgba, duration) in enumerate(frames):
+        h, w, _ = rgba.shape
+        key = not delta or prev is None or (keyframe and i % keyframe == 0)
+        if key:
+            rect = (0, 0, w, h)
+        else:
+            rect = changed_rect(prev, rgba)
+            if rect is None:
+                pending[3] += duration
+                continue
+        if pending:
+            yield tuple(pending)
+        x, y, rw, rh = rect
+        pending = [rgba[y:y + rh, x:x + rw], x, y, duration, bool(key)]
+        prev = rgba
+    if pending:
+        yield tuple(pending)
+
+
+class AnimationConverter:
+    """
+    Convert frames to LVGL images named <name>_<n>, written in `ofmt` to
+    `odir` with an index <name>.json and <name>.h, or to one asset pack
+    <name>.bin with the frames in its index.
+    Delta frames must be copied to the canvas at (ofs_x, ofs_y) without
+    blending, transparent pixels in them replace the previous frame.
+    """
+
+    # columns of the C index for file output
+    C_FIELDS = [("name", "const char *"),
+                ("ofs_x", "uint16_t"), ("ofs_y", "uint16_t"),
+                ("w", "uint16_t"), ("h", "uint16_t"),
+                ("duration", "uint32_t"), ("key", "uint8_t")]
+    # columns added to the asset pack index
+    PACK_FIELDS = [("duration", "uint32_t"), ("key", "uint8_t")]
+
+    def __init__(self,
+                 cf: ColorFormat,
+                 ofmt: OutputFormat,
+                 odir: str,
+                 delta: bool = True,
+                 keyframe: int = 0,
+                 compress: CompressMethod = CompressMethod.NONE,
+                 background: int = 0x00,
+                 align: int = 1,
+                 quantizer=None,
+                 pack_align: int = 4) -> None:
+        self.cf = cf
+        self.ofmt = ofmt
+        self.output = odir
+        self.delta = delta
+        self.keyframe = keyframe
+        self.compress = compress
+        self.background = background
+        self.align = align
+        self.quantizer = quantizer
+        self.pack_align = pack_align
+
+    def convert(self, source, name: str = None, size=None, delay: int = 100):
+        """
+        Convert animation file or png folder, return the index
+        """
+        if name is None:
+            name = path.splitext(path.basename(path.normpath(source)))[0]
+        name = name.replace("-", "_").replace(".", "_")
+        loop, frames = open_frames(source, size, delay)
+        return self.convert_frames(frames, name, loop)
+
+    def convert_frames(self, frames, name: str, loop: int = 0):
+        os.makedirs(self.output, exist_ok=True)
+        pack = None
+        if self.ofmt == OutputFormat.ASSET_PACK:
+            pack = AssetPack(self.pack_align, self.PACK_FIELDS)
+
+        entries = []
+        canvas = None
+        duration = 0
+        for n, (rgba, x, y, ms, key) in enumerate(
+                delta_frames(frames, self.delta, self.keyframe)):
+            if canvas is None:
+                canvas = (rgba.shape[1], rgba.shape[0])
+            frame_name = f"{name}_{n}"
+            img = LVGLImage().from_rgba(rgba, self.cf,
+                                        background=self.background,
+                                        quantizer=self.quantizer,
+                                        name=frame_name)
+            img.adjust_stride(align=self.align)
+            info = {"ofs_x": x, "ofs_y": y, "duration": ms, "key": key}
+            output = path.join(self.output, frame_name)
+            if self.ofmt == OutputFormat.BIN_FILE:
+                img.to_bin(output + ".bin", compress=self.compress)
+            elif self.ofmt == OutputFormat.C_ARRAY:
+                img.to_c_array(output + ".c", compress=self.compress)
+            elif self.ofmt == OutputFormat.PNG_FILE:
+                img.to_png(output + ".png")
+            if pack is not None:
+                entries.append(pack.add_image(frame_name, img,
+                                              compress=self.compress, **info))
+            else:
+                entries.append({"name": frame_name, "cf": img.cf.name,
+                                "w": img.w, "h": img.h, **info})
+            duration += ms
+            logging.info(f"{frame_name}: {img.w}x{img.h} at ({x}, {y}), "
+                         f"{ms}ms{', key' if key else ''}")
+
+        if canvas is None:
+            raise ParameterError(f"{name} has no frames")
+
+        meta = {"w": canvas[0], "h": canvas[1], "loop": loop,
+                "frames": len(entries), "duration": duration}
+        if pack is not None:
+            pack.write(path.join(self.output, name), **meta)
+            return {**meta, "assets": pack.entries}
+
+        index = {"name": name, **meta, "assets": entries}
+        with open(path.join(self.output, name + ".json"), "w") as f:
+            json.dump(index, f, indent=2)
+        write_c_index_file(path.join(self.output, name + ".h"), self.C_FIELDS,
+                           entries, {k.upper(): v for k, v in meta.items()})
+        return index
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Animated image or png folder to LVGL images per frame.')
+    parser.add_argument('--ofmt',
+                        help="output format of frames, PACK puts all frames "
+                             "in one blob",
+                        default="BIN",
+                        choices=["C", "BIN", "PNG", "PACK"])
+    parser.add_argument('--cf',
+                        help="color format of frames, AUTO for I1/2/4/8",
+                        default="RGB565A8",
+                        choices=["L8", "I1", "I2", "I4", "I8", "A1", "A2", "A4",
+                                 "A8", "ARGB8888", "XRGB8888", "RGB565",
+                                 "RGB565A8", "ARGB8565", "RGB888", "AUTO"])
+    parser.add_argument('--delta', action='store_true',
+                        help="store only the changed rectangle of each frame")
+    parser.add_argument('--keyframe', type=int, default=0, metavar='N',
+                        help="with --delta, store every Nth frame in full")
+    parser.add_argument('--size', default=None, metavar='WxH',
+                        help="resize frames, e.g. 64x64")
+    parser.add_argument('--delay', type=int, default=100, metavar='ms',
+                        help="frame time for png folders and frames "
+                             "without timing")
+    parser.add_argument('--compress', default="NONE",
+                        choices=["NONE", "RLE", "LZ4"])
+    parser.add_argument('--align', type=int, default=1, metavar='byte',
+                        help="stride alignment in bytes")
+    parser.add_argument('--pack-align', type=int, default=4, metavar='byte',
+                        help="alignment in bytes of each frame in asset pack")
+    parser.add_argument('--background', default=0x00_00_00,
+                        type=lambda x: int(x, 0), metavar='color',
+                        help="Background color for formats without alpha")
+    parser.add_argument('--name', default=None,
+                        help="name prefix of frames, default to input name")
+    parser.add_argument('-o', '--output', default="./output",
+                        help="Select the output folder, default to ./output")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('input', help="animated image file or png folder")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    cf = None if args.cf == "AUTO" else ColorFormat[args.cf]
+    size = tuple(map(int, args.size.lower().split('x'))) if args.size else None
+    converter = AnimationConverter(cf,
+                                   OutputFormat(args.ofmt),
+                                   args.output,
+                                   delta=args.delta,
+                                   keyframe=args.keyframe,
+                                   compress=CompressMethod[args.compress],
+                                   background=args.background,
+                                   align=args.align,
+                                   pack_align=args.pack_align)
+    index = converter.convert(args.input, args.name, size, args.delay)
+    print(f"done {index['frames']} frames, {index['duration']}ms")
+
+
+if __name__ == "__main__":
+    main()
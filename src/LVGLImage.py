@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import os
+import json
 import logging
 import argparse
+import tempfile
 import subprocess
 from os import path
 from enum import Enum
@@ -18,6 +20,29 @@ try:
 except ImportError:
     raise ImportError("Need lz4 package, do `pip3 install lz4`")
 
+try:
+    import numpy as np
+except ImportError:
+    raise ImportError("Need numpy package, do `pip3 install numpy`")
+
+try:
+    # optional, decodes png files several times faster than pypng
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+
+# linear->sRGB table size for L8 conversion, one step changes the 8bit
+# result by at most 0.05 LSB
+LUMA_LUT_SIZE = 65536
+
+# "0x??," text of every byte value, used to format C arrays row by row
+C_HEX_TABLE = np.frombuffer("".join(f"0x{v:02x}," for v in range(256)).encode(),
+                            dtype=np.uint8).reshape(256, 5)
+C_LINE_PREFIX = np.frombuffer(b"\n    ", dtype=np.uint8)
+# rows formatted and written to file in one go
+C_ROWS_PER_BLOCK = 4096
+
 
 def uint8_t(val) -> bytes:
     return val.to_bytes(1, byteorder='little')
@@ -72,17 +97,22 @@ class PngQuant:
     """
 
     def __init__(self, ncolors=256, dither=True, exec_path="") -> None:
-        executable = path.join(exec_path, "pngquant")
-        self.cmd = (f"{executable} {'--nofs' if not dither else ''} "
-                    f"{ncolors}  --force - < ")
+        self.executable = path.join(exec_path, "pngquant")
+        self.dither = dither
+        self.cmd = self._command(ncolors)
+
+    def _command(self, ncolors):
+        return (f"{self.executable} {'--nofs' if not self.dither else ''} "
+                f"{ncolors}  --force - < ")
 
-    def convert(self, filename) -> bytes:
+    def convert(self, filename, ncolors=None) -> bytes:
         if not os.path.isfile(filename):
             raise BaseException(f"file not found: {filename}")
 
+        cmd = self.cmd if ncolors is None else self._command(ncolors)
         try:
             compressed = subprocess.check_output(
-                f'{self.cmd} "{str(filename)}"',
+                f'{cmd} "{str(filename)}"',
                 stderr=subprocess.STDOUT,
                 shell=True)
         except subprocess.CalledProcessError:
@@ -95,6 +125,216 @@ class PngQuant:
 
         return compressed
 
+    def convert_rgba(self, rgba: np.ndarray, ncolors=None) -> bytes:
+        """
+        Same as convert() for an h x w x 4 RGBA array
+        """
+        h, w, _ = rgba.shape
+        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
+            png.Writer(w, h, alpha=True, greyscale=False).write_array(
+                tmp, rgba.reshape(-1).tolist())
+            temp_path = tmp.name
+        try:
+            return self.convert(temp_path, ncolors)
+        finally:
+            os.unlink(temp_path)
+
+
+class PaletteQuantizer:
+    """
+    In-process replacement of `pngquant`: median-cut palette refined with a
+    few k-means iterations, optional Floyd-Steinberg dithering.
+    Call fit() with a set of images to share one palette among all of them.
+    """
+
+    def __init__(self, ncolors=256, dither=True, kmeans_iter=3,
+                 sample_pixels=65536) -> None:
+        self.ncolors = ncolors
+        self.dither = dither
+        self.kmeans_iter = kmeans_iter
+        # palette is built from at most this many randomly sampled pixels
+        self.sample_pixels = sample_pixels
+        self.palette = None  # shared palette set by fit()
+
+    @staticmethod
+    def _unique_colors(images, sample_pixels=None):
+        """
+        Return unique RGBA colors and their pixel counts. Fully transparent
+        pixels are folded into (0, 0, 0, 0). With sample_pixels, only that
+        many pixels picked at random (with a fixed seed) are counted.
+        """
+        packed = []
+        for rgba in images:
+            p = rgba.reshape(-1, 4).copy()
+            p[p[:, 3] == 0] = 0
+            packed.append(p.view('<u4').ravel())
+        packed = np.concatenate(packed)
+        if sample_pixels and len(packed) > sample_pixels:
+            rng = np.random.default_rng(0)
+            packed = packed[rng.choice(len(packed), sample_pixels, replace=False)]
+        values, counts = np.unique(packed, return_counts=True)
+        colors = values.astype('<u4').view(np.uint8).reshape(-1, 4)
+        return colors, counts
+
+    @staticmethod
+    def _nearest(colors, palette, chunk=4096):
+        """
+        Index of the nearest palette entry for each color
+        """
+        # |c - p|^2 = |c|^2 - 2 c.p + |p|^2, |c|^2 is the same for all p
+        pal = palette.astype(np.float32)
+        pal_norm = (pal**2).sum(axis=1)
+        result = np.empty(len(colors), dtype=np.uint8)
+        for i in range(0, len(colors), chunk):
+            c = colors[i:i + chunk].astype(np.float32)
+            d = pal_norm[None, :] - 2 * (c @ pal.T)
+            result[i:i + chunk] = d.argmin(axis=1)
+        return result
+
+    def build_palette(self, images, ncolors) -> np.ndarray:
+        """
+        Build a palette of at most ncolors RGBA entries for the images
+        """
+        colors, counts = self._unique_colors(images, self.sample_pixels)
+        if len(colors) <= ncolors:
+            # few colors, use the exact set if the sample missed none
+            colors, counts = self._unique_colors(images)
+        if len(colors) <= ncolors:
+            return colors
+
+        # median cut, always split the box with the largest weighted range
+        def box(idx):
+            c = colors[idx]
+            ranges = c.max(axis=0).astype(np.int32) - c.min(axis=0)
+            ch = int(ranges.argmax())
+            score = int(ranges[ch]) * int(counts[idx].sum()) if len(idx) > 1 else 0
+            return score, ch, idx
+
+        boxes = [box(np.arange(len(colors)))]
+        while len(boxes) < ncolors:
+            best = max(range(len(boxes)), key=lambda i: boxes[i][0])
+            score, ch, idx = boxes[best]
+            if score == 0:
+                break
+            boxes.pop(best)
+            idx = idx[np.argsort(colors[idx, ch], kind='stable')]
+            cum = np.cumsum(counts[idx])
+            cut = int(np.searchsorted(cum, cum[-1] / 2))
+            cut = min(max(cut, 1), len(idx) - 1)
+            boxes += [box(idx[:cut]), box(idx[cut:])]
+        boxes = [idx for _, _, idx in boxes]
+
+        weights = counts.astype(np.float64)
+        palette = np.array([
+            (colors[idx] * weights[idx, None]).sum(axis=0) / weights[idx].sum()
+            for idx in boxes
+        ])
+
+        # refine with weighted k-means on the unique colors
+        for _ in range(self.kmeans_iter):
+            labels = self._nearest(colors, np.rint(palette))
+            sums = np.zeros_like(palette)
+            np.add.at(sums, labels, colors * weights[:, None])
+            total = np.bincount(labels, weights=weights, minlength=len(palette))
+            used = total > 0
+            palette[used] = sums[used] / total[used, None]
+
+        return np.clip(np.rint(palette), 0, 255).astype(np.uint8)
+
+    def fit(self, images):
+        """
+        Build one shared palette for a set of RGBA images
+        """
+        self.palette = self.build_palette(images, self.ncolors)
+        return self
+
+    def remap(self, rgba, palette) -> np.ndarray:
+        """
+        Map RGBA image to palette indices
+        """
+        h, w, _ = rgba.shape
+        rgba = rgba.copy()
+        rgba[rgba[..., 3] == 0] = 0
+        if not self.dither:
+            colors, inverse = np.unique(rgba.reshape(-1, 4).view('<u4'),
+                                        return_inverse=True)
+            colors = colors.astype('<u4').view(np.uint8).reshape(-1, 4)
+            return self._nearest(colors, palette)[inverse.ravel()].reshape(h, w)
+
+        # Floyd-Steinberg error diffusion. A pixel only depends on its left
+        # neighbour and the three pixels above it, so all pixels on an
+        # anti-diagonal x + 2y = t can be processed together, in the same
+        # order of dependencies as a left-to-right, top-to-bottom pass.
+        # Fully transparent pixels neither take nor pass on error.
+        pal = palette.astype(np.float32)
+        out = np.empty((h, w), dtype=np.uint8)
+        cur = rgba.astype(np.float32)
+        opaque = rgba[..., 3] > 0
+        clear = self._nearest(np.zeros((1, 4), dtype=np.uint8), palette)[0]
+        # error padded by one column on each side and one row below
+        err = np.zeros((h + 1, w + 2, 4), dtype=np.float32)
+        for t in range(w + 2 * (h - 1)):
+            ys = np.arange(max(0, (t - w + 2) // 2), min(h - 1, t // 2) + 1)
+            xs = t - 2 * ys
+            keep = opaque[ys, xs]
+            out[ys[~keep], xs[~keep]] = clear
+            ys, xs = ys[keep], xs[keep]
+            if not len(ys):
+                continue
+            v = np.clip(cur[ys, xs] + err[ys, xs + 1], 0, 255)
+            idx = self._nearest(np.rint(v).astype(np.uint8), palette)
+            out[ys, xs] = idx
+            e = v - pal[idx]
+            err[ys, xs + 2] += e * (7 / 16)
+            err[ys + 1, xs] += e * (3 / 16)
+            err[ys + 1, xs + 1] += e * (5 / 16)
+            err[ys + 1, xs + 2] += e * (1 / 16)
+        return out
+
+    def quantize(self, rgba, ncolors=None):
+        """
+        Return palette as list of (R, G, B, A) and the index map of the image
+        """
+        palette = self.palette
+        if palette is None:
+            palette = self.build_palette([rgba], ncolors or self.ncolors)
+        elif ncolors and len(palette) > ncolors:
+            raise ParameterError(f"shared palette has {len(palette)} colors, "
+                                 f"more than {ncolors}")
+        indices = self.remap(rgba, palette)
+        return [tuple(c) for c in palette.tolist()], indices
+
+
+def cluster_images(images, k, iterations=10) -> List:
+    """
+    Group visually similar RGBA images into k clusters by their coarse color
+    histogram, return the cluster label of each image
+    """
+    features = []
+    for rgba in images:
+        p = rgba.reshape(-1, 4)
+        bins = (p[:, 0] >> 6) * 16 + (p[:, 1] >> 6) * 4 + (p[:, 2] >> 6)
+        hist = np.bincount(bins, weights=p[:, 3] / 255.0, minlength=64)
+        features.append(hist / max(hist.sum(), 1e-9))
+    features = np.array(features)
+
+    k = max(1, min(k, len(images)))
+    # farthest point initialization, deterministic
+    centers = [features[0]]
+    for _ in range(1, k):
+        d = np.min([((features - c)**2).sum(axis=1) for c in centers], axis=0)
+        centers.append(features[int(d.argmax())])
+    centers = np.array(centers)
+
+    labels = np.zeros(len(images), dtype=int)
+    for _ in range(iterations):
+        d = ((features[:, None, :] - centers[None, :, :])**2).sum(axis=2)
+        labels = d.argmin(axis=1)
+        for c in range(k):
+            if (labels == c).any():
+                centers[c] = features[labels == c].mean(axis=0)
+    return labels.tolist()
+
 
 class CompressMethod(Enum):
     NONE = 0x00
@@ -181,6 +421,14 @@ class ColorFormat(Enum):
             ColorFormat.ARGB8565,
             ColorFormat.RGB565A8)
 
+    @property
+    def can_crop(self) -> bool:
+        """
+        Return if fully transparent pixels stay invisible in this format, so
+        they can be cropped away without changing how the image looks
+        """
+        return self.has_alpha and self is not ColorFormat.XRGB8888
+
     @property
     def is_colormap(self) -> bool:
         return self in (ColorFormat.ARGB8888, ColorFormat.RGB888,
@@ -303,6 +551,104 @@ def unpack_colors(data: bytes, cf: ColorFormat, w) -> List:
     return ret
 
 
+def cf_from_filename(filename) -> ColorFormat:
+    """
+    Color format named in the filename like `icon.RGB565A8.png`, or None
+    """
+    # split filename string and match with ColorFormat to check which cf to use
+    names = str(path.basename(filename)).split(".")
+    for c in names[1:-1]:
+        if c in ColorFormat.__members__:
+            return ColorFormat[c]
+    return None
+
+
+def mask_bbox(mask: np.ndarray):
+    """
+    Bounding box (x, y, w, h) of the True values of a 2D mask, None if
+    there are none. Rows and columns are reduced separately, so only the
+    edges are searched for.
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    x, y = int(cols[0]), int(rows[0])
+    return x, y, int(cols[-1]) - x + 1, int(rows[-1]) - y + 1
+
+
+def crop_to_alpha(rgba: np.ndarray):
+    """
+    Crop RGBA array to the bounding box of pixels that are not fully
+    transparent, return the view and its x, y. A fully transparent image
+    is cropped to its top left pixel.
+    """
+    x, y, w, h = mask_bbox(rgba[..., 3] > 0) or (0, 0, 1, 1)
+    return rgba[y:y + h, x:x + w], x, y
+
+
+def read_rgba(filename) -> np.ndarray:
+    """
+    Read a png file as an h x w x 4 uint8 RGBA array
+    """
+    if PILImage is not None:
+        with PILImage.open(filename) as img:
+            if img.format == "PNG" and img.mode in ("RGBA", "RGB", "P", "L", "LA"):
+                return np.array(img.convert("RGBA"))
+    w, h, rows, _ = png.Reader(str(filename)).asRGBA8()
+    return rows_to_array(rows, w, h)
+
+
+def rows_to_array(rows, w, h) -> np.ndarray:
+    """
+    Stack RGBA8 rows returned by pypng to an h x w x 4 uint8 array
+    """
+    return np.vstack([np.asarray(row, dtype=np.uint8) for row in rows]).reshape(h, w, 4)
+
+
+def pack_rows(rows: np.ndarray, bpp: int) -> bytes:
+    """
+    Pack 2D array of 1/2/4bpp values MSB first, each row padded to whole byte.
+    Same result as `png.pack_rows`.
+    """
+    if bpp == 8:
+        return rows.astype(np.uint8).tobytes()
+    h, w = rows.shape
+    ppb = 8 // bpp  # pixels per byte
+    padded = np.zeros((h, (w + ppb - 1) // ppb * ppb), dtype=np.uint8)
+    padded[:, :w] = rows
+    padded = padded.reshape(h, -1, ppb)
+    shifts = np.arange(8 - bpp, -1, -bpp, dtype=np.uint8)
+    return np.bitwise_or.reduce(padded << shifts, axis=2).astype(np.uint8).tobytes()
+
+
+def c_array_blocks(data: bytes, per_line: int):
+    """
+    Format data as C array text, `per_line` bytes on each line. Each line is
+    "\\n    0x??,0x??,...". Whole blocks of lines are formatted at once with a
+    lookup into C_HEX_TABLE instead of formatting byte by byte.
+    """
+    src = np.frombuffer(data, dtype=np.uint8)
+    block_size = per_line * C_ROWS_PER_BLOCK
+    for start in range(0, len(src), block_size):
+        block = src[start:start + block_size]
+        nrows = -(-len(block) // per_line)
+        text = np.empty((nrows, len(C_LINE_PREFIX) + per_line * 5),
+                        dtype=np.uint8)
+        text[:, :len(C_LINE_PREFIX)] = C_LINE_PREFIX
+        hexed = text[:, len(C_LINE_PREFIX):].reshape(nrows, per_line, 5)
+        full = len(block) // per_line
+        hexed[:full] = C_HEX_TABLE[block[:full * per_line].reshape(full, per_line)]
+        tail = len(block) - full * per_line
+        if not tail:
+            yield text.tobytes().decode("ascii")
+            continue
+        # last line is shorter
+        hexed[full, :tail] = C_HEX_TABLE[block[full * per_line:]]
+        last = text[full, :len(C_LINE_PREFIX) + tail * 5]
+        yield (text[:full].tobytes() + last.tobytes()).decode("ascii")
+
+
 def write_c_array_file(
         w: int, h: int,
         stride: int,
@@ -310,7 +656,13 @@ def write_c_array_file(
         filename: str,
         premultiplied: bool,
         compress: CompressMethod,
-        data: bytes):
+        data: bytes,
+        palette: bool = True,
+        offset=None):
+    """
+    offset: (x, y) of a cropped image in its source, written as
+    `const lv_point_t <varname>_ofs`
+    """
     varname = path.basename(filename).split('.')[0]
     varname = varname.replace("-", "_")
     varname = varname.replace(".", "_")
@@ -359,14 +711,16 @@ const lv_image_dsc_t {varname} = {{
   .data = {varname}_map,
 }};
 
+'''
+    if offset is not None:
+        ending += f'''const lv_point_t {varname}_ofs = {{ {offset[0]}, {offset[1]} }};
+
 '''
 
     def write_binary(f, data, stride):
         stride = 16 if stride == 0 else stride
-        for i, v in enumerate(data):
-            if i % stride == 0:
-                f.write("\n    ")
-            f.write(f"0x{v:02x},")
+        for block in c_array_blocks(data, stride):
+            f.write(block)
         f.write("\n")
 
     with open(filename, "w+") as f:
@@ -375,8 +729,9 @@ const lv_image_dsc_t {varname} = {{
         if compress != CompressMethod.NONE:
             write_binary(f, data, 16)
         else:
-            # write palette separately
-            ncolors = cf.ncolors
+            # write palette separately, data has no palette if it's stored
+            # in a shared palette file
+            ncolors = cf.ncolors if palette else 0
             if ncolors:
                 write_binary(f, data[:ncolors * 4], 16)
 
@@ -385,6 +740,22 @@ const lv_image_dsc_t {varname} = {{
         f.write(ending)
 
 
+def write_palette_c_file(filename: str, palette: bytes):
+    """
+    Write a shared palette (B,G,R,A per color) as C array
+    """
+    varname = path.basename(filename).split('.')[0]
+    varname = varname.replace("-", "_")
+    varname = varname.replace(".", "_")
+
+    with open(filename, "w+") as f:
+        f.write(f"\n#include <stdint.h>\n\n"
+                f"const uint8_t {varname}_map[] = {{")
+        for block in c_array_blocks(bytes(palette), 16):
+            f.write(block)
+        f.write(f"\n}};\n\nconst uint32_t {varname}_size = sizeof({varname}_map);\n")
+
+
 class LVGLImageHeader:
 
     def __init__(self,
@@ -490,6 +861,8 @@ class LVGLCompressData:
 
 class LVGLImage:
 
+    _luma_luts = None  # cached by _luma_tables()
+
     def __init__(self,
                  cf: ColorFormat = ColorFormat.UNKNOWN,
                  w: int = 0,
@@ -498,6 +871,9 @@ class LVGLImage:
         self.stride = 0  # default no valid stride value
         self.premultiplied = False
         self.rgb565_dither = False
+        self.crop = False
+        # position of the image in the source when it's cropped
+        self.ofs_x = self.ofs_y = 0
         self.set_data(cf, w, h, data)
 
     def __repr__(self) -> str:
@@ -539,39 +915,50 @@ class LVGLImage:
             raise ParameterError(f"Stride is too small:{stride}, "
                                  f"minimal:{current.stride_default}")
 
-        def change_stride(data: bytearray, h, current_stride, new_stride):
-            data_in = data
-            data_out = []  # stride adjusted new data
-            if new_stride < current_stride:  # remove padding byte
-                for i in range(h):
-                    start = i * current_stride
-                    end = start + new_stride
-                    data_out.append(data_in[start:end])
-            else:  # adding more padding bytes
-                padding = b'\x00' * (new_stride - current_stride)
-                for i in range(h):
-                    data_out.append(data_in[i * current_stride:(i + 1) *
-                                            current_stride])
-                    data_out.append(padding)
-            return b''.join(data_out)
-
-        palette_size = self.cf.ncolors * 4
-        data_out = [self.data[:palette_size]]
-        data_out.append(
-            change_stride(self.data[palette_size:], self.h, current.stride,
-                          stride))
+        # only record the new stride, data is re-strided once when it's
+        # accessed, so round trips of stride changes don't copy at all
+        self.stride = stride
 
+    @property
+    def data(self):
+        if self._data_stride != self.stride:
+            self._data = self._restride(self._data, self._data_stride,
+                                        self.stride)
+            self._data_stride = self.stride
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._data_stride = self.stride
+
+    def _restride(self, data, current_stride, new_stride) -> bytearray:
+        """
+        Copy data with current_stride into a new buffer with new_stride.
+        Each plane is accessed as a 2D strided view, rows are copied in one
+        numpy assignment per plane.
+        """
+        palette_size = self.cf.ncolors * 4 if self.is_indexed else 0
+        planes = [(current_stride, new_stride)]
         # deal with alpha map for RGB565A8
         if self.cf == ColorFormat.RGB565A8:
-            logging.warning("handle RGB565A8 alpha map")
-            a8_stride = self.stride // 2
-            a8_map = self.data[-a8_stride * self.h:]
-            data_out.append(
-                change_stride(a8_map, self.h, current.stride // 2,
-                              stride // 2))
-
-        self.stride = stride
-        self.data = bytearray(b''.join(data_out))
+            planes.append((current_stride // 2, new_stride // 2))
+
+        out_len = palette_size + sum(n * self.h for _, n in planes)
+        out = bytearray(out_len)
+        src = np.frombuffer(data, dtype=np.uint8)
+        dst = np.frombuffer(out, dtype=np.uint8)
+        dst[:palette_size] = src[:palette_size]
+
+        src_offset = dst_offset = palette_size
+        for cur, new in planes:
+            src_plane = src[src_offset:src_offset + cur * self.h].reshape(self.h, cur)
+            dst_plane = dst[dst_offset:dst_offset + new * self.h].reshape(self.h, new)
+            n = min(cur, new)
+            dst_plane[:, :n] = src_plane[:, :n]
+            src_offset += cur * self.h
+            dst_offset += new * self.h
+        return out
 
     def premultiply(self):
         """
@@ -744,54 +1131,82 @@ class LVGLImage:
 
     def to_bin(self,
                filename: str,
-               compress: CompressMethod = CompressMethod.NONE):
+               compress: CompressMethod = CompressMethod.NONE,
+               palette: bool = True):
         """
-        Write this image to file, filename should be ended with '.bin'
+        Write this image to file, filename should be ended with '.bin'.
+        Set palette to False to leave out the palette of indexed image when
+        it's stored in a shared palette file.
         """
         self._check_ext(filename, ".bin")
         self._check_dir(filename)
 
         with open(filename, "wb+") as f:
-            bin = bytearray()
-            flags = 0
-            flags |= 0x08 if compress != CompressMethod.NONE else 0
-            flags |= 0x01 if self.premultiplied else 0
-
-            header = LVGLImageHeader(self.cf,
-                                     self.w,
-                                     self.h,
-                                     self.stride,
-                                     flags=flags)
-            bin += header.binary
-            compressed = LVGLCompressData(self.cf, compress, self.data)
-            bin += compressed.compressed
-
-            f.write(bin)
+            f.write(self.bin_data(compress, palette))
 
         return self
 
+    def bin_data(self,
+                 compress: CompressMethod = CompressMethod.NONE,
+                 palette: bool = True) -> bytearray:
+        """
+        Header and (compressed) data of this image, as written by to_bin
+        """
+        bin = bytearray()
+        flags = 0
+        flags |= 0x08 if compress != CompressMethod.NONE else 0
+        flags |= 0x01 if self.premultiplied else 0
+
+        header = LVGLImageHeader(self.cf,
+                                 self.w,
+                                 self.h,
+                                 self.stride,
+                                 flags=flags)
+        bin += header.binary
+        compressed = LVGLCompressData(self.cf, compress,
+                                      self._data_without_palette(palette))
+        bin += compressed.compressed
+        return bin
+
     def to_c_array(self,
                    filename: str,
-                   compress: CompressMethod = CompressMethod.NONE):
+                   compress: CompressMethod = CompressMethod.NONE,
+                   palette: bool = True):
         self._check_ext(filename, ".c")
         self._check_dir(filename)
 
+        data = self._data_without_palette(palette)
         if compress != CompressMethod.NONE:
-            data = LVGLCompressData(self.cf, compress, self.data).compressed
-        else:
-            data = self.data
+            data = LVGLCompressData(self.cf, compress, data).compressed
         write_c_array_file(self.w, self.h, self.stride, self.cf, filename,
                            self.premultiplied,
-                           compress, data)
+                           compress, data, palette,
+                           (self.ofs_x, self.ofs_y) if self.crop else None)
+
+    def _data_without_palette(self, palette: bool = False):
+        if palette or not self.is_indexed:
+            return self.data
+        return self.data[self.cf.ncolors * 4:]
+
+    @property
+    def palette(self) -> bytes:
+        """
+        Palette of indexed image in B,G,R,A format, empty for other formats
+        """
+        return bytes(self.data[:self.cf.ncolors * 4]) if self.is_indexed else b''
 
     def to_png(self, filename: str):
         self._check_ext(filename, ".png")
         self._check_dir(filename)
 
-        old_stride = self.stride
-        self.adjust_stride(align=1)
+        # unpack from a packed copy, the image itself is left untouched
+        packed = LVGLImageHeader(self.cf, self.w, self.h).stride_default
+        if self._data_stride == packed:
+            data = self._data
+        else:
+            data = self._restride(self._data, self._data_stride, packed)
+
         if self.cf.is_indexed:
-            data = self.data
             # Separate lvgl bin image data to palette and bitmap
             # The palette is in format of [(RGBA), (RGBA)...].
             # LVGL palette is in format of B,G,R,A,...
@@ -808,7 +1223,7 @@ class LVGLImage:
             data = unpack_colors(data, self.cf, self.w)
         elif self.cf.is_alpha_only:
             # separate packed data to plain data
-            transparency = unpack_colors(self.data, self.cf, self.w)
+            transparency = unpack_colors(data, self.cf, self.w)
             data = []
             for a in transparency:
                 data += [0, 0, 0, a]
@@ -820,13 +1235,12 @@ class LVGLImage:
                                  bitdepth=self.cf.bpp,
                                  greyscale=True,
                                  alpha=False)
-            data = self.data
         elif self.cf.is_colormap:
             encoder = png.Writer(self.w,
                                  self.h,
                                  alpha=self.cf.has_alpha,
                                  greyscale=False)
-            data = unpack_colors(self.data, self.cf, self.w)
+            data = unpack_colors(data, self.cf, self.w)
         else:
             logging.warning(f"missing logic: {self.cf.name}")
             return
@@ -834,44 +1248,116 @@ class LVGLImage:
         with open(filename, "wb") as f:
             encoder.write_array(f, data)
 
-        self.adjust_stride(stride=old_stride)
-
     def from_png(self,
                  filename: str,
                  cf: ColorFormat = None,
                  background: int = 0x00_00_00,
-                 rgb565_dither=False):
+                 rgb565_dither=False,
+                 quantizer=None,
+                 crop=False):
         """
         Create lvgl image from png file.
-        If cf is none, used I1/2/4/8 based on palette size
+        If cf is none, used I1/2/4/8 based on palette size.
+        quantizer is a PngQuant (default) or PaletteQuantizer used to convert
+        images without a suitable palette to indexed formats.
+        crop: only convert the bounding box of the pixels that are not fully
+        transparent, its position is kept in ofs_x, ofs_y.
         """
 
         self.background = background
         self.rgb565_dither = rgb565_dither
+        self.quantizer = quantizer
+        self.ofs_x = self.ofs_y = 0
 
         if cf is None:  # guess cf from filename
-            # split filename string and match with ColorFormat to check
-            # which cf to use
-            names = str(path.basename(filename)).split(".")
-            for c in names[1:-1]:
-                if c in ColorFormat.__members__:
-                    cf = ColorFormat[c]
-                    break
+            cf = cf_from_filename(filename)
+        self.crop = self._check_crop(crop, cf, filename)
 
         if cf is None or cf.is_indexed:  # palette mode
             self._png_to_indexed(cf, filename)
         elif cf.is_alpha_only:
             self._png_to_alpha_only(cf, filename)
         elif cf.is_luma_only:
-            self._png_to_luma_only(cf, filename)
+            self._rgba_to_luma_only(cf, self._crop_rgba(read_rgba(filename)))
         elif cf.is_colormap:
-            self._png_to_colormap(cf, filename)
+            self._rgba_to_colormap(cf, self._crop_rgba(read_rgba(filename)))
         else:
             logging.warning(f"missing logic: {cf.name}")
 
         logging.info(f"from png: {filename}, cf: {self.cf.name}")
         return self
 
+    def from_rgba(self,
+                  rgba: np.ndarray,
+                  cf: ColorFormat = None,
+                  background: int = 0x00_00_00,
+                  rgb565_dither=False,
+                  quantizer=None,
+                  name: str = "rgba",
+                  crop=False):
+        """
+        Create lvgl image from an h x w x 4 uint8 RGBA array, converted the
+        same way as from_png. If cf is none, used I1/2/4/8 based on the
+        number of colors. name is only used in log messages.
+        """
+        self.background = background
+        self.rgb565_dither = rgb565_dither
+        self.quantizer = quantizer
+        self.crop = self._check_crop(crop, cf, name)
+        self.ofs_x = self.ofs_y = 0
+
+        if cf is None or cf.is_indexed:
+            rgba = self._crop_rgba(rgba)
+            quantizer = self._quantizer(cf)
+            ncolors = 256 if cf is None else cf.ncolors
+            if isinstance(quantizer, PngQuant):
+                reader = png.Reader(bytes=quantizer.convert_rgba(rgba, ncolors))
+                _, _, rows, _ = reader.read()
+                palette = reader.palette(alpha="force")
+            else:
+                palette, rows = quantizer.quantize(rgba, ncolors)
+            h, w, _ = rgba.shape
+            self._set_indexed(cf, w, h, palette, rows, name)
+        elif cf.is_alpha_only:
+            self._rgba_to_alpha_only(cf, self._crop_rgba(rgba))
+        elif cf.is_luma_only:
+            self._rgba_to_luma_only(cf, self._crop_rgba(rgba))
+        elif cf.is_colormap:
+            self._rgba_to_colormap(cf, self._crop_rgba(rgba))
+        else:
+            logging.warning(f"missing logic: {cf.name}")
+
+        logging.info(f"from rgba: {name}, cf: {self.cf.name}")
+        return self
+
+    @staticmethod
+    def _check_crop(crop, cf: ColorFormat, name: str) -> bool:
+        """
+        Cropping is only done for formats that keep transparency, without
+        alpha the transparent pixels show as background and are part of
+        the image
+        """
+        if crop and cf is not None and not cf.can_crop:
+            logging.warning(f"{name}: {cf.name} has no alpha, not cropped")
+            return False
+        return crop
+
+    def _crop_rgba(self, rgba: np.ndarray) -> np.ndarray:
+        """
+        Crop to the alpha bounding box if self.crop is set, a fully
+        transparent image is cropped to its top left pixel
+        """
+        if not self.crop:
+            return rgba
+        rgba, self.ofs_x, self.ofs_y = crop_to_alpha(rgba)
+        return rgba
+
+    def _quantizer(self, cf: ColorFormat):
+        ncolors = 256 if cf is None else cf.ncolors
+        # pngquant stays the default until the builtin quantizer matches it
+        # in bench_quantize.py on both speed and error
+        return self.quantizer or PngQuant(ncolors)
+
     def _png_to_indexed(self, cf: ColorFormat, filename: str):
         # convert to palette mode
         auto_cf = cf is None
@@ -882,14 +1368,43 @@ class LVGLImage:
 
         # to preserve original palette data only convert the image if needed. For this
         # check if image has a palette and the requested palette size equals the existing one 
-        if not 'palette' in metadata or not auto_cf and len(metadata['palette']) !=  2 ** cf.bpp:
-            # reread and convert file
-            reader = png.Reader(
-                bytes=PngQuant(256 if auto_cf else cf.ncolors).convert(filename))
-            w, h, rows, _ = reader.read()
+        ncolors = 256 if auto_cf else cf.ncolors
+        quantizer = self._quantizer(cf)
+        crop = self.crop
+        # a shared palette always replaces the palette of the file
+        shared = getattr(quantizer, 'palette', None) is not None
+        if shared or not 'palette' in metadata or not auto_cf and len(metadata['palette']) !=  2 ** cf.bpp:
+            if isinstance(quantizer, PngQuant):
+                # reread and convert file
+                reader = png.Reader(bytes=quantizer.convert(filename, ncolors))
+                w, h, rows, _ = reader.read()
+                palette = reader.palette(alpha="force")
+            else:
+                # crop before quantizing, dithering may leak alpha to the border
+                rgba = self._crop_rgba(read_rgba(filename))
+                h, w, _ = rgba.shape
+                palette, rows = quantizer.quantize(rgba, ncolors)
+                crop = False
+        else:
+            palette = reader.palette(alpha="force")  # always return alpha
 
-        palette = reader.palette(alpha="force")  # always return alpha
+        self._set_indexed(cf, w, h, palette, rows, path.basename(filename),
+                          crop=crop)
 
+    def _set_indexed(self, cf: ColorFormat, w, h, palette, rows, name: str,
+                     crop=False):
+        """
+        Set data from palette of (R,G,B,A) and rows of indices, cf is chosen
+        from the palette size if it's none
+        """
+        auto_cf = cf is None
+        if crop:
+            # quantized or not, crop by the alpha of the palette colors
+            rows = np.vstack([np.asarray(row, dtype=np.uint8) for row in rows])
+            alpha = np.array([c[3] for c in palette], dtype=np.uint8)[rows]
+            x, y, w, h = mask_bbox(alpha > 0) or (0, 0, 1, 1)
+            self.ofs_x, self.ofs_y = x, y
+            rows = rows[y:y + h, x:x + w]
         palette_len = len(palette)
         if auto_cf:
             if palette_len <= 2:
@@ -904,7 +1419,7 @@ class LVGLImage:
         if palette_len != cf.ncolors:
             if not auto_cf:
                 logging.warning(
-                    f"{path.basename(filename)} palette: {palette_len}, "
+                    f"{name} palette: {palette_len}, "
                     f"extended to: {cf.ncolors}")
             palette += [(255, 255, 255, 0)] * (cf.ncolors - palette_len)
 
@@ -916,7 +1431,9 @@ class LVGLImage:
             rawdata += uint32_t((a << 24) | (r << 16) | (g << 8) | (b << 0))
 
         # pack data if not in I8 format
-        if cf == ColorFormat.I8:
+        if isinstance(rows, np.ndarray):
+            rawdata += pack_rows(rows, cf.bpp)
+        elif cf == ColorFormat.I8:
             for e in rows:
                 rawdata += e
         else:
@@ -931,18 +1448,16 @@ class LVGLImage:
         if not info['alpha']:
             raise FormatError(f"{filename} has no alpha channel")
 
-        rawdata = bytearray()
+        self._rgba_to_alpha_only(cf, self._crop_rgba(rows_to_array(rows, w, h)))
+
+    def _rgba_to_alpha_only(self, cf: ColorFormat, rgba: np.ndarray):
+        h, w, _ = rgba.shape
+        # alpha plane as a strided view, quantized and packed row by row
+        alpha = rgba[..., 3]
         if cf == ColorFormat.A8:
-            for row in rows:
-                A = row[3::4]
-                for e in A:
-                    rawdata += uint8_t(e)
+            rawdata = bytearray(alpha.tobytes())
         else:
-            shift = 8 - cf.bpp
-            mask = 2**cf.bpp - 1
-            rows = [[(a >> shift) & mask for a in row[3::4]] for row in rows]
-            for row in png.pack_rows(rows, cf.bpp):
-                rawdata += row
+            rawdata = bytearray(pack_rows(alpha >> (8 - cf.bpp), cf.bpp))
 
         self.set_data(cf, w, h, rawdata)
 
@@ -956,26 +1471,43 @@ class LVGLImage:
             return 12.92 * y
         return 1.055 * pow(y, 1 / 2.4) - 0.055
 
-    def _png_to_luma_only(self, cf: ColorFormat, filename: str):
-        reader = png.Reader(str(filename))
-        w, h, rows, info = reader.asRGBA8()
-        rawdata = bytearray()
-        for row in rows:
-            R = row[0::4]
-            G = row[1::4]
-            B = row[2::4]
-            A = row[3::4]
-            for r, g, b, a in zip(R, G, B, A):
-                r, g, b, a = color_pre_multiply(r, g, b, a, self.background)
-                r = self.sRGB_to_linear(r / 255.0)
-                g = self.sRGB_to_linear(g / 255.0)
-                b = self.sRGB_to_linear(b / 255.0)
-                luma = 0.2126 * r + 0.7152 * g + 0.0722 * b
-                rawdata += uint8_t(int(self.linear_to_sRGB(luma) * 255))
+    def _luma_tables(self):
+        """
+        Return 256-entry sRGB->linear table and LUMA_LUT_SIZE-entry
+        linear->sRGB table, built once from the exact conversions
+        """
+        if LVGLImage._luma_luts is None:
+            to_linear = np.array(
+                [self.sRGB_to_linear(v / 255.0) for v in range(256)])
+            n = LUMA_LUT_SIZE
+            to_srgb = np.array(
+                [int(self.linear_to_sRGB(i / (n - 1)) * 255) for i in range(n)],
+                dtype=np.uint8)
+            LVGLImage._luma_luts = (to_linear, to_srgb)
+        return LVGLImage._luma_luts
+
+    def _rgba_to_luma_only(self, cf: ColorFormat, rgba: np.ndarray):
+        rgba = rgba.astype(np.int32)
+        h, w, _ = rgba.shape
+
+        # blend with background, same as color_pre_multiply
+        a = rgba[..., 3:4]
+        background = np.array([(self.background >> 16) & 0xff,
+                               (self.background >> 8) & 0xff,
+                               self.background & 0xff], dtype=np.int32)
+        rgb = (rgba[..., :3] * a + (255 - a) * background) >> 8
+
+        to_linear, to_srgb = self._luma_tables()
+        linear = to_linear[rgb]
+        luma = (0.2126 * linear[..., 0] + 0.7152 * linear[..., 1] +
+                0.0722 * linear[..., 2])
+        index = np.clip(np.rint(luma * (LUMA_LUT_SIZE - 1)), 0,
+                        LUMA_LUT_SIZE - 1).astype(np.int32)
+        rawdata = bytearray(to_srgb[index].tobytes())
 
         self.set_data(ColorFormat.L8, w, h, rawdata)
 
-    def _png_to_colormap(self, cf, filename: str):
+    def _rgba_to_colormap(self, cf, rgba: np.ndarray):
 
         if cf == ColorFormat.ARGB8888:
 
@@ -1017,11 +1549,10 @@ class LVGLImage:
         else:
             raise FormatError(f"Invalid color format: {cf.name}")
 
-        reader = png.Reader(str(filename))
-        w, h, rows, _ = reader.asRGBA8()
+        h, w, _ = rgba.shape
         rawdata = bytearray()
         alpha = bytearray()
-        for y, row in enumerate(rows):
+        for y, row in enumerate(rgba.reshape(h, w * 4).tolist()):
             R = row[0::4]
             G = row[1::4]
             B = row[2::4]
@@ -1248,10 +1779,213 @@ class OutputFormat(Enum):
     C_ARRAY = "C"
     BIN_FILE = "BIN"
     PNG_FILE = "PNG"  # convert to lvgl image and then to png
+    ASSET_PACK = "PACK"  # all images in one blob with a C/JSON index
+
+
+class AssetPack:
+    """
+    Concatenate LVGL bin images (header + data, compressed or not) into one
+    blob for a flash partition. Every asset starts at a multiple of `align`
+    bytes. The index maps name to offset/size/cf/w/h and is written as JSON
+    and as a C header, so the device can mmap or seek to assets directly.
+    """
+
+    # columns of the C index table, missing values are written as 0.
+    # x, y is the position of a sprite in the atlas image at offset,
+    # ofs_x, ofs_y is where the image is drawn, e.g. a frame of animation.
+    C_FIELDS = [("name", "const char *"), ("cf", "lv_color_format_t"),
+                ("offset", "uint32_t"), ("size", "uint32_t"),
+                ("x", "uint16_t"), ("y", "uint16_t"),
+                ("w", "uint16_t"), ("h", "uint16_t"),
+                ("ofs_x", "uint16_t"), ("ofs_y", "uint16_t")]
+
+    def __init__(self, align: int = 4, extra_fields: List = ()) -> None:
+        """
+        extra_fields: (key, ctype) columns added to the C index
+        """
+        if align < 1:
+            raise ParameterError(f"Invalid pack align: {align}")
+        self.align = align
+        self.fields = self.C_FIELDS + list(extra_fields)
+        self.blob = bytearray()
+        self.entries = []
+        self._names = set()
+
+    def _add_name(self, name: str):
+        if name in self._names:
+            raise ParameterError(f"duplicated asset name: {name}")
+        self._names.add(name)
+
+    def add(self, name: str, data: bytes, cf: ColorFormat, **info) -> dict:
+        self._add_name(name)
+        self.blob += b'\x00' * (-len(self.blob) % self.align)
+        entry = {"name": name, "offset": len(self.blob), "size": len(data),
+                 "cf": cf.name, **info}
+        self.blob += data
+        self.entries.append(entry)
+        return entry
+
+    def add_image(self,
+                  name: str,
+                  img: "LVGLImage",
+                  compress: CompressMethod = CompressMethod.NONE,
+                  palette: bool = True,
+                  **info) -> dict:
+        info = {"ofs_x": img.ofs_x, "ofs_y": img.ofs_y, **info}
+        return self.add(name, img.bin_data(compress, palette), img.cf,
+                        w=img.w, h=img.h, **info)
+
+    def add_sprite(self, name: str, atlas: dict, x, y, w, h, **info) -> dict:
+        """
+        Index a rectangle of an atlas image added before, no data is added
+        """
+        self._add_name(name)
+        entry = {"name": name, "offset": atlas["offset"],
+                 "size": atlas["size"], "cf": atlas["cf"], "atlas": atlas["name"],
+                 "x": x, "y": y, "w": w, "h": h, **info}
+        self.entries.append(entry)
+        return entry
+
+    def write(self, filename: str, **meta):
+        """
+        Write filename.bin, filename.json and filename.h. meta is added to
+        the JSON index, integers also as macros in the C index.
+        """
+        base, _ = path.splitext(filename)
+        dir = path.dirname(base)
+        if dir and not path.exists(dir):
+            os.makedirs(dir)
+
+        with open(base + ".bin", "wb") as f:
+            f.write(self.blob)
+        with open(base + ".json", "w") as f:
+            json.dump({"align": self.align, "size": len(self.blob), **meta,
+                       "assets": self.entries}, f, indent=2)
+        defines = {"SIZE": len(self.blob)}
+        defines.update((k.upper(), v) for k, v in meta.items()
+                       if isinstance(v, int))
+        write_c_index_file(base + ".h", self.fields, self.entries, defines)
+
+
+def write_c_index_file(filename: str, fields: List, entries: List[dict],
+                       defines: dict = None):
+    """
+    Write entries as a static C table in a header file. fields is a list of
+    (key, ctype); "const char *" values are quoted, lv_color_format_t values
+    are color format names, other missing values are written as 0.
+    """
+    varname = path.basename(filename).split('.')[0]
+    varname = varname.replace("-", "_")
+    guard = varname.upper() + "_H"
+
+    def value(entry, key, ctype):
+        if ctype == "const char *":
+            return f'"{entry.get(key, "")}"'
+        if ctype == "lv_color_format_t":
+            return f"LV_COLOR_FORMAT_{entry.get(key, 'UNKNOWN')}"
+        return str(int(entry.get(key, 0)))
+
+    members = "".join(f"    {ctype}{'' if ctype.endswith('*') else ' '}{key};\n"
+                      for key, ctype in fields)
+    rows = "".join(
+        "    {" + ", ".join(value(e, key, ctype) for key, ctype in fields) + "},\n"
+        for e in entries)
+    defines = {"COUNT": len(entries), **(defines or {})}
+    macros = "".join(f"#define {varname.upper()}_{k} {v}\n" for k, v in defines.items())
+
+    with open(filename, "w") as f:
+        f.write(f'''
+#ifndef {guard}
+#define {guard}
+
+#if defined(LV_LVGL_H_INCLUDE_SIMPLE)
+#include "lvgl.h"
+#else
+#include "lvgl/lvgl.h"
+#endif
+
+typedef struct {{
+{members}}} {varname}_entry_t;
+
+static const {varname}_entry_t {varname}_index[] = {{
+{rows}}};
+
+{macros}
+#endif /* {guard} */
+''')
+
+
+class SpriteAtlas:
+    """
+    Pack many small images into a few atlas images of at most
+    max_size x max_size pixels. Images are sorted by height and placed on
+    shelves left to right, a new atlas is started when one is full.
+    Images larger than max_size are left out.
+    """
+
+    def __init__(self, max_size: int = 512) -> None:
+        if max_size < 1:
+            raise ParameterError(f"Invalid atlas size: {max_size}")
+        self.max_size = max_size
+
+    def layout(self, sizes: List) -> List:
+        """
+        Place (w, h) sizes, return (atlas index, x, y) for each of them or
+        None if it doesn't fit in any atlas
+        """
+        order = sorted(range(len(sizes)),
+                       key=lambda i: (-sizes[i][1], -sizes[i][0]))
+        places = [None] * len(sizes)
+        atlas, x, y, shelf_h = -1, 0, 0, 0
+        for i in order:
+            w, h = sizes[i]
+            if w > self.max_size or h > self.max_size:
+                continue
+            if atlas < 0 or x + w > self.max_size:  # next shelf
+                x, y, shelf_h = 0, y + shelf_h, h
+            if atlas < 0 or y + h > self.max_size:  # next atlas
+                atlas, x, y, shelf_h = atlas + 1, 0, 0, h
+            places[i] = (atlas, x, y)
+            x += w
+        return places
+
+    def pack(self, images: List[np.ndarray]):
+        """
+        Pack h x w x 4 RGBA arrays, return the atlas RGBA arrays (cropped to
+        the used area) and (atlas index, x, y, w, h) per image, None for
+        images that are too large.
+        """
+        sizes = [(img.shape[1], img.shape[0]) for img in images]
+        places = self.layout(sizes)
+        natlas = max((p[0] + 1 for p in places if p), default=0)
+        extent = [[0, 0] for _ in range(natlas)]
+        for (w, h), place in zip(sizes, places):
+            if place:
+                a, x, y = place
+                extent[a][0] = max(extent[a][0], x + w)
+                extent[a][1] = max(extent[a][1], y + h)
+
+        atlases = [np.zeros((h, w, 4), dtype=np.uint8) for w, h in extent]
+        rects = []
+        for img, (w, h), place in zip(images, sizes, places):
+            if place is None:
+                rects.append(None)
+                continue
+            a, x, y = place
+            atlases[a][y:y + h, x:x + w] = img
+            rects.append((a, x, y, w, h))
+        return atlases, rects
 
 
 class PNGConverter:
 
+    # columns of atlas.h, sprite rectangle in the atlas image and its
+    # position in the source image when cropped
+    ATLAS_FIELDS = [("name", "const char *"), ("atlas", "const char *"),
+                    ("x", "uint16_t"), ("y", "uint16_t"),
+                    ("w", "uint16_t"), ("h", "uint16_t"),
+                    ("ofs_x", "uint16_t"), ("ofs_y", "uint16_t")]
+
     def __init__(self,
                  files: List,
                  cf: ColorFormat,
@@ -1262,18 +1996,81 @@ class PNGConverter:
                  premultiply: bool = False,
                  compress: CompressMethod = CompressMethod.NONE,
                  keep_folder=True,
-                 rgb565_dither=False) -> None:
+                 rgb565_dither=False,
+                 quantizer=None,
+                 shared_palette: int = 0,
+                 external_palette: bool = False,
+                 pack_name: str = "assets",
+                 pack_align: int = 4,
+                 atlas_size: int = 0,
+                 crop: bool = False) -> None:
+        """
+        shared_palette: for indexed formats, 0 gives every image its own
+        palette, 1 uses one palette for all images, N groups similar images
+        into N clusters that share a palette each.
+        external_palette: leave the shared palette out of image data and write
+        it once to palette_<n> files.
+        pack_name, pack_align: file name and asset alignment in bytes of the
+        blob written for OutputFormat.ASSET_PACK.
+        atlas_size: pack images into atlas images of at most this size in
+        pixels, one set of atlases per color format. 0 converts every image
+        separately.
+        crop: convert only the bounding box of the pixels that are not fully
+        transparent. The offsets are in crop.json, the asset pack or atlas
+        index, and in the C file as <name>_ofs.
+        """
         self.files = files
         self.cf = cf
         self.ofmt = ofmt
         self.output = odir
-        self.pngquant = None
+        self.quantizer = quantizer
         self.keep_folder = keep_folder
         self.align = align
         self.premultiply = premultiply
         self.compress = compress
         self.background = background
         self.rgb565_dither = rgb565_dither
+        self.shared_palette = shared_palette
+        self.external_palette = external_palette
+        self.pack_name = pack_name
+        self.pack_align = pack_align
+        self.atlas_size = atlas_size
+        self.crop = crop
+
+    def _palette_quantizers(self):
+        """
+        Build the shared palettes, return quantizer and palette id per file
+        """
+        if isinstance(self.quantizer, PngQuant):
+            raise ParameterError("shared palette needs the builtin quantizer")
+        base = self.quantizer or PaletteQuantizer()
+        ncolors = 256 if self.cf is None else self.cf.ncolors
+
+        images = [read_rgba(f) for f in self.files]
+        labels = cluster_images(images, self.shared_palette)
+        quantizers = {}
+        for label in sorted(set(labels)):
+            group = [img for img, l in zip(images, labels) if l == label]
+            quantizers[label] = PaletteQuantizer(
+                ncolors, base.dither, base.kmeans_iter,
+                base.sample_pixels).fit(group)
+            logging.info(f"palette_{label}: {len(group)} images, "
+                         f"{len(quantizers[label].palette)} colors")
+        return [quantizers[l] for l in labels], labels
+
+    def _write_palettes(self, palettes, labels):
+        index = {}
+        for label, palette in palettes.items():
+            name = f"palette_{label}"
+            if self.ofmt == OutputFormat.C_ARRAY:
+                write_palette_c_file(path.join(self.output, name + ".c"), palette)
+            else:
+                with open(path.join(self.output, name + ".bin"), "wb") as f:
+                    f.write(palette)
+            index[name] = [self._asset_name(f)
+                           for f, l in zip(self.files, labels) if l == label]
+        with open(path.join(self.output, "palettes.json"), "w") as f:
+            json.dump(index, f, indent=2)
 
     def _replace_ext(self, input, ext):
         if self.keep_folder:
@@ -1284,38 +2081,161 @@ class PNGConverter:
         output = path.join(self.output, output)
         return output
 
+    def _asset_name(self, input):
+        return Path(path.relpath(self._replace_ext(str(input), ""),
+                                 self.output)).as_posix()
+
+    def _finish(self, img):
+        img.adjust_stride(align=self.align)
+        if self.premultiply:
+            img.premultiply()
+        return img
+
+    def _write_image(self, output, img, pack=None, palette=True):
+        """
+        Write img to output (without extension) in self.ofmt, or add it to
+        the asset pack. Return the pack entry if it's added to pack.
+        """
+        if self.ofmt == OutputFormat.BIN_FILE:
+            img.to_bin(output + ".bin", compress=self.compress, palette=palette)
+        elif self.ofmt == OutputFormat.C_ARRAY:
+            img.to_c_array(output + ".c", compress=self.compress, palette=palette)
+        elif self.ofmt == OutputFormat.PNG_FILE:
+            img.to_png(output + ".png")
+        elif self.ofmt == OutputFormat.ASSET_PACK:
+            name = Path(path.relpath(output, self.output)).as_posix()
+            return pack.add_image(name, img, compress=self.compress,
+                                  palette=palette)
+        return None
+
+    def _convert_atlas(self, pack):
+        """
+        Pack the images into atlases, one set of atlases per color format.
+        Sprite rectangles are added to the pack index, or written to
+        atlas.json and atlas.h for other output formats.
+        """
+        if self.shared_palette:
+            raise ParameterError("atlas can't be used with shared palette")
+        if self.cf in (ColorFormat.RAW, ColorFormat.RAW_ALPHA):
+            raise ParameterError(f"atlas not supported for {self.cf.name}")
+
+        groups = {}
+        for f in self.files:
+            cf = self.cf or cf_from_filename(f)
+            groups.setdefault(cf, []).append(f)
+
+        output = []
+        sprites = []
+        packer = SpriteAtlas(self.atlas_size)
+        for cf, files in groups.items():
+            prefix = f"atlas_{cf.name if cf else 'AUTO'}_"
+            images = [read_rgba(f) for f in files]
+            offsets = [(0, 0)] * len(files)
+            if self.crop and (cf is None or cf.can_crop):
+                cropped = [crop_to_alpha(img) for img in images]
+                images = [img for img, _, _ in cropped]
+                offsets = [(x, y) for _, x, y in cropped]
+            atlases, rects = packer.pack(images)
+            entries = []
+            for n, rgba in enumerate(atlases):
+                name = prefix + str(n)
+                img = self._finish(LVGLImage().from_rgba(
+                    rgba, cf, background=self.background,
+                    rgb565_dither=self.rgb565_dither,
+                    quantizer=self.quantizer, name=name))
+                output.append((name, img))
+                entries.append(self._write_image(path.join(self.output, name),
+                                                 img, pack))
+                logging.info(f"{name}: {img.w}x{img.h}, "
+                             f"{sum(r is not None and r[0] == n for r in rects)} sprites")
+
+            for f, rect, (ofs_x, ofs_y) in zip(files, rects, offsets):
+                if rect is None:
+                    logging.warning(f"{f} is larger than atlas size, "
+                                    f"converted separately")
+                    img = self._finish(LVGLImage().from_png(
+                        f, self.cf, background=self.background,
+                        rgb565_dither=self.rgb565_dither,
+                        quantizer=self.quantizer, crop=self.crop))
+                    output.append((f, img))
+                    self._write_image(self._replace_ext(f, ""), img, pack)
+                    continue
+                n, x, y, w, h = rect
+                name = self._asset_name(f)
+                if pack is not None:
+                    pack.add_sprite(name, entries[n], x, y, w, h,
+                                    ofs_x=ofs_x, ofs_y=ofs_y)
+                else:
+                    sprites.append({"name": name, "atlas": prefix + str(n),
+                                    "x": x, "y": y, "w": w, "h": h,
+                                    "ofs_x": ofs_x, "ofs_y": ofs_y})
+
+        if pack is None:
+            with open(path.join(self.output, "atlas.json"), "w") as f:
+                json.dump(sprites, f, indent=2)
+            write_c_index_file(path.join(self.output, "atlas.h"),
+                               self.ATLAS_FIELDS, sprites)
+        return output
+
     def convert(self):
+        pack = None
+        if self.ofmt == OutputFormat.ASSET_PACK:
+            pack = AssetPack(self.pack_align)
+        if self.atlas_size:
+            if not path.exists(self.output):
+                os.makedirs(self.output)
+            output = self._convert_atlas(pack)
+            if pack is not None:
+                pack.write(path.join(self.output, self.pack_name))
+            return output
+
         output = []
-        for f in self.files:
+        quantizers, labels = [self.quantizer] * len(self.files), None
+        shared = self.shared_palette and (self.cf is None or self.cf.is_indexed)
+        if shared:
+            quantizers, labels = self._palette_quantizers()
+        palettes = {}
+
+        for i, f in enumerate(self.files):
             if self.cf in (ColorFormat.RAW, ColorFormat.RAW_ALPHA):
                 # Process RAW image explicitly
                 img = RAWImage().from_file(f, self.cf)
                 img.to_c_array(self._replace_ext(f, ".c"))
             else:
-                img = LVGLImage().from_png(f, self.cf, background=self.background, rgb565_dither=self.rgb565_dither)
-                img.adjust_stride(align=self.align)
-
-                if self.premultiply:
-                    img.premultiply()
+                img = LVGLImage().from_png(f, self.cf, background=self.background, rgb565_dither=self.rgb565_dither,
+                                           quantizer=quantizers[i], crop=self.crop)
+                self._finish(img)
                 output.append((f, img))
-                if self.ofmt == OutputFormat.BIN_FILE:
-                    img.to_bin(self._replace_ext(f, ".bin"),
-                               compress=self.compress)
-                elif self.ofmt == OutputFormat.C_ARRAY:
-                    img.to_c_array(self._replace_ext(f, ".c"),
-                                   compress=self.compress)
-                elif self.ofmt == OutputFormat.PNG_FILE:
-                    img.to_png(self._replace_ext(f, ".png"))
+                if shared:
+                    palettes.setdefault(labels[i], img.palette)
+                inline_palette = not (shared and self.external_palette)
+                self._write_image(self._replace_ext(f, ""), img, pack,
+                                  inline_palette)
+
+        if shared and self.ofmt != OutputFormat.PNG_FILE:
+            self._write_palettes(palettes, labels)
+        if pack is not None:
+            pack.write(path.join(self.output, self.pack_name))
+        elif self.crop:
+            self._write_crop_index(output)
 
         return output
 
+    def _write_crop_index(self, output):
+        index = {self._asset_name(f): {"ofs_x": img.ofs_x, "ofs_y": img.ofs_y,
+                                       "w": img.w, "h": img.h}
+                 for f, img in output}
+        with open(path.join(self.output, "crop.json"), "w") as f:
+            json.dump(index, f, indent=2)
+
 
 def main():
     parser = argparse.ArgumentParser(description='LVGL PNG to bin image tool.')
     parser.add_argument('--ofmt',
-                        help="output filename format, C or BIN",
+                        help=("output filename format, C or BIN, PACK puts all "
+                              "images in one blob with a C/JSON index"),
                         default="BIN",
-                        choices=["C", "BIN", "PNG"])
+                        choices=["C", "BIN", "PNG", "PACK"])
     parser.add_argument(
         '--cf',
         help=("bin image color format, use AUTO for automatically "
@@ -1330,6 +2250,31 @@ def main():
     parser.add_argument('--rgb565dither', action='store_true',
                         help="use dithering to correct banding in gradients", default=False)
 
+    parser.add_argument('--quantizer',
+                        help=("palette quantizer for indexed formats, builtin "
+                              "runs in-process, pngquant needs the tool in PATH "
+                              "(default: pngquant, builtin with --shared-palette)"),
+                        default=None,
+                        choices=["builtin", "pngquant"])
+
+    parser.add_argument('--nodither', action='store_true',
+                        help="disable Floyd-Steinberg dithering for indexed formats",
+                        default=False)
+
+    parser.add_argument('--shared-palette',
+                        help=("use one palette for all indexed images, or "
+                              "N palettes for N clusters of similar images"),
+                        default=0,
+                        type=int,
+                        const=1,
+                        metavar='N',
+                        nargs='?')
+
+    parser.add_argument('--external-palette', action='store_true',
+                        help=("leave the shared palette out of image data, "
+                              "write it once to palette_<n> files"),
+                        default=False)
+
     parser.add_argument('--premultiply', action='store_true',
                         help="pre-multiply color with alpha", default=False)
 
@@ -1344,6 +2289,29 @@ def main():
                         type=int,
                         metavar='byte',
                         nargs='?')
+    parser.add_argument('--pack-name',
+                        help="file name of the asset pack, default to assets",
+                        default="assets")
+    parser.add_argument('--pack-align',
+                        help="alignment in bytes of each image in asset pack",
+                        default=4,
+                        type=int,
+                        metavar='byte')
+    parser.add_argument('--atlas',
+                        help=("pack images into atlas images of at most "
+                              "SIZE x SIZE pixels, with the sprite rectangles "
+                              "in atlas.json/atlas.h or the asset pack index"),
+                        default=0,
+                        type=int,
+                        const=512,
+                        metavar='SIZE',
+                        nargs='?')
+    parser.add_argument('--crop', action='store_true',
+                        help=("convert only the bounding box of the pixels "
+                              "that are not fully transparent, offsets are "
+                              "written to the index. Ignored for formats "
+                              "without alpha"),
+                        default=False)
     parser.add_argument('--background',
                         help="Background color for formats without alpha",
                         default=0x00_00_00,
@@ -1380,6 +2348,13 @@ def main():
     ofmt = OutputFormat(args.ofmt) if cf not in (
         ColorFormat.RAW, ColorFormat.RAW_ALPHA) else OutputFormat.C_ARRAY
     compress = CompressMethod[args.compress]
+    if args.quantizer is None:
+        # shared palettes are only built by the builtin quantizer
+        args.quantizer = "builtin" if args.shared_palette else "pngquant"
+    if args.quantizer == "pngquant":
+        quantizer = PngQuant(dither=not args.nodither)
+    else:
+        quantizer = PaletteQuantizer(dither=not args.nodither)
 
     converter = PNGConverter(files,
                              cf,
@@ -1390,7 +2365,14 @@ def main():
                              premultiply=args.premultiply,
                              compress=compress,
                              keep_folder=False,
-                             rgb565_dither=args.rgb565dither)
+                             rgb565_dither=args.rgb565dither,
+                             quantizer=quantizer,
+                             shared_palette=args.shared_palette,
+                             external_palette=args.external_palette,
+                             pack_name=args.pack_name,
+                             pack_align=args.pack_align,
+                             atlas_size=args.atlas,
+                             crop=args.crop)
     output = converter.convert()
     for f, img in output:
         logging.info(f"len: {img.data_len} for {path.basename(f)} ")
@@ -1412,6 +2394,54 @@ def test():
     img.to_png("output/cogwheel.ARGB8565.png.png")  # convert back to png
 
 
+def test_luma():
+    """
+    L8 conversion with lookup tables must be within one LSB of the exact
+    per-pixel conversion
+    """
+    img = LVGLImage()
+    to_linear, to_srgb = img._luma_tables()
+
+    def exact(r, g, b):
+        r = img.sRGB_to_linear(r / 255.0)
+        g = img.sRGB_to_linear(g / 255.0)
+        b = img.sRGB_to_linear(b / 255.0)
+        luma = 0.2126 * r + 0.7152 * g + 0.0722 * b
+        return int(img.linear_to_sRGB(luma) * 255)
+
+    # the result only depends on luma, so check the table over the whole
+    # luma range that 8bit RGB can produce: every grid point and midpoint
+    n = LUMA_LUT_SIZE
+    for i in range(2 * n - 1):
+        luma = i / (2 * (n - 1))
+        expected = int(img.linear_to_sRGB(luma) * 255)
+        got = int(to_srgb[int(np.rint(luma * (n - 1)))])
+        assert abs(got - expected) <= 1, (luma, got, expected)
+
+    # and all gray levels plus random colors through the real code path
+    rng = np.random.default_rng(0)
+    colors = np.concatenate([
+        np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1),
+        rng.integers(0, 256, (20000, 3), dtype=np.uint8)])
+    alpha = np.concatenate([np.full(256, 255, dtype=np.uint8),
+                            rng.integers(0, 256, 20000, dtype=np.uint8)])
+    rgba = np.concatenate([colors, alpha[:, None]], axis=1)[None, :, :]
+    filename = "output/test_luma.png"
+    img._check_dir(filename)
+    with open(filename, "wb") as f:
+        png.Writer(rgba.shape[1], 1, greyscale=False, alpha=True).write_array(
+            f, rgba.ravel().tolist())
+
+    background = 0x20_80_F0
+    img.from_png(filename, ColorFormat.L8, background=background)
+    worst = 0
+    for (r, g, b, a), got in zip(rgba[0].tolist(), img.data):
+        r, g, b, a = color_pre_multiply(r, g, b, a, background)
+        worst = max(worst, abs(got - exact(r, g, b)))
+    assert worst <= 1, worst
+    print(f"luma max error: {worst} LSB")
+
+
 def test_raw():
     logging.basicConfig(level=logging.INFO)
     f = "pngs/cogwheel.RGB565A8.png"
@@ -1423,4 +2453,5 @@ def test_raw():
 if __name__ == "__main__":
     # test()
     # test_raw()
+    # test_luma()
     main()
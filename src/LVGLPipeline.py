@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# Decode every source image once and generate all sizes x color formats x
+# compress methods from it in one pass. Sizes come from a resolution
+# pyramid of successive downscales, the time of every target is reported.
+#
+# usage:
+#   python LVGLPipeline.py [--sizes 128x128,64x64,32x32] [--cf AUTO,RGB565]
+#       [--compress NONE,RLE] [--ofmt C|BIN|PNG] [--cache DIR] [-o output]
+#       <image or folder>...
+import os
+import time
+import hashlib
+import tempfile
+import logging
+import argparse
+from os import path
+from pathlib import Path
+
+import numpy as np
+
+from LVGLImage import (LVGLImage, ColorFormat, CompressMethod, OutputFormat,
+                       ParameterError)
+
+try:
+    from PIL import Image
+except ImportError:
+    raise ImportError("Need pillow package, do `pip3 install pillow`")
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".bmp", ".gif")
+# JPEG is decoded at reduced scale but at least this many times the target
+# size, so LANCZOS still has enough pixels to filter
+DRAFT_OVERSAMPLE = 2
+# change to invalidate cached images when the resize method changes
+CACHE_VERSION = b"1"
+# resize cache used by the GUIs
+DEFAULT_CACHE_DIR = path.join(tempfile.gettempdir(), "lvgl_resize_cache")
+
+
+def parse_size(text: str):
+    """
+    "64x64" -> (64, 64)
+    """
+    try:
+        w, h = map(int, text.lower().split("x"))
+    except ValueError:
+        raise ParameterError(f"invalid size: {text}")
+    return w, h
+
+
+def has_alpha(img) -> bool:
+    return img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+
+
+def open_image(filename, size=None):
+    """
+    Open and decode an image. A JPEG much larger than size is decoded at a
+    reduced scale (1/2, 1/4 or 1/8 by the JPEG decoder), which is several
+    times faster than decoding at full resolution and resizing.
+    """
+    img = Image.open(filename)
+    if size and img.format == "JPEG":
+        img.draft(img.mode, (size[0] * DRAFT_OVERSAMPLE,
+                             size[1] * DRAFT_OVERSAMPLE))
+    img.load()
+    return img
+
+
+class ResizeCache:
+    """
+    On-disk cache of resized images keyed by the hash of the source file
+    and the target size, stored as png in cache_dir
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def source_key(filename) -> str:
+        sha = hashlib.sha1(CACHE_VERSION)
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def _path(self, key, size):
+        return path.join(self.cache_dir, f"{key}_{size[0]}x{size[1]}.png")
+
+    def get(self, key, size):
+        try:
+            with Image.open(self._path(key, size)) as img:
+                img.load()
+                return img
+        except (OSError, SyntaxError):  # missing or broken entry
+            return None
+
+    def put(self, key, size, img):
+        filename = self._path(key, size)
+        temp = f"{filename}.{os.getpid()}.tmp"
+        img.save(temp, "PNG")
+        os.replace(temp, filename)
+
+
+def load_resized(filename, size, cache: ResizeCache = None):
+    """
+    Return filename resized to size in RGBA or RGB mode, from cache if
+    it's there
+    """
+    key = cache.source_key(filename) if cache else None
+    img = cache.get(key, size) if key else None
+    if img is None:
+        img = open_image(filename, size)
+        img = img.convert('RGBA' if has_alpha(img) else 'RGB')
+        img = img.resize(size, Image.Resampling.LANCZOS)
+        if key:
+            cache.put(key, size, img)
+    return img
+
+
+def build_pyramid(img, sizes):
+    """
+    Resize img to every (w, h) in sizes, return {size: image}. Sizes are
+    made from large to small, each one from the previous level when it's
+    large enough, so the full resolution source is resized only once.
+    """
+    levels = {}
+    current = img
+    for size in sorted(set(sizes), key=lambda s: s[0] * s[1], reverse=True):
+        if current.size == size:
+            levels[size] = current
+            continue
+        source = current
+        if current.width < size[0] or current.height < size[1]:
+            source = img
+        levels[size] = current = source.resize(size, Image.Resampling.LANCZOS)
+    return levels
+
+
+class MultiTargetConverter:
+    """
+    Convert images to every combination of sizes, color formats and
+    compress methods. cf None picks RGB565A8 for images with alpha and
+    RGB565 for the others. Output is named <name>, followed by size, color
+    format and compress method for the parts that have more than one value.
+    """
+
+    def __init__(self,
+                 sizes,
+                 cfs,
+                 compresses=(CompressMethod.NONE,),
+                 ofmt: OutputFormat = OutputFormat.C_ARRAY,
+                 odir: str = "output",
+                 save_png: bool = False,
+                 cache_dir: str = None) -> None:
+        """
+        save_png: also save every resized image as <name>_<w>x<h>.png
+        cache_dir: keep resized images there, later runs with the same
+        source and size skip decoding and resizing
+        """
+        if ofmt not in (OutputFormat.C_ARRAY, OutputFormat.BIN_FILE,
+                        OutputFormat.PNG_FILE):
+            raise ParameterError(f"unsupported output format: {ofmt.name}")
+        self.sizes = list(sizes)
+        self.cfs = list(cfs)
+        # compress doesn't apply to png output
+        self.compresses = list(compresses) if ofmt != OutputFormat.PNG_FILE \
+            else [CompressMethod.NONE]
+        self.ofmt = ofmt
+        self.output = odir
+        self.save_png = save_png
+        self.cache = ResizeCache(cache_dir) if cache_dir else None
+
+    def _output_name(self, name, size, cf, compress):
+        parts = [name]
+        if len(self.sizes) > 1:
+            parts.append(f"{size[0]}x{size[1]}")
+        if len(self.cfs) > 1:
+            parts.append(cf.name if cf else "AUTO")
+        if len(self.compresses) > 1:
+            parts.append(compress.name)
+        return path.join(self.output, "_".join(parts))
+
+    def convert(self, filename, name: str = None):
+        """
+        Convert one image to all targets, return a list of dict with the
+        output filename and the time spent in ms. decode (including cache
+        lookup) and resize time is shared by all targets of a source.
+        """
+        if name is None:
+            name = path.splitext(path.basename(filename))[0]
+        os.makedirs(self.output, exist_ok=True)
+
+        start = time.perf_counter()
+        key = self.cache.source_key(filename) if self.cache else None
+        levels = {}
+        for size in self.sizes if key else []:
+            cached = self.cache.get(key, size)
+            if cached is not None:
+                levels[size] = cached
+        missing = [s for s in self.sizes if s not in levels]
+
+        resize_ms = 0.0
+        if missing:
+            # decode at reduced scale for the largest size still needed
+            img = open_image(filename, max(missing, key=lambda s: s[0] * s[1]))
+            img = img.convert('RGBA' if has_alpha(img) else 'RGB')
+            decode_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            resized = build_pyramid(img, missing)
+            resize_ms = (time.perf_counter() - start) * 1000
+            levels.update(resized)
+            for size in missing if key else []:
+                self.cache.put(key, size, resized[size])
+        else:
+            decode_ms = (time.perf_counter() - start) * 1000
+
+        results = []
+        for size in self.sizes:
+            level = levels[size]
+            alpha = level.mode == 'RGBA'
+            if self.save_png:
+                level.save(path.join(self.output, f"{name}_{size[0]}x{size[1]}.png"))
+            rgba = np.asarray(level.convert('RGBA'))
+            opaque = None
+            for target_cf in self.cfs:
+                cf = target_cf
+                if cf is None:
+                    cf = ColorFormat.RGB565A8 if alpha else ColorFormat.RGB565
+                start = time.perf_counter()
+                source = rgba
+                if alpha and not cf.has_alpha:
+                    # drop alpha and keep the original colors like the GUI
+                    # always did, instead of blending onto the background
+                    if opaque is None:
+                        opaque = np.asarray(level.convert('RGB').convert('RGBA'))
+                    source = opaque
+                lvgl_img = LVGLImage().from_rgba(source, cf, name=name)
+                convert_ms = (time.perf_counter() - start) * 1000
+
+                for compress in self.compresses:
+                    output = self._output_name(name, size, target_cf, compress)
+                    start = time.perf_counter()
+                    if self.ofmt == OutputFormat.C_ARRAY:
+                        output += ".c"
+                        lvgl_img.to_c_array(output, compress=compress)
+                    elif self.ofmt == OutputFormat.BIN_FILE:
+                        output += ".bin"
+                        lvgl_img.to_bin(output, compress=compress)
+                    else:
+                        output += ".png"
+                        lvgl_img.to_png(output)
+                    write_ms = (time.perf_counter() - start) * 1000
+                    results.append({
+                        "source": str(filename), "output": output,
+                        "size": size, "cf": cf.name, "compress": compress.name,
+                        "cached": size not in missing,
+                        "decode_ms": decode_ms, "resize_ms": resize_ms,
+                        "convert_ms": convert_ms, "write_ms": write_ms,
+                    })
+        return results
+
+
+def _collect_files(inputs):
+    for name in inputs:
+        if path.isdir(name):
+            for f in sorted(Path(name).rglob("*")):
+                if f.suffix.lower() in IMAGE_EXTS:
+                    yield str(f)
+        else:
+            yield name
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert images to several sizes and color formats at once.')
+    parser.add_argument('--sizes', default="128x128,64x64,32x32",
+                        help="comma separated sizes (default: 128x128,64x64,32x32)")
+    parser.add_argument('--cf', default="AUTO",
+                        help="comma separated color formats, AUTO picks "
+                             "RGB565A8 or RGB565 by alpha (default: AUTO)")
+    parser.add_argument('--compress', default="NONE",
+                        help="comma separated compress methods of NONE, RLE, LZ4")
+    parser.add_argument('--ofmt', default="C", choices=["C", "BIN", "PNG"])
+    parser.add_argument('--cache', default=None, metavar='DIR',
+                        help="keep resized images in DIR to skip decoding "
+                             "and resizing in later runs")
+    parser.add_argument('-o', '--output', default="./output",
+                        help="Select the output folder, default to ./output")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('inputs', nargs='+', help="image files or folders")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    cfs = [None if c == "AUTO" else ColorFormat[c] for c in args.cf.split(",")]
+    compresses = [CompressMethod[c] for c in args.compress.split(",")]
+    converter = MultiTargetConverter(sizes, cfs, compresses,
+                                     OutputFormat(args.ofmt), args.output,
+                                     cache_dir=args.cache)
+
+    total = time.perf_counter()
+    count = 0
+    for f in _collect_files(args.inputs):
+        results = converter.convert(f)
+        count += 1
+        r = results[0]
+        print(f"{path.basename(f)}: decode {r['decode_ms']:.1f}ms, "
+              f"resize {r['resize_ms']:.1f}ms"
+              f"{', cached' if all(r['cached'] for r in results) else ''}")
+        for r in results:
+            print(f"    {r['size'][0]}x{r['size'][1]:<4} {r['cf']:9} "
+                  f"{r['compress']:5} convert {r['convert_ms']:7.1f}ms "
+                  f"write {r['write_ms']:6.1f}ms  {path.basename(r['output'])}")
+    print(f"done {count} files in {time.perf_counter() - total:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+# 可取消、可断点续传的批量转换
+# 每个完成的文件追加记录到输出目录下的日志文件(.batch_journal.jsonl)，
+# 中途取消、关闭或崩溃后重新运行同样的任务，会跳过已经完成的文件。
+# 输出先写到输出目录下的临时子目录，成功后再逐个改名到输出目录，
+# 写了一半的文件不会出现在输出目录里。
+#
+# 用法:
+#   python batch_job.py [--mode audio_to_p3|p3_to_audio] [-l LUFS] [-d]
+#       [--restart] [-o output] <文件或目录>...
+#   转换中按Ctrl+C取消，当前文件转完后退出，再次运行同样的命令继续。
+#   在终端中输入 p 回车暂停、r 回车继续、q 回车取消；
+#   也可以用 kill -USR1 暂停、kill -USR2 继续（不支持Windows）
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import signal
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import (ThreadPoolExecutor, FIRST_COMPLETED, wait)
+
+JOURNAL_NAME = ".batch_journal.jsonl"
+STAGING_PREFIX = ".partial-"
+# 无法判断创建者进程是否存在时（Windows），超过这个时间的临时目录才算遗留的
+STALE_STAGING_SECONDS = 24 * 3600
+
+
+def _process_alive(pid):
+    if os.name == "nt":
+        return None  # Windows上os.kill(pid, 0)会发送CTRL_C_EVENT，不能用来检查
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:  # 进程存在但属于其他用户
+        return True
+    return True
+
+
+def clean_staging(output_dir, job_id=None):
+    """
+    删除临时目录：属于job_id的，以及创建它的进程已经退出的（上次中断时
+    留下的）。同一个输出目录中其他正在运行的任务的临时目录不受影响
+    """
+    if not os.path.isdir(output_dir):
+        return
+    for name in os.listdir(output_dir):
+        if not name.startswith(STAGING_PREFIX):
+            continue
+        staging = os.path.join(output_dir, name)
+        owner = name[len(STAGING_PREFIX):].split("-")
+        if job_id is not None and name.startswith(STAGING_PREFIX + job_id + "-"):
+            stale = True
+        elif len(owner) == 3 and owner[0].isdigit():
+            alive = _process_alive(int(owner[0]))
+            if alive is None:
+                try:
+                    stale = time.time() - os.path.getmtime(staging) > STALE_STAGING_SECONDS
+                except OSError:
+                    continue
+            else:
+                stale = not alive
+        else:
+            stale = True  # 旧版本留下的没有任务id的目录
+        if stale:
+            shutil.rmtree(staging, ignore_errors=True)
+
+
+def new_job_id():
+    """任务id: 进程号-随机数，进程号用来判断临时目录是否是遗留的"""
+    return f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def run_item(convert, input_file, output_dir, job_id=None):
+    """
+    调用 convert(input_file, staging_dir) 把输出写到临时目录，成功后改名到
+    output_dir，返回 (convert的返回值, 输出文件列表)。失败时临时目录被删除。
+    在工作线程或工作进程中执行，convert需要是模块级函数才能传给进程池。
+    临时目录以job_id开头，job_id要由运行任务的主进程生成
+    """
+    job_id = job_id or new_job_id()
+    staging = os.path.join(output_dir, f"{STAGING_PREFIX}{job_id}-{uuid.uuid4().hex}")
+    os.makedirs(staging)
+    try:
+        result = convert(input_file, staging)
+        outputs = []
+        for name in sorted(os.listdir(staging)):
+            target = os.path.join(output_dir, name)
+            os.replace(os.path.join(staging, name), target)
+            outputs.append(target)
+        return result, outputs
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+class Journal:
+    """
+    只追加的任务日志，每行一个json记录。记录的key由输入文件的路径、大小、
+    修改时间和转换参数决定，文件或参数改变后会重新转换
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.done = {}
+        if os.path.exists(filename):
+            with open(filename, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # 崩溃时写了一半的最后一行
+                        continue
+                    if record.get("ok"):
+                        self.done[record["key"]] = record
+                    else:
+                        self.done.pop(record["key"], None)
+
+    @staticmethod
+    def key(input_file, params):
+        try:
+            stat = os.stat(input_file)
+            size, mtime = stat.st_size, stat.st_mtime_ns
+        except OSError:
+            # 文件已经不存在，转换时会失败并记录下来
+            size = mtime = None
+        text = json.dumps([os.path.abspath(input_file), size, mtime, params],
+                          ensure_ascii=False)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def is_done(self, key):
+        record = self.done.get(key)
+        return record is not None and all(os.path.exists(f) for f in record["outputs"])
+
+    def append(self, key, input_file, ok, outputs=(), error=None):
+        record = {"key": key, "input": input_file, "ok": ok,
+                  "outputs": list(outputs), "time": time.time()}
+        if error:
+            record["error"] = error
+        with open(self.filename, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if ok:
+            self.done[key] = record
+
+
+class BatchJob:
+    """
+    把 inputs 逐个交给 convert(input_file, staging_dir) 转换到 output_dir。
+    run() 阻塞到全部完成或被取消，pause()/resume()/cancel() 可以在其他线程
+    调用；暂停和取消不会打断正在转换的文件，只是不再开始新的文件。
+    executor 默认为单线程，传入进程池时 convert 需要可以pickle。
+    params 是转换参数，参数不同的任务不会互相跳过。
+    """
+
+    def __init__(self, inputs, convert, output_dir, params=None,
+                 executor=None, workers=1, restart=False):
+        self.inputs = list(inputs)
+        self.convert = convert
+        self.output_dir = output_dir
+        self.params = params
+        self.executor = executor
+        self.workers = workers
+        os.makedirs(output_dir, exist_ok=True)
+        journal = os.path.join(output_dir, JOURNAL_NAME)
+        if restart and os.path.exists(journal):
+            os.remove(journal)
+        self.journal = Journal(journal)
+        self.job_id = new_job_id()
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._cancelled = threading.Event()
+
+    def pending(self):
+        """返回还没有完成的 [(key, input_file)]"""
+        items = []
+        for input_file in self.inputs:
+            key = Journal.key(input_file, self.params)
+            if not self.journal.is_done(key):
+                items.append((key, input_file))
+        return items
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._resumed.set()
+
+    @property
+    def paused(self):
+        return not self._resumed.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self, on_done=None, items=None):
+        """
+        转换所有未完成的文件，每完成一个调用
+        on_done(input_file, ok, result, error)，返回 (成功数, 失败数)
+        """
+        clean_staging(self.output_dir, self.job_id)
+        if items is None:
+            items = self.pending()
+        todo = iter(items)
+        exhausted = False
+        succeeded = failed = 0
+        executor = self.executor or ThreadPoolExecutor(max_workers=1)
+        in_flight = {}
+        try:
+            while True:
+                # 保持每个工作者有一个排队的文件，暂停或取消后不再提交
+                while (not exhausted and not self.cancelled and not self.paused
+                       and len(in_flight) < self.workers * 2):
+                    item = next(todo, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    future = executor.submit(run_item, self.convert, item[1],
+                                             self.output_dir, self.job_id)
+                    in_flight[future] = item
+                if not in_flight:
+                    if exhausted or self.cancelled:
+                        break
+                    self._resumed.wait(0.1)
+                    continue
+
+                if self.cancelled:
+                    # 还没开始的文件直接取消，正在转换的等它完成
+                    for future in in_flight:
+                        future.cancel()
+                finished, _ = wait(in_flight, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key, input_file = in_flight.pop(future)
+                    if future.cancelled():
+                        continue
+                    try:
+                        result, outputs = future.result()
+                    except Exception as e:
+                        self.journal.append(key, input_file, False, error=str(e))
+                        failed += 1
+                        if on_done:
+                            on_done(input_file, False, None, e)
+                    else:
+                        self.journal.append(key, input_file, True, outputs)
+                        succeeded += 1
+                        if on_done:
+                            on_done(input_file, True, result, None)
+        finally:
+            if self.executor is None:
+                executor.shutdown()
+        return succeeded, failed
+
+
+def audio_to_p3(input_file, output_dir, target_lufs=None):
+    from convert_audio_to_p3 import encode_audio_to_opus
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    encode_audio_to_opus(input_file, os.path.join(output_dir, f"{base_name}.p3"), target_lufs)
+
+
+def p3_to_audio(input_file, output_dir):
+    from convert_p3_to_audio import decode_p3_to_audio
+    base_name = os.path.splitext(os.path.basename(input_file))[0]
+    decode_p3_to_audio(input_file, os.path.join(output_dir, f"{base_name}.wav"))
+
+
+def _collect_files(inputs, exts):
+    for name in inputs:
+        if os.path.isdir(name):
+            for f in sorted(Path(name).rglob("*")):
+                if f.suffix.lower() in exts:
+                    yield str(f)
+        else:
+            yield name
+
+
+def main():
+    parser = argparse.ArgumentParser(description='可断点续传的批量音频/P3转换')
+    parser.add_argument('--mode', choices=['audio_to_p3', 'p3_to_audio'], default='audio_to_p3')
+    parser.add_argument('-l', '--lufs', type=float, default=-16.0,
+                        help='目标响度LUFS (默认: -16)')
+    parser.add_argument('-d', '--disable-loudnorm', action='store_true',
+                        help='关闭响度调整')
+    parser.add_argument('--restart', action='store_true',
+                        help='忽略已完成的记录，全部重新转换')
+    parser.add_argument('-o', '--output', default="output", help='输出目录 (默认: output)')
+    parser.add_argument('inputs', nargs='+', help='输入文件或目录')
+    args = parser.parse_args()
+
+    from functools import partial
+    if args.mode == 'audio_to_p3':
+        target_lufs = None if args.disable_loudnorm else args.lufs
+        convert = partial(audio_to_p3, target_lufs=target_lufs)
+        params = [args.mode, target_lufs]
+        exts = ('.wav', '.mp3', '.ogg', '.flac', '.m4a')
+    else:
+        convert = p3_to_audio
+        params = [args.mode]
+        exts = ('.p3',)
+
+    job = BatchJob(_collect_files(args.inputs, exts), convert, args.output,
+                   params, restart=args.restart)
+    items = job.pending()
+    skipped = len(job.inputs) - len(items)
+    if skipped:
+        print(f"跳过 {skipped} 个已完成的文件")
+
+    def on_done(input_file, ok, result, error):
+        name = os.path.basename(input_file)
+        print(f"转换成功: {name}" if ok else f"转换失败: {name}: {error}")
+
+    def on_interrupt(signum, frame):
+        # 第一次Ctrl+C等当前文件转完后退出，第二次立即退出
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        print("正在取消，当前文件转换完成后退出，再按一次Ctrl+C立即退出")
+        job.cancel()
+
+    signal.signal(signal.SIGINT, on_interrupt)
+
+    def pause():
+        if not job.paused:
+            job.pause()
+            print("已暂停，当前文件转换完成后不再开始新的文件，输入 r 回车继续")
+
+    def resume():
+        if job.paused:
+            job.resume()
+            print("继续转换")
+
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: pause())
+        signal.signal(signal.SIGUSR2, lambda signum, frame: resume())
+
+    def read_commands():
+        for line in sys.stdin:
+            command = line.strip().lower()
+            if command == "p":
+                pause()
+            elif command == "r":
+                resume()
+            elif command == "q":
+                print("正在取消，当前文件转换完成后退出")
+                job.cancel()
+                return
+
+    if sys.stdin is not None and sys.stdin.isatty():
+        print("输入 p 回车暂停，r 回车继续，q 回车取消")
+        threading.Thread(target=read_commands, daemon=True).start()
+
+    succeeded, failed = job.run(on_done, items)
+    print(f"完成 {succeeded} 个，失败 {failed} 个")
+    if job.cancelled:
+        print("已取消，再次运行同样的命令可以继续")
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
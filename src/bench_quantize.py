@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Compare speed and error of the in-process palette quantizer against pngquant
+#
+# usage:
+#   python bench_quantize.py [--ncolors 256] [--nodither] <png file or folder>...
+import os
+import time
+import shutil
+import argparse
+from pathlib import Path
+
+import numpy as np
+import png
+
+from LVGLImage import PaletteQuantizer, PngQuant, read_rgba
+
+
+def quantize_builtin(filename, ncolors, dither):
+    rgba = read_rgba(filename)
+    palette, indices = PaletteQuantizer(ncolors, dither=dither).quantize(rgba)
+    return np.array(palette, dtype=np.uint8)[indices]
+
+
+def quantize_pngquant(filename, ncolors, dither):
+    reader = png.Reader(bytes=PngQuant(ncolors, dither=dither).convert(filename))
+    w, h, rows, _ = reader.read()
+    palette = np.array(reader.palette(alpha="force"), dtype=np.uint8)
+    indices = np.vstack([np.asarray(row, dtype=np.uint8) for row in rows])
+    return palette[indices]
+
+
+def error(original, quantized):
+    """
+    Mean squared RGBA error over the pixels that are not fully transparent
+    """
+    mask = original[..., 3] > 0
+    if not mask.any():
+        return 0.0
+    diff = original.astype(np.float64) - quantized.astype(np.float64)
+    return float((diff[mask]**2).mean())
+
+
+def blurred_error(original, quantized):
+    """
+    Mean squared RGB error after a small blur, how far apart the images look
+    from a viewing distance. Dithering raises the per pixel error but should
+    lower this one
+    """
+    from PIL import Image, ImageFilter
+
+    def blur(x):
+        img = Image.fromarray(x[..., :3])
+        return np.asarray(img.filter(ImageFilter.GaussianBlur(1.5))).astype(np.float64)
+    mask = original[..., 3] > 0
+    if not mask.any():
+        return 0.0
+    return float(((blur(original) - blur(quantized))[mask]**2).mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='palette quantizer benchmark')
+    parser.add_argument('--ncolors', type=int, default=256)
+    parser.add_argument('--nodither', action='store_true')
+    parser.add_argument('inputs', nargs='+', help="png files or folders")
+    args = parser.parse_args()
+
+    files = []
+    for name in args.inputs:
+        if os.path.isdir(name):
+            files += sorted(Path(name).rglob("*.[pP][nN][gG]"))
+        else:
+            files.append(Path(name))
+
+    methods = [("builtin", quantize_builtin)]
+    if shutil.which("pngquant"):
+        methods.append(("pngquant", quantize_pngquant))
+    else:
+        print("pngquant not found in PATH, only builtin is measured")
+
+    totals = {name: [0.0, 0.0, 0.0] for name, _ in methods}
+    for f in files:
+        original = read_rgba(f)
+        line = f"{f.name:32}"
+        for name, method in methods:
+            start = time.perf_counter()
+            quantized = method(str(f), args.ncolors, not args.nodither)
+            elapsed = time.perf_counter() - start
+            mse = error(original, quantized)
+            blurred = blurred_error(original, quantized)
+            totals[name][0] += elapsed
+            totals[name][1] += mse
+            totals[name][2] += blurred
+            line += f"  {name}: {elapsed * 1000:7.1f}ms mse {mse:7.2f} blurred {blurred:6.2f}"
+        print(line)
+
+    print(f"{len(files)} files")
+    for name, (elapsed, mse, blurred) in totals.items():
+        print(f"{name:10} total {elapsed:.3f}s, "
+              f"{len(files) / elapsed if elapsed else 0:.1f} files/s, "
+              f"mean mse {mse / max(len(files), 1):.2f}, "
+              f"blurred {blurred / max(len(files), 1):.2f}")
+
+
+if __name__ == "__main__":
+    main()
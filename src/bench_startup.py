@@ -0,0 +1,91 @@
+# 命令行工具启动耗时检查
+# 用 `python -X importtime` 统计导入耗时，并检查 `--help` 和导入模块时没有加载重量级依赖
+#
+# 用法:
+#   python bench_startup.py [--budget-ms 150] [--runs 5]
+# 有检查项不通过时返回非0退出码，可以放进CI防止启动速度回退
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 这些依赖只应该在真正转换时才导入
+HEAVY_MODULES = ("librosa", "numpy", "opuslib", "tqdm", "pyloudnorm",
+                 "soundfile", "sounddevice", "scipy", "numba")
+
+# (名称, 命令行参数)
+CASES = [
+    ("convert_audio_to_p3 --help", ["convert_audio_to_p3.py", "--help"]),
+    ("convert_p3_to_audio (usage)", ["convert_p3_to_audio.py"]),
+    ("import convert_audio_to_p3", ["-c", "import convert_audio_to_p3"]),
+    ("import convert_p3_to_audio", ["-c", "import convert_p3_to_audio"]),
+    ("import p3_convertor", ["-c", "import p3_convertor"]),
+    ("p3_probe --help", ["p3_probe.py", "--help"]),
+    ("p3_ogg_remux --help", ["p3_ogg_remux.py", "--help"]),
+]
+
+
+def parse_importtime(stderr):
+    """
+    解析 -X importtime 的输出，返回 {模块名: 累计耗时(us)}
+    """
+    result = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        try:
+            result[name.strip()] = int(cumulative)
+        except ValueError:
+            pass  # 表头
+    return result
+
+
+def run_case(args, runs):
+    best = None
+    imports = {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime"] + args,
+                              cwd=HERE, capture_output=True, text=True)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+        imports = parse_importtime(proc.stderr)
+    return best, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检查命令行工具的启动耗时')
+    parser.add_argument('--budget-ms', type=float, default=150,
+                        help='单次启动的耗时上限 (默认: 150ms)')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='每项运行次数，取最快的一次 (默认: 5)')
+    parser.add_argument('--top', type=int, default=5,
+                        help='显示耗时最多的导入模块数量')
+    args = parser.parse_args()
+
+    baseline, _ = run_case(["-c", "pass"], args.runs)
+    print(f"interpreter start-up: {baseline:.1f}ms")
+
+    failed = False
+    for name, case_args in CASES:
+        elapsed, imports = run_case(case_args, args.runs)
+        heavy = sorted(m for m in imports if m.split(".")[0] in HEAVY_MODULES
+                       and "." not in m)
+        ok = not heavy and elapsed <= args.budget_ms
+        failed |= not ok
+        print(f"{'OK ' if ok else 'BAD'} {elapsed:7.1f}ms  {name}")
+        if heavy:
+            print(f"      heavy imports: {', '.join(heavy)}")
+        top = sorted(imports.items(), key=lambda x: -x[1])[:args.top]
+        for module, us in top:
+            print(f"      {us / 1000:7.1f}ms  {module}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,23 @@
 # convert audio files to protocol v3 stream
-import librosa
-import opuslib
+# Heavy dependencies (librosa, numpy, opuslib, ...) are imported inside the
+# functions that need them, so `--help` and importing this module stay fast.
 import struct
 import sys
-import tqdm
-import numpy as np
+import wave
 import argparse
-import pyloudnorm as pyln
 
-def encode_audio_to_opus(input_file, output_file, target_lufs=None):
+# numpy dtype of each raw PCM sample format accepted in pipe mode
+RAW_SAMPLE_FORMATS = {'s16le': '<i2', 's32le': '<i4', 'f32le': '<f4'}
+# numpy dtype of each WAV sample width in bytes
+WAV_SAMPLE_WIDTHS = {1: 'u1', 2: '<i2', 4: '<i4'}
+
+def load_audio(input_file, target_lufs=None):
+    """
+    Load an audio file as 16kHz mono int16 samples, optionally loudness-normalized
+    """
+    import librosa
+    import numpy as np
+
     # Load audio file using librosa
     audio, sample_rate = librosa.load(input_file, sr=None, mono=False, dtype=np.float32)
     
@@ -21,42 +30,198 @@ def encode_audio_to_opus(input_file, output_file, target_lufs=None):
         print("      audio distortion. If the input audio has already been ", file=sys.stderr)
         print("      loudness-adjusted or if the input audio is TTS audio, ", file=sys.stderr)
         print("      please use the `-d` parameter to disable loudness adjustment.", file=sys.stderr)
+        import pyloudnorm as pyln
         meter = pyln.Meter(sample_rate)
         current_loudness = meter.integrated_loudness(audio)
         audio = pyln.normalize.loudness(audio, current_loudness, target_lufs)
-        print(f"Adjusted loudness: {current_loudness:.1f} LUFS -> {target_lufs} LUFS")
+        print(f"Adjusted loudness: {current_loudness:.1f} LUFS -> {target_lufs} LUFS", file=sys.stderr)
 
     # Convert sample rate to 16000Hz if necessary
     target_sample_rate = 16000
     if sample_rate != target_sample_rate:
         audio = librosa.resample(audio, orig_sr=sample_rate, target_sr=target_sample_rate)
-        sample_rate = target_sample_rate
     
     # Convert audio data back to int16 after processing
-    audio = (audio * 32767).astype(np.int16)
-    
+    return (audio * 32767).astype(np.int16)
+
+def encode_pcm_to_packets(audio, sample_rate=16000, progress=False):
+    """
+    Encode int16 samples to P3 packets, yielding each packet as soon as it is ready
+    """
+    import numpy as np
+    import opuslib
+
     # Initialize Opus encoder
     encoder = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_AUDIO)
 
+    duration = 60  # 60ms per frame
+    frame_size = int(sample_rate * duration / 1000)
+    frames = range(0, len(audio), frame_size)
+    if progress:
+        import tqdm
+        frames = tqdm.tqdm(frames)
+    for i in frames:
+        frame = audio[i:i + frame_size]
+        if len(frame) < frame_size:
+            # pad the last partial frame with silence instead of dropping it,
+            # the same as pipe mode
+            frame = np.concatenate([frame, np.zeros(frame_size - len(frame), dtype=frame.dtype)])
+        opus_data = encoder.encode(frame.tobytes(), frame_size=frame_size)
+        yield struct.pack('>BBH', 0, 0, len(opus_data)) + opus_data
+
+def encode_audio_to_opus(input_file, output_file, target_lufs=None, version=1):
+    """
+    Encode an audio file to P3, version 2 adds the P3v2 header and packet index.
+    An output_file of '-' writes to stdout
+    """
+    from p3_format import P3Writer
+
+    audio = load_audio(input_file, target_lufs)
+
     # Encode and save
-    with open(output_file, 'wb') as f:
-        duration = 60  # 60ms per frame
-        frame_size = int(sample_rate * duration / 1000)
-        for i in tqdm.tqdm(range(0, len(audio) - frame_size, frame_size)):
-            frame = audio[i:i + frame_size]
+    f = sys.stdout.buffer if output_file == '-' else open(output_file, 'wb')
+    with f, P3Writer(f, version, loudness=target_lufs) as writer:
+        for packet in encode_pcm_to_packets(audio, progress=True):
+            writer.write_packed(packet)
+
+def open_pcm_stream(stream, input_format='wav', sample_rate=16000,
+                    channels=1, sample_format='s16le'):
+    """
+    Open a WAV or raw PCM byte stream, return its sample rate and a generator
+    of float32 mono blocks, one 60ms frame each
+    """
+    import numpy as np
+
+    if input_format == 'wav':
+        wav = wave.open(stream, 'rb')
+        sample_rate = wav.getframerate()
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        if width not in WAV_SAMPLE_WIDTHS:
+            raise ValueError(f"Unsupported WAV sample width: {width * 8} bits")
+        dtype = np.dtype(WAV_SAMPLE_WIDTHS[width])
+        read = wav.readframes
+    else:
+        dtype = np.dtype(RAW_SAMPLE_FORMATS[sample_format])
+        frame_bytes = dtype.itemsize * channels
+        read = lambda n: stream.read(n * frame_bytes)
+
+    block_frames = int(sample_rate * 60 / 1000)
+
+    def blocks():
+        leftover = b''
+        while True:
+            chunk = read(block_frames)
+            if not chunk:
+                if leftover:
+                    print(f"Warning: dropped {len(leftover)} trailing bytes of an incomplete sample frame",
+                          file=sys.stderr)
+                break
+            data = leftover + chunk
+            usable = len(data) - len(data) % (dtype.itemsize * channels)
+            data, leftover = data[:usable], data[usable:]
+            if not data:
+                continue
+            block = np.frombuffer(data, dtype=dtype).astype(np.float32)
+            if dtype.kind == 'u':
+                block = (block - 128) / 128
+            elif dtype.kind == 'i':
+                block /= 2 ** (dtype.itemsize * 8 - 1)
+            if channels > 1:
+                block = block.reshape(-1, channels).mean(axis=1)
+            yield block
+
+    return sample_rate, blocks()
+
+def encode_stream_to_p3(input_stream, output_stream, version=1, **stream_format):
+    """
+    Encode a WAV or raw PCM stream to P3, writing and flushing every packet
+    as soon as one 60ms frame of input has arrived. With version 2 the packet
+    count and index are only filled in when output_stream is seekable.
+    """
+    import numpy as np
+    import opuslib
+    from p3_format import P3Writer
+
+    sample_rate, blocks = open_pcm_stream(input_stream, **stream_format)
+    target_sample_rate = 16000
+    resampler = None
+    if sample_rate != target_sample_rate:
+        # soxr is what librosa.resample uses by default, its stream API keeps
+        # the filter state between blocks
+        import soxr
+        resampler = soxr.ResampleStream(sample_rate, target_sample_rate, 1, dtype='float32')
+
+    encoder = opuslib.Encoder(target_sample_rate, 1, opuslib.APPLICATION_AUDIO)
+    frame_size = int(target_sample_rate * 60 / 1000)
+    writer = P3Writer(output_stream, version)
+    pending = np.zeros(0, dtype=np.int16)
+
+    def encode_pending(final=False):
+        nonlocal pending
+        if final and len(pending) % frame_size:
+            # pad the last partial frame with silence instead of dropping it
+            pad = frame_size - len(pending) % frame_size
+            pending = np.concatenate([pending, np.zeros(pad, dtype=np.int16)])
+        while len(pending) >= frame_size:
+            frame = pending[:frame_size]
             opus_data = encoder.encode(frame.tobytes(), frame_size=frame_size)
-            packet = struct.pack('>BBH', 0, 0, len(opus_data)) + opus_data
-            f.write(packet)
+            writer.write(opus_data)
+            output_stream.flush()
+            pending = pending[frame_size:]
+
+    def append(block):
+        nonlocal pending
+        block = np.clip(block * 32767, -32768, 32767).astype(np.int16)
+        pending = np.concatenate([pending, block])
+
+    for block in blocks:
+        if resampler is not None:
+            block = resampler.resample_chunk(block)
+        append(block)
+        encode_pending()
+
+    if resampler is not None:
+        append(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+    encode_pending(final=True)
+    writer.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Convert audio to Opus with loudness normalization')
-    parser.add_argument('input_file', help='Input audio file')
-    parser.add_argument('output_file', help='Output .opus file')
+    parser.add_argument('input_file', help='Input audio file, or - to read WAV/raw PCM from stdin')
+    parser.add_argument('output_file', help='Output .opus file, or - to write to stdout')
     parser.add_argument('-l', '--lufs', type=float, default=-16.0,
                        help='Target loudness in LUFS (default: -16)')
     parser.add_argument('-d', '--disable-loudnorm', action='store_true',
                        help='Disable loudness normalization')
+    parser.add_argument('-f', '--input-format', choices=['wav', 'raw'], default='wav',
+                       help='Input format in pipe mode (default: wav)')
+    parser.add_argument('-r', '--rate', type=int, default=16000,
+                       help='Sample rate of raw PCM input (default: 16000)')
+    parser.add_argument('-c', '--channels', type=int, default=1,
+                       help='Channel count of raw PCM input (default: 1)')
+    parser.add_argument('-s', '--sample-format', choices=list(RAW_SAMPLE_FORMATS), default='s16le',
+                       help='Sample format of raw PCM input (default: s16le)')
+    parser.add_argument('--p3v2', action='store_true',
+                       help='Write P3v2 with a header and packet index (default: P3 v1)')
     args = parser.parse_args()
 
     target_lufs = None if args.disable_loudnorm else args.lufs
-    encode_audio_to_opus(args.input_file, args.output_file, target_lufs)
\ No newline at end of file
+    if args.input_file == '-' or args.input_format == 'raw':
+        # pipe mode: encode packet by packet as the input arrives. Other input
+        # files are decoded whole by librosa even when writing to stdout
+        if target_lufs is not None:
+            print("Note: Loudness normalization needs the whole audio and is", file=sys.stderr)
+            print("      disabled in pipe mode.", file=sys.stderr)
+        input_stream = sys.stdin.buffer if args.input_file == '-' else open(args.input_file, 'rb')
+        output_stream = sys.stdout.buffer if args.output_file == '-' else open(args.output_file, 'wb')
+        with input_stream, output_stream:
+            encode_stream_to_p3(input_stream, output_stream,
+                                input_format=args.input_format,
+                                sample_rate=args.rate,
+                                channels=args.channels,
+                                sample_format=args.sample_format,
+                                version=2 if args.p3v2 else 1)
+    else:
+        encode_audio_to_opus(args.input_file, args.output_file, target_lufs,
+                             version=2 if args.p3v2 else 1)
\ No newline at end of file
@@ -1,51 +1,139 @@
-import struct
 import sys
-import opuslib
-import numpy as np
-from tqdm import tqdm
-import soundfile as sf
+import argparse
 
+# 并行解码时每段前面多解码的数据包数，让解码器状态收敛到和顺序解码一致，这部分输出丢弃。
+# Opus在每个数据包开头重新编码帧参数（SILK按独立帧解码，CELT的能量预测系数
+# 小于1），跨数据包保留的只有滤波器历史等信号状态，误差逐帧衰减，
+# 5个60ms数据包（15个20ms帧）后通常已经和顺序解码完全一致。
+# 这只是经验值，所以解码时还会用 SEAM_CHECK_PACKETS 检查每个接缝
+PREROLL_PACKETS = 5
+# 每段解码完后，同一个解码器继续解码下一段开头的数据包数，和下一段的输出对比。
+# 第一段就是顺序解码，逐段对比一致说明每个接缝都已收敛
+SEAM_CHECK_PACKETS = 3
+# 每段至少包含的数据包数（200个约12秒），太短时预解码的开销占比过高
+MIN_SEGMENT_PACKETS = 200
 
-def decode_p3_to_audio(input_file, output_file):
-    sample_rate = 16000
-    channels = 1
-    decoder = opuslib.Decoder(sample_rate, channels)
 
-    pcm_frames = []
-    frame_size = int(sample_rate * 60 / 1000)
+def decode_segment(packets, start, end, preroll=PREROLL_PACKETS,
+                   sample_rate=16000, channels=1, check=0):
+    """
+    用新的解码器解码 packets[start:end]，先解码前面最多 preroll 个数据包
+    让解码器状态收敛，返回int16采样。check大于0时返回 (采样, 同一个解码器
+    继续解码后面check个数据包的采样)，用来检查下一段的开头
+    """
+    from p3_format import OpusBatchDecoder
 
-    with open(input_file, "rb") as f:
-        f.seek(0, 2)
-        total_size = f.tell()
-        f.seek(0)
+    decoder = OpusBatchDecoder(sample_rate, channels)
+    decoder.decode_all(packets[max(0, start - preroll):start])
+    pcm = decoder.decode_all(packets[start:end])
+    if not check:
+        return pcm
+    return pcm, decoder.decode_all(packets[end:end + check])
 
-        with tqdm(total=total_size, unit="B", unit_scale=True) as pbar:
-            while True:
-                header = f.read(4)
-                if not header or len(header) < 4:
-                    break
 
-                pkt_type, reserved, opus_len = struct.unpack(">BBH", header)
-                opus_data = f.read(opus_len)
-                if len(opus_data) != opus_len:
-                    break
+def split_segments(count, workers, min_packets=MIN_SEGMENT_PACKETS):
+    """
+    把count个数据包分成若干段 [(start, end)]，段数为workers的4倍以便负载均衡，
+    但每段不少于min_packets个
+    """
+    n = max(1, min(workers * 4, count // min_packets))
+    bounds = [count * i // n for i in range(n + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
 
-                pcm = decoder.decode(opus_data, frame_size)
-                pcm_frames.append(np.frombuffer(pcm, dtype=np.int16))
 
-                pbar.update(4 + opus_len)
+def decode_packets(packets, workers=1, preroll=PREROLL_PACKETS,
+                   sample_rate=16000, channels=1, tolerance=0):
+    """
+    解码Opus数据包列表。workers大于1时分段并行解码再拼接，opuslib通过ctypes
+    调用libopus时会释放GIL，所以用线程就能用满多个核心。
+    除第一段外每段都从新的解码器开始，前面预解码preroll个数据包。
+    每个接缝处用前一段的解码器继续解码SEAM_CHECK_PACKETS个数据包，
+    和后一段开头的输出对比，差异超过tolerance时改为顺序解码，
+    所以返回的结果和顺序解码的差异不超过tolerance
+    """
+    import numpy as np
+    from p3_format import OpusBatchDecoder
 
-    if not pcm_frames:
+    if workers <= 1:
+        return OpusBatchDecoder(sample_rate, channels).decode_all(packets)
+
+    from concurrent.futures import ThreadPoolExecutor
+    segments = split_segments(len(packets), workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda s: decode_segment(packets, s[0], s[1], preroll,
+                                                         sample_rate, channels,
+                                                         SEAM_CHECK_PACKETS),
+                                segments))
+    parts = [pcm for pcm, _ in results]
+    for k in range(1, len(parts)):
+        expected = results[k - 1][1]
+        actual = parts[k][:len(expected)]
+        diff = np.abs(expected.astype(np.int32) - actual.astype(np.int32)) \
+            if len(actual) == len(expected) else None
+        if diff is None or diff.max(initial=0) > tolerance:
+            print(f"Warning: segment {k} did not converge after {preroll} packets "
+                  f"of preroll, decoding serially", file=sys.stderr)
+            return OpusBatchDecoder(sample_rate, channels).decode_all(packets)
+    return np.concatenate(parts)
+
+
+def compare_decodes(packets, workers, preroll=PREROLL_PACKETS, sample_rate=16000, channels=1):
+    """
+    并行解码和顺序解码对比，返回 (最大绝对误差, 不同的采样数, 总采样数)
+    """
+    import numpy as np
+
+    serial = decode_packets(packets, 1, sample_rate=sample_rate, channels=channels)
+    parallel = decode_packets(packets, workers, preroll, sample_rate, channels)
+    diff = np.abs(serial.astype(np.int32) - parallel.astype(np.int32))
+    return int(diff.max(initial=0)), int(np.count_nonzero(diff)), len(serial)
+
+
+def decode_p3_to_audio(input_file, output_file, workers=1, tolerance=0):
+    # 依赖较重，只在真正解码时导入
+    import soundfile as sf
+    from tqdm import tqdm
+    from p3_format import read_p3_file, OpusBatchDecoder
+
+    # v1文件固定为16kHz单声道，P3v2从文件头读取
+    header, packets = read_p3_file(input_file)
+    sample_rate = header["sample_rate"]
+    channels = header["channels"]
+    if not packets:
         raise ValueError("No valid audio data found")
 
-    pcm_data = np.concatenate(pcm_frames)
+    if workers > 1:
+        pcm_data = decode_packets(packets, workers, sample_rate=sample_rate,
+                                  channels=channels, tolerance=tolerance)
+    else:
+        # 分批解码直接写入一次分配的输出缓冲区，每批更新一次进度
+        with tqdm(total=len(packets), unit="packet") as pbar:
+            pcm_data = OpusBatchDecoder(sample_rate, channels).decode_all(packets, pbar.update)
 
     sf.write(output_file, pcm_data, sample_rate, subtype="PCM_16")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python convert_p3_to_audio.py <input.p3> <output.wav>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Convert P3 to audio')
+    parser.add_argument('input_file', help='Input .p3 file')
+    parser.add_argument('output_file', nargs='?', help='Output audio file')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Decode segments in parallel with N threads (default: 1, serial)')
+    parser.add_argument('--verify', action='store_true',
+                        help='Compare the parallel decode with the serial one and report the difference')
+    parser.add_argument('--tolerance', type=int, default=0,
+                        help='Largest sample difference from the serial decode accepted at segment '
+                             'seams, and by --verify (default: 0)')
+    args = parser.parse_args()
+    if not args.verify and args.output_file is None:
+        parser.error("the following arguments are required: output_file")
+
+    if args.verify:
+        from p3_format import read_p3_file
+        header, packets = read_p3_file(args.input_file)
+        max_diff, count, total = compare_decodes(packets, max(args.jobs, 2), sample_rate=header["sample_rate"],
+                                                 channels=header["channels"])
+        print(f"max abs diff {max_diff}, {count}/{total} samples differ")
+        sys.exit(0 if max_diff <= args.tolerance else 1)
 
-    decode_p3_to_audio(sys.argv[1], sys.argv[2])
+    decode_p3_to_audio(args.input_file, args.output_file, args.jobs, args.tolerance)
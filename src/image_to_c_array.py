@@ -1,9 +1,8 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image
 import os
-import tempfile
-from LVGLImage import LVGLImage, ColorFormat, CompressMethod
+from LVGLImage import OutputFormat
+from LVGLPipeline import MultiTargetConverter, DEFAULT_CACHE_DIR
 
 class ImageConverterApp:
     def __init__(self, root):
@@ -12,7 +11,7 @@ class ImageConverterApp:
         
         # 初始化变量
         self.selected_files = []
-        self.resolution = tk.StringVar(value="128x128")
+        self.resolutions = {}
         self.output_dir = "output"
         
         # 创建界面组件
@@ -33,11 +32,13 @@ class ImageConverterApp:
             ("32x32", "32x32")  # 新增32x32选项
         ]
         
+        # 可以同时选择多个分辨率，每张图片只解码一次
         for text, value in resolutions:
-            ttk.Radiobutton(res_frame, 
-                          text=text,
-                          variable=self.resolution,
-                          value=value).pack(side=tk.LEFT, padx=5)
+            var = tk.BooleanVar(value=value == "128x128")
+            self.resolutions[value] = var
+            ttk.Checkbutton(res_frame,
+                            text=text,
+                            variable=var).pack(side=tk.LEFT, padx=5)
         
         # 转换按钮
         self.convert_button = ttk.Button(self.root, text="开始转换", command=self.convert_images)
@@ -64,17 +65,23 @@ class ImageConverterApp:
             messagebox.showwarning("警告", "请先选择图片文件！")
             return
         
+        # 解析分辨率
+        sizes = [tuple(map(int, value.split('x')))
+                 for value, var in self.resolutions.items() if var.get()]
+        if not sizes:
+            messagebox.showwarning("警告", "请至少选择一个分辨率！")
+            return
+        
         # 初始化进度条
         self.progress.pack(pady=5)
         self.progress["maximum"] = len(self.selected_files)
         self.progress["value"] = 0
         
-        # 确保输出目录存在
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
-        
-        # 解析分辨率
-        width, height = map(int, self.resolution.get().split('x'))
+        # 和lvgl_tools_gui.py使用同一个多目标转换器：有透明通道时转为RGB565A8，
+        # 否则为RGB565，同时保存缩放后的png，缩放结果缓存在磁盘上
+        converter = MultiTargetConverter(sizes, [None], ofmt=OutputFormat.C_ARRAY,
+                                         odir=self.output_dir, save_png=True,
+                                         cache_dir=DEFAULT_CACHE_DIR)
         
         success_count = 0
         for idx, file_path in enumerate(self.selected_files):
@@ -84,46 +91,9 @@ class ImageConverterApp:
                 self.root.update_idletasks()
                 
                 # 处理每个文件
-                with Image.open(file_path) as img:
-                    # 调整图片大小
-                    img = img.resize((width, height), Image.Resampling.LANCZOS)
-                    
-                    # 处理透明通道
-                    has_alpha = img.mode in ('RGBA', 'LA')
-                    if has_alpha:
-                        img = img.convert('RGBA')
-                        cf = ColorFormat.RGB565A8
-                    else:
-                        img = img.convert('RGB')
-                        cf = ColorFormat.RGB565
-                    
-                    # 保存调整后的图片
-                    base_name = os.path.splitext(os.path.basename(file_path))[0]
-                    output_image_name = f"{base_name}_{width}x{height}.png"
-                    output_image_path = os.path.join(self.output_dir, output_image_name)
-                    img.save(output_image_path, 'PNG')
-                    self.log_write(f"已保存调整后的图片: {output_image_name}\n")
-                    
-                    # 创建临时文件
-                    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmpfile:
-                        temp_path = tmpfile.name
-                        img.save(temp_path, 'PNG')
-                    
-                    # 转换为LVGL C数组
-                    lvgl_img = LVGLImage().from_png(temp_path, cf=cf)
-                    
-                    # 生成C数组文件名
-                    output_c_path = os.path.join(self.output_dir, f"{base_name}.c")
-                    
-                    # 保存C数组文件
-                    lvgl_img.to_c_array(output_c_path)
-                    
-                    # 记录日志
-                    self.log_write(f"成功转换：{base_name}.c\n")
-                    success_count += 1
-                    
-                    # 清理临时文件
-                    os.unlink(temp_path)
+                for r in converter.convert(file_path):
+                    self.log_write(f"成功转换：{os.path.basename(r['output'])}\n")
+                success_count += 1
                     
             except Exception as e:
                 self.log_write(f"错误处理文件 {os.path.basename(file_path)}: {str(e)}\n")
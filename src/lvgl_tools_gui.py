@@ -2,18 +2,29 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from PIL import Image
 import os
-import tempfile
-import sys
-from LVGLImage import LVGLImage, ColorFormat, CompressMethod
+import time
+import queue
+import threading
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from LVGLImage import ColorFormat, CompressMethod, OutputFormat
+from LVGLPipeline import MultiTargetConverter, DEFAULT_CACHE_DIR
+from batch_job import BatchJob
+from tk_log import TkLogSink
+
+ALL_SIZES = [(128, 128), (64, 64), (32, 32)]
 
 HELP_TEXT = """LVGL图片转换工具使用说明：
 
 1. 添加文件：点击“添加文件”按钮选择需要转换的图片，支持批量导入
+   GIF动图会逐帧转换，并生成记录每帧位置和时长的索引头文件
 
 2. 移除文件：在列表中选中文件前的复选框“[ ]”（选中后会变成“[√]”），点击“移除选中”可删除选定文件
 
 3. 设置分辨率：选择需要的分辨率，如128x128
    建议根据自己的设备的屏幕分辨率来选择。过大和过小都会影响显示效果。
+   分辨率、颜色格式和压缩方式都可以选择“全部”，每张图片只解码一次，一次生成所有组合
 
 4. 颜色格式：选择“自动识别”会根据图片是否透明自动选择，或手动指定
    除非你了解这个选项，否则建议使用自动识别，不然可能会出现一些意想不到的问题……
@@ -25,8 +36,67 @@ HELP_TEXT = """LVGL图片转换工具使用说明：
    默认为程序所在目录下的output文件夹
 
 7. 转换：点击“转换全部”或“转换选中”开始转换
+   转换在后台进程中进行，使用全部CPU核心，转换时界面不会卡住，进度条下方显示速度和剩余时间
+   转换中可以暂停或取消，已完成的文件记录在输出目录中，中断后再次转换会跳过它们
 """
 
+
+def convert_animation(file_path, output_dir, width, height, cf, compress, suffix=""):
+    """
+    suffix加在输出文件名后面，区分同一个动图的不同分辨率、颜色格式和压缩方式
+    """
+    from LVGLAnimation import AnimationConverter
+
+    if cf is None:
+        with Image.open(file_path) as img:
+            has_alpha = img.mode in ('RGBA', 'LA') or 'transparency' in img.info
+        cf = ColorFormat.RGB565A8 if has_alpha else ColorFormat.RGB565
+
+    name = os.path.splitext(os.path.basename(file_path))[0] + suffix
+    converter = AnimationConverter(cf, OutputFormat.C_ARRAY, output_dir,
+                                   delta=True, compress=compress)
+    index = converter.convert(file_path, name, size=(width, height))
+    return f"成功转换动图: {index['name']}.h, {index['frames']}帧, {index['duration']}ms"
+
+
+def convert_file(file_path, output_dir, sizes, cfs, compresses):
+    """
+    在工作进程中转换一个文件到output_dir，返回日志行列表，失败时抛出异常
+    """
+    lines = [f"正在处理: {os.path.basename(file_path)}"]
+    with Image.open(file_path) as img:
+        animated = getattr(img, "is_animated", False)
+    if animated:
+        # 动图逐帧转换，只保存和上一帧不同的区域，每种组合分别转换，
+        # 文件名后缀和静态图片的一致
+        for width, height in sizes:
+            for cf in cfs:
+                for compress in compresses:
+                    suffix = ""
+                    if len(sizes) > 1:
+                        suffix += f"_{width}x{height}"
+                    if len(cfs) > 1:
+                        suffix += "_" + (cf.name if cf else "AUTO")
+                    if len(compresses) > 1:
+                        suffix += "_" + compress.name
+                    lines.append(convert_animation(file_path, output_dir, width, height,
+                                                   cf, compress, suffix))
+        return lines
+
+    # 每张图片只解码一次，缩放出所有分辨率后再生成各个颜色格式和压缩方式
+    converter = MultiTargetConverter(sizes, cfs, compresses, OutputFormat.C_ARRAY,
+                                     output_dir, save_png=True,
+                                     cache_dir=DEFAULT_CACHE_DIR)
+    results = converter.convert(file_path)
+    r = results[0]
+    cached = "（缓存）" if all(r["cached"] for r in results) else ""
+    lines.append(f"解码 {r['decode_ms']:.1f}ms, 缩放 {r['resize_ms']:.1f}ms{cached}")
+    for r in results:
+        lines.append(f"成功转换: {os.path.basename(r['output'])} "
+                     f"({r['convert_ms'] + r['write_ms']:.1f}ms)")
+    return lines
+
+
 class ImageConverterApp:
     def __init__(self, root):
         self.root = root
@@ -38,10 +108,16 @@ class ImageConverterApp:
         self.resolution = tk.StringVar(value="128x128")
         self.color_format = tk.StringVar(value="自动识别")
         self.compress_method = tk.StringVar(value="NONE")
+        self.status = tk.StringVar(value="")
+
+        # 后台转换状态
+        self.job = None
+        self.results = queue.Queue()
 
         # 创建UI组件
         self.create_widgets()
         self.redirect_output()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def create_widgets(self):
         # 参数设置框架
@@ -51,17 +127,17 @@ class ImageConverterApp:
         # 分辨率设置
         ttk.Label(settings_frame, text="分辨率:").grid(row=0, column=0, padx=2)
         ttk.Combobox(settings_frame, textvariable=self.resolution, 
-                    values=["128x128", "64x64", "32x32"], width=8).grid(row=0, column=1, padx=2)
+                    values=["128x128", "64x64", "32x32", "全部"], width=8).grid(row=0, column=1, padx=2)
 
         # 颜色格式
         ttk.Label(settings_frame, text="颜色格式:").grid(row=0, column=2, padx=2)
         ttk.Combobox(settings_frame, textvariable=self.color_format,
-                    values=["自动识别", "RGB565", "RGB565A8"], width=10).grid(row=0, column=3, padx=2)
+                    values=["自动识别", "RGB565", "RGB565A8", "全部"], width=10).grid(row=0, column=3, padx=2)
 
         # 压缩方式
         ttk.Label(settings_frame, text="压缩方式:").grid(row=0, column=4, padx=2)
         ttk.Combobox(settings_frame, textvariable=self.compress_method,
-                    values=["NONE", "RLE"], width=8).grid(row=0, column=5, padx=2)
+                    values=["NONE", "RLE", "全部"], width=8).grid(row=0, column=5, padx=2)
 
         # 文件操作框架
         file_frame = ttk.LabelFrame(self.root, text="输入文件")
@@ -93,10 +169,27 @@ class ImageConverterApp:
         # 转换按钮和帮助按钮
         convert_frame = ttk.Frame(self.root)
         convert_frame.grid(row=3, column=0, padx=10, pady=10)
-        ttk.Button(convert_frame, text="转换全部文件", command=lambda: self.start_conversion(True)).pack(side=tk.LEFT, padx=5)
-        ttk.Button(convert_frame, text="转换选中文件", command=lambda: self.start_conversion(False)).pack(side=tk.LEFT, padx=5)
+        self.convert_buttons = [
+            ttk.Button(convert_frame, text="转换全部文件", command=lambda: self.start_conversion(True)),
+            ttk.Button(convert_frame, text="转换选中文件", command=lambda: self.start_conversion(False)),
+        ]
+        for button in self.convert_buttons:
+            button.pack(side=tk.LEFT, padx=5)
+        self.pause_button = ttk.Button(convert_frame, text="暂停", command=self.toggle_pause,
+                                       state=tk.DISABLED)
+        self.pause_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(convert_frame, text="取消", command=self.cancel_conversion,
+                                        state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
         ttk.Button(convert_frame, text="帮助", command=self.show_help).pack(side=tk.RIGHT, padx=5)
 
+        # 进度条和速度
+        progress_frame = ttk.Frame(self.root)
+        progress_frame.grid(row=5, column=0, padx=10, pady=5, sticky="ew")
+        self.progress = ttk.Progressbar(progress_frame, mode="determinate")
+        self.progress.pack(fill=tk.X)
+        ttk.Label(progress_frame, textvariable=self.status).pack(anchor=tk.W)
+
         # 日志区域（新增清空按钮部分）
         log_frame = ttk.LabelFrame(self.root, text="日志")
         log_frame.grid(row=4, column=0, padx=10, pady=5, sticky="nsew")
@@ -118,26 +211,14 @@ class ImageConverterApp:
 
     def clear_log(self):
         """清空日志内容"""
-        self.log_text.delete(1.0, tk.END)
+        self.log_sink.clear()
 
     def show_help(self):
         messagebox.showinfo("帮助", HELP_TEXT)
 
     def redirect_output(self):
-        class StdoutRedirector:
-            def __init__(self, text_widget):
-                self.text_widget = text_widget
-                self.original_stdout = sys.stdout
-
-            def write(self, message):
-                self.text_widget.insert(tk.END, message)
-                self.text_widget.see(tk.END)
-                self.original_stdout.write(message)
-
-            def flush(self):
-                self.original_stdout.flush()
-
-        sys.stdout = StdoutRedirector(self.log_text)
+        # 后台线程/进程的输出先进队列，再由主线程批量写入日志框
+        self.log_sink = TkLogSink(self.log_text).install()
 
     def on_tree_click(self, event):
         region = self.tree.identify("region", event.x, event.y)
@@ -186,68 +267,131 @@ class ImageConverterApp:
         os.makedirs(self.output_dir.get(), exist_ok=True)
         
         # 解析转换参数
-        width, height = map(int, self.resolution.get().split('x'))
-        compress = CompressMethod.RLE if self.compress_method.get() == "RLE" else CompressMethod.NONE
+        if self.resolution.get() == "全部":
+            sizes = ALL_SIZES
+        else:
+            sizes = [tuple(map(int, self.resolution.get().split('x')))]
+        color_format_str = self.color_format.get()
+        if color_format_str == "全部":
+            cfs = [ColorFormat.RGB565, ColorFormat.RGB565A8]
+        elif color_format_str == "自动识别":
+            cfs = [None]
+        else:
+            cfs = [ColorFormat[color_format_str]]
+        if self.compress_method.get() == "全部":
+            compresses = [CompressMethod.NONE, CompressMethod.RLE]
+        else:
+            compresses = [CompressMethod[self.compress_method.get()]]
 
         # 执行转换
-        self.convert_images(input_files, width, height, compress)
-
-    def convert_images(self, input_files, width, height, compress):
-        success_count = 0
-        total_files = len(input_files)
-        
-        for idx, file_path in enumerate(input_files):
+        self.convert_images(input_files, sizes, cfs, compresses)
+
+    def convert_images(self, input_files, sizes, cfs, compresses):
+        """把文件分给进程池转换，结果通过队列交回主线程"""
+        # 转换参数不同时已完成的记录不会被跳过
+        params = [[list(s) for s in sizes], [cf.name if cf else "AUTO" for cf in cfs],
+                  [c.name for c in compresses]]
+        workers = os.cpu_count() or 1
+        self.job = BatchJob(input_files,
+                            partial(convert_file, sizes=sizes, cfs=cfs, compresses=compresses),
+                            self.output_dir.get(), params,
+                            executor=ProcessPoolExecutor(max_workers=workers),
+                            workers=workers)
+        items = self.job.pending()
+        skipped = len(input_files) - len(items)
+        if skipped:
+            print(f"跳过 {skipped} 个已转换完成的文件\n")
+
+        for button in self.convert_buttons:
+            button.state(["disabled"])
+        self.pause_button.config(state=tk.NORMAL, text="暂停")
+        self.cancel_button.config(state=tk.NORMAL)
+        self.total_files = len(items)
+        self.done_files = 0
+        self.success_count = 0
+        self.start_time = time.perf_counter()
+        self.progress["maximum"] = max(self.total_files, 1)
+        self.progress["value"] = 0
+        self.status.set(f"0/{self.total_files}")
+
+        def on_done(input_path, ok, result, error):
+            self.results.put((input_path, ok, result, error))
+
+        self.job_thread = threading.Thread(target=self.run_job, args=(self.job, items, on_done),
+                                           daemon=True)
+        self.job_thread.start()
+        self.root.after(100, self.poll_results)
+
+    @staticmethod
+    def run_job(job, items, on_done):
+        try:
+            job.run(on_done, items)
+        finally:
+            job.executor.shutdown(cancel_futures=True)
+
+    def poll_results(self):
+        """在主线程中取出已完成的结果，更新日志、进度和速度"""
+        while True:
             try:
-                print(f"正在处理: {os.path.basename(file_path)}")
-                
-                with Image.open(file_path) as img:
-                    # 调整图片大小
-                    img = img.resize((width, height), Image.Resampling.LANCZOS)
-                    
-                    # 处理颜色格式
-                    color_format_str = self.color_format.get()
-                    if color_format_str == "自动识别":
-                        # 检测透明通道
-                        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
-                        if has_alpha:
-                            img = img.convert('RGBA')
-                            cf = ColorFormat.RGB565A8
-                        else:
-                            img = img.convert('RGB')
-                            cf = ColorFormat.RGB565
-                    else:
-                        if color_format_str == "RGB565A8":
-                            img = img.convert('RGBA')
-                            cf = ColorFormat.RGB565A8
-                        else:
-                            img = img.convert('RGB')
-                            cf = ColorFormat.RGB565
-
-                    # 保存调整后的图片
-                    base_name = os.path.splitext(os.path.basename(file_path))[0]
-                    output_image_path = os.path.join(self.output_dir.get(), f"{base_name}_{width}x{height}.png")
-                    img.save(output_image_path, 'PNG')
-
-                    # 创建临时文件
-                    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmpfile:
-                        temp_path = tmpfile.name
-                        img.save(temp_path, 'PNG')
-
-                    # 转换为LVGL C数组
-                    lvgl_img = LVGLImage().from_png(temp_path, cf=cf)
-                    output_c_path = os.path.join(self.output_dir.get(), f"{base_name}.c")
-                    lvgl_img.to_c_array(output_c_path, compress=compress)
-
-                    success_count += 1
-                    os.unlink(temp_path)
-                    print(f"成功转换: {base_name}.c\n")
-
-            except Exception as e:
-                print(f"转换失败: {str(e)}\n")
-
-        print(f"转换完成! 成功 {success_count}/{total_files} 个文件\n")
+                input_path, ok, lines, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if not ok:
+                lines = [f"正在处理: {os.path.basename(input_path)}", f"转换失败: {str(error)}"]
+            print("\n".join(lines) + "\n")
+            self.done_files += 1
+            self.success_count += ok
+
+        elapsed = time.perf_counter() - self.start_time
+        self.progress["value"] = self.done_files
+        if self.job.paused:
+            self.status.set(f"{self.done_files}/{self.total_files}  已暂停")
+        elif self.done_files:
+            rate = self.done_files / elapsed
+            eta = (self.total_files - self.done_files) / rate
+            self.status.set(f"{self.done_files}/{self.total_files}  "
+                            f"{rate:.1f} 个/秒  剩余约 {eta:.0f} 秒")
+
+        if self.job_thread.is_alive() or not self.results.empty():
+            self.root.after(100, self.poll_results)
+            return
+
+        for button in self.convert_buttons:
+            button.state(["!disabled"])
+        self.pause_button.config(state=tk.DISABLED, text="暂停")
+        self.cancel_button.config(state=tk.DISABLED)
+        if self.job.cancelled:
+            self.status.set(f"{self.done_files}/{self.total_files}  已取消")
+            print(f"已取消，成功 {self.success_count} 个文件，再次转换会从中断处继续\n")
+        else:
+            self.status.set(f"{self.total_files}/{self.total_files}  用时 {elapsed:.1f} 秒")
+            print(f"转换完成! 成功 {self.success_count}/{self.total_files} 个文件\n")
+        self.job = None
+
+    def toggle_pause(self):
+        if self.job is None:
+            return
+        if self.job.paused:
+            self.job.resume()
+            self.pause_button.config(text="暂停")
+        else:
+            # 正在转换的文件会继续完成，之后不再开始新的文件
+            self.job.pause()
+            self.pause_button.config(text="继续")
+
+    def cancel_conversion(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+            print("正在取消，正在转换的文件完成后停止\n")
+
+    def on_close(self):
+        if self.job is not None:
+            self.job.cancel()
+        self.root.destroy()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = ImageConverterApp(root)
     root.mainloop()
\ No newline at end of file
@@ -2,9 +2,9 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
 import threading
-import sys
-from convert_audio_to_p3 import encode_audio_to_opus
-from convert_p3_to_audio import decode_p3_to_audio
+from functools import partial
+from batch_job import BatchJob, audio_to_p3, p3_to_audio
+from tk_log import TkLogSink
 
 class AudioConverterApp:
     def __init__(self, master):
@@ -18,6 +18,7 @@ class AudioConverterApp:
         self.output_dir.set(os.path.abspath("output"))
         self.enable_loudnorm = tk.BooleanVar(value=True)
         self.target_lufs = tk.DoubleVar(value=-16.0)
+        self.job = None
 
         # 创建UI组件
         self.create_widgets()
@@ -85,6 +86,12 @@ class AudioConverterApp:
                   width=15).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="转换选中文件", command=lambda: self.start_conversion(False),
                   width=15).pack(side=tk.LEFT, padx=5)
+        self.pause_button = ttk.Button(button_frame, text="暂停", command=self.toggle_pause,
+                                       width=8, state=tk.DISABLED)
+        self.pause_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(button_frame, text="取消", command=self.cancel_conversion,
+                                        width=8, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
 
         # 日志区域
         log_frame = ttk.LabelFrame(self.master, text="日志")
@@ -147,20 +154,8 @@ class AudioConverterApp:
             self.output_dir.set(path)
 
     def redirect_output(self):
-        class StdoutRedirector:
-            def __init__(self, text_widget):
-                self.text_widget = text_widget
-                self.original_stdout = sys.stdout
-
-            def write(self, message):
-                self.text_widget.insert(tk.END, message)
-                self.text_widget.see(tk.END)
-                self.original_stdout.write(message)
-
-            def flush(self):
-                self.original_stdout.flush()
-
-        sys.stdout = StdoutRedirector(self.log_text)
+        # 后台线程/进程的输出先进队列，再由主线程批量写入日志框
+        self.log_sink = TkLogSink(self.log_text).install()
 
     def start_conversion(self, convert_all):
         """开始转换"""
@@ -174,46 +169,76 @@ class AudioConverterApp:
             messagebox.showwarning("警告", msg)
             return
         
-        os.makedirs(self.output_dir.get(), exist_ok=True)
+        if self.job is not None:
+            messagebox.showwarning("警告", "正在转换中")
+            return
 
         try:
+            # 已经转换完成的文件记录在输出目录中，中断后再次转换会跳过它们
             if self.mode.get() == "audio_to_p3":
                 target_lufs = self.target_lufs.get() if self.enable_loudnorm.get() else None
-                thread = threading.Thread(target=self.convert_audio_to_p3, args=(target_lufs, input_files))
+                convert = partial(audio_to_p3, target_lufs=target_lufs)
+                params = ["audio_to_p3", target_lufs]
             else:
-                thread = threading.Thread(target=self.convert_p3_to_audio, args=(input_files,))
-            
-            thread.start()
+                convert = p3_to_audio
+                params = ["p3_to_audio"]
+            self.job = BatchJob(input_files, convert, self.output_dir.get(), params)
+            self.job_thread = threading.Thread(target=self.run_job, args=(self.job,), daemon=True)
+            self.job_thread.start()
         except Exception as e:
+            self.job = None
             print(f"转换初始化失败: {str(e)}")
-
-    def convert_audio_to_p3(self, target_lufs, input_files):
-        """音频转P3转换逻辑"""
-        for input_path in input_files:
-            try:
-                filename = os.path.basename(input_path)
-                base_name = os.path.splitext(filename)[0]
-                output_path = os.path.join(self.output_dir.get(), f"{base_name}.p3")
-                
-                print(f"正在转换: {filename}")
-                encode_audio_to_opus(input_path, output_path, target_lufs)
-                print(f"转换成功: {filename}\n")
-            except Exception as e:
-                print(f"转换失败: {str(e)}\n")
-
-    def convert_p3_to_audio(self, input_files):
-        """P3转音频转换逻辑"""
-        for input_path in input_files:
-            try:
-                filename = os.path.basename(input_path)
-                base_name = os.path.splitext(filename)[0]
-                output_path = os.path.join(self.output_dir.get(), f"{base_name}.wav")
-                
-                print(f"正在转换: {filename}")
-                decode_p3_to_audio(input_path, output_path)
+            return
+        self.pause_button.config(state=tk.NORMAL, text="暂停")
+        self.cancel_button.config(state=tk.NORMAL)
+        self.master.after(200, self.check_job)
+
+    def run_job(self, job):
+        """在转换线程中执行，日志通过TkLogSink交给主线程"""
+        items = job.pending()
+        skipped = len(job.inputs) - len(items)
+        if skipped:
+            print(f"跳过 {skipped} 个已转换完成的文件\n")
+
+        def on_done(input_path, ok, result, error):
+            filename = os.path.basename(input_path)
+            if ok:
                 print(f"转换成功: {filename}\n")
-            except Exception as e:
-                print(f"转换失败: {str(e)}\n")
+            else:
+                print(f"转换失败: {filename}: {str(error)}\n")
+
+        succeeded, failed = job.run(on_done, items)
+        if job.cancelled:
+            print(f"已取消，完成 {succeeded} 个，再次转换会从中断处继续\n")
+        else:
+            print(f"转换完成! 成功 {succeeded} 个，失败 {failed} 个\n")
+
+    def check_job(self):
+        """主线程定时检查转换线程是否结束"""
+        if self.job_thread.is_alive():
+            self.master.after(200, self.check_job)
+            return
+        self.job = None
+        self.pause_button.config(state=tk.DISABLED, text="暂停")
+        self.cancel_button.config(state=tk.DISABLED)
+
+    def toggle_pause(self):
+        if self.job is None:
+            return
+        if self.job.paused:
+            self.job.resume()
+            self.pause_button.config(text="暂停")
+            print("继续转换\n")
+        else:
+            self.job.pause()
+            self.pause_button.config(text="继续")
+            print("已暂停，当前文件转换完成后停止\n")
+
+    def cancel_conversion(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+            print("正在取消，当前文件转换完成后停止\n")
 
 if __name__ == "__main__":
     root = tk.Tk()
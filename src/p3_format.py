@@ -0,0 +1,404 @@
+# P3 格式读写工具
+# p3格式(v1): 连续的数据包 [1字节类型, 1字节保留, 2字节长度, Opus数据]
+# P3v2: [文件头][与v1相同的数据包...][可选的数据包索引]
+#   文件头(32字节，大端): 'P3V2', 文件头长度(H), 版本(B), 声道数(B), 采样率(I),
+#       帧时长ms(H), 标志(H), 数据包数(I, 未知时为0xFFFFFFFF),
+#       响度LUFS(f, 未知时为NaN), 索引位置(Q, 没有索引时为0)
+#   索引: 'P3IX', 数据包数(I), 每个数据包头部在文件中的位置(I)...
+#   v1文件第一个字节是数据包类型0，不会以'P3V2'开头，读取时按开头4个字节区分版本
+import math
+import struct
+
+SAMPLE_RATE = 16000  # 采样率固定为16000Hz
+CHANNELS = 1  # 单声道
+FRAME_DURATION = 60  # 每帧60ms
+
+PACKET_HEADER = struct.Struct('>BBH')
+
+P3V2_MAGIC = b'P3V2'
+P3V2_HEADER = struct.Struct('>4sHBBIHHIfQ')
+P3V2_INDEX_MAGIC = b'P3IX'
+P3V2_INDEX_HEADER = struct.Struct('>4sI')
+P3V2_FLAG_INDEX = 0x0001
+UNKNOWN_PACKET_COUNT = 0xFFFFFFFF
+
+# Opus TOC 中 config 对应的单帧时长，单位为 48kHz 下的采样数 (RFC 6716 3.1)
+_SILK_FRAME_SAMPLES = (480, 960, 1920, 2880)
+_HYBRID_FRAME_SAMPLES = (480, 960)
+_CELT_FRAME_SAMPLES = (120, 240, 480, 960)
+
+
+def pack_p3_packet(opus_data, packet_type=0):
+    """
+    给一个Opus数据包加上4字节的P3头部
+    """
+    return PACKET_HEADER.pack(packet_type, 0, len(opus_data)) + opus_data
+
+
+def pack_p3v2_header(packets=None, loudness=None, index_offset=0,
+                     sample_rate=SAMPLE_RATE, channels=CHANNELS,
+                     frame_duration=FRAME_DURATION):
+    """
+    生成P3v2文件头，packets为None表示数据包数未知（流式输出）
+    """
+    flags = P3V2_FLAG_INDEX if index_offset else 0
+    return P3V2_HEADER.pack(P3V2_MAGIC, P3V2_HEADER.size, 2, channels,
+                            sample_rate, frame_duration, flags,
+                            UNKNOWN_PACKET_COUNT if packets is None else packets,
+                            math.nan if loudness is None else loudness,
+                            index_offset)
+
+
+def parse_p3_header(data):
+    """
+    解析P3文件开头的数据（至少32字节，文件更短时为整个文件），返回文件信息:
+    version, sample_rate, channels, frame_duration, packets (未知时为None),
+    loudness (未知时为None), data_offset (第一个数据包的位置),
+    index_offset (没有索引时为0)。v1文件返回固定的16kHz单声道60ms，
+    文件头中的版本不是2时抛出ValueError
+    """
+    if bytes(data[:4]) != P3V2_MAGIC or len(data) < P3V2_HEADER.size:
+        return {"version": 1, "sample_rate": SAMPLE_RATE, "channels": CHANNELS,
+                "frame_duration": FRAME_DURATION, "packets": None,
+                "loudness": None, "data_offset": 0, "index_offset": 0}
+    (_, header_size, version, channels, sample_rate, frame_duration, flags,
+     packets, loudness, index_offset) = P3V2_HEADER.unpack_from(data)
+    if version != 2:
+        raise ValueError(f"unsupported P3 version {version}")
+    if header_size < P3V2_HEADER.size:
+        raise ValueError(f"invalid P3v2 header size {header_size}")
+    return {"version": version, "sample_rate": sample_rate, "channels": channels,
+            "frame_duration": frame_duration,
+            "packets": None if packets == UNKNOWN_PACKET_COUNT else packets,
+            "loudness": None if math.isnan(loudness) else loudness,
+            "data_offset": header_size,
+            "index_offset": index_offset if flags & P3V2_FLAG_INDEX else 0}
+
+
+def read_p3_header(f):
+    """
+    从文件开头读取并解析文件头，把文件位置移到第一个数据包
+    """
+    f.seek(0)
+    header = parse_p3_header(f.read(P3V2_HEADER.size))
+    f.seek(header["data_offset"])
+    return header
+
+
+def p3_data_end(header, size):
+    """
+    数据包部分的结束位置：有索引时为索引开始的位置，否则为文件末尾
+    """
+    index_offset = header["index_offset"]
+    return index_offset if 0 < index_offset <= size else size
+
+
+def p3_duration(input_file):
+    """
+    只读取P3v2的32字节文件头，返回 (时长秒, 数据包数)。v1文件或数据包数
+    未知（流式写入）时返回None，这时只能扫描全部数据包
+    """
+    with open(input_file, 'rb') as f:
+        header = parse_p3_header(f.read(P3V2_HEADER.size))
+    if header["packets"] is None:
+        return None
+    return header["packets"] * header["frame_duration"] / 1000, header["packets"]
+
+
+def iter_p3_packets(data, header=None):
+    """
+    遍历内存中的P3数据（v1或v2），逐个返回Opus数据包（不含头部）
+    遇到被截断的末尾数据包时停止
+    """
+    view = memoryview(data)
+    if header is None:
+        header = parse_p3_header(view[:P3V2_HEADER.size])
+    offset = header["data_offset"]
+    end = p3_data_end(header, len(view))
+    while offset + 4 <= end:
+        _, _, opus_len = PACKET_HEADER.unpack_from(view, offset)
+        offset += 4
+        if offset + opus_len > end:
+            break
+        yield bytes(view[offset:offset + opus_len])
+        offset += opus_len
+
+
+def read_p3_file(input_file):
+    """
+    读取P3文件（v1或v2），返回 (文件信息, Opus数据包列表)
+    """
+    with open(input_file, 'rb') as f:
+        data = f.read()
+    header = parse_p3_header(data[:P3V2_HEADER.size])
+    return header, list(iter_p3_packets(data, header))
+
+
+def read_p3_packets(input_file):
+    """
+    读取P3文件中的全部Opus数据包
+    """
+    return read_p3_file(input_file)[1]
+
+
+def read_p3_index(data, header):
+    """
+    读取P3v2的数据包索引，返回每个数据包头部的位置列表，没有或损坏时返回None
+    """
+    offset = header["index_offset"]
+    if not offset or offset + P3V2_INDEX_HEADER.size > len(data):
+        return None
+    magic, count = P3V2_INDEX_HEADER.unpack_from(data, offset)
+    start = offset + P3V2_INDEX_HEADER.size
+    if magic != P3V2_INDEX_MAGIC or start + 4 * count > len(data):
+        return None
+    return list(struct.unpack_from(f'>{count}I', data, start))
+
+
+def load_p3_index(f, header):
+    """
+    从打开的文件中只读取P3v2的数据包索引部分，没有或损坏时返回None
+    """
+    offset = header["index_offset"]
+    if not offset:
+        return None
+    f.seek(offset)
+    data = f.read(P3V2_INDEX_HEADER.size)
+    if len(data) < P3V2_INDEX_HEADER.size:
+        return None
+    magic, count = P3V2_INDEX_HEADER.unpack(data)
+    data = f.read(4 * count)
+    if magic != P3V2_INDEX_MAGIC or len(data) < 4 * count:
+        return None
+    return list(struct.unpack(f'>{count}I', data))
+
+
+def seek_p3_packet(f, header, packet, data_end):
+    """
+    把文件位置移到第packet个数据包的头部，返回实际跳过的数据包数
+    （文件中的数据包不够时较少）。有索引时直接跳转，否则逐个读取数据包头部
+    """
+    if packet <= 0:
+        f.seek(header["data_offset"])
+        return 0
+    index = load_p3_index(f, header)
+    if index is not None:
+        packet = min(packet, len(index))
+        f.seek(index[packet] if packet < len(index) else data_end)
+        return packet
+    offset = header["data_offset"]
+    skipped = 0
+    f.seek(offset)
+    while skipped < packet and offset + 4 <= data_end:
+        data = f.read(4)
+        if len(data) < 4:
+            break
+        _, _, opus_len = PACKET_HEADER.unpack(data)
+        if offset + 4 + opus_len > data_end:
+            break
+        offset += 4 + opus_len
+        skipped += 1
+        f.seek(offset)
+    f.seek(offset)
+    return skipped
+
+
+class P3Writer:
+    """
+    按P3格式逐个写入数据包。version为2时先写文件头，close时在末尾写入
+    数据包索引并回填文件头中的数据包数和索引位置；输出不能seek（管道、
+    HTTP响应）时数据包数保持未知，也不写索引
+    """
+
+    def __init__(self, stream, version=1, loudness=None, index=True,
+                 sample_rate=SAMPLE_RATE, channels=CHANNELS,
+                 frame_duration=FRAME_DURATION):
+        self.stream = stream
+        self.version = version
+        self.loudness = loudness
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_duration = frame_duration
+        self.count = 0
+        self.offsets = []
+        try:
+            self.seekable = stream.seekable()
+        except AttributeError:
+            self.seekable = False
+        # 只有P3v2会写索引，v1不收集数据包位置
+        self.index = index and self.seekable and version == 2
+        self.position = stream.tell() if self.seekable else 0
+        self.start = self.position
+        if version == 2:
+            self._write(self._header(None, 0))
+
+    def _header(self, packets, index_offset):
+        return pack_p3v2_header(packets, self.loudness, index_offset,
+                                self.sample_rate, self.channels, self.frame_duration)
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.position += len(data)
+
+    def write(self, opus_data):
+        """写入一个Opus数据包（不含P3头部）"""
+        if self.index:
+            self.offsets.append(self.position - self.start)
+        self._write(pack_p3_packet(opus_data))
+        self.count += 1
+
+    def write_packed(self, packet):
+        """写入已经带4字节P3头部的数据包"""
+        if self.index:
+            self.offsets.append(self.position - self.start)
+        self._write(packet)
+        self.count += 1
+
+    def close(self):
+        if self.version != 2 or not self.seekable:
+            return
+        index_offset = 0
+        if self.index:
+            index_offset = self.position - self.start
+            self._write(P3V2_INDEX_HEADER.pack(P3V2_INDEX_MAGIC, len(self.offsets)))
+            self._write(struct.pack(f'>{len(self.offsets)}I', *self.offsets))
+        end = self.stream.tell()
+        self.stream.seek(self.start)
+        self.stream.write(self._header(self.count, index_offset))
+        self.stream.seek(end)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+def write_p3_packets(output_file, packets, version=1, loudness=None, index=True,
+                     sample_rate=SAMPLE_RATE, channels=CHANNELS,
+                     frame_duration=FRAME_DURATION):
+    """
+    把Opus数据包按P3格式写入文件，version为2时写P3v2文件头和索引，
+    文件头中记录sample_rate、channels和frame_duration
+    """
+    with open(output_file, 'wb') as f, \
+            P3Writer(f, version, loudness, index, sample_rate=sample_rate,
+                     channels=channels, frame_duration=frame_duration) as writer:
+        for p in packets:
+            writer.write(p)
+
+
+def opus_frame_samples(toc):
+    """
+    根据TOC字节返回单帧时长（48kHz下的采样数）
+    """
+    config = toc >> 3
+    if config < 12:
+        return _SILK_FRAME_SAMPLES[config & 0x03]
+    if config < 16:
+        return _HYBRID_FRAME_SAMPLES[config & 0x01]
+    return _CELT_FRAME_SAMPLES[config & 0x03]
+
+
+def opus_frame_count(packet):
+    """
+    根据TOC字节返回数据包中的帧数，数据包不合法时返回0
+    """
+    if not packet:
+        return 0
+    code = packet[0] & 0x03
+    if code == 0:
+        return 1
+    if code in (1, 2):
+        return 2
+    if len(packet) < 2:
+        return 0
+    return packet[1] & 0x3f
+
+
+def opus_packet_samples(packet):
+    """
+    返回数据包的总时长（48kHz下的采样数），数据包不合法时返回0
+    """
+    if not packet:
+        return 0
+    return opus_frame_count(packet) * opus_frame_samples(packet[0])
+
+
+class OpusBatchDecoder:
+    """
+    批量解码Opus数据包，PCM直接写入调用者提供的int16 numpy数组，
+    不像 opuslib.Decoder.decode 那样为每个数据包创建ctypes缓冲区和bytes对象。
+    opuslib和numpy只在创建解码器时导入，不影响只读头部的工具的启动速度
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        import opuslib.api
+        import opuslib.api.decoder
+
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_size = sample_rate * FRAME_DURATION // 1000
+        # 单个Opus数据包最长120ms
+        self.max_frame_size = sample_rate * 120 // 1000
+        self._api = opuslib.api
+        self._state = opuslib.api.decoder.create_state(sample_rate, channels)
+
+    def __del__(self):
+        state = getattr(self, "_state", None)
+        if state is not None:
+            self._api.decoder.destroy(state)
+            self._state = None
+
+    def decode_into(self, packets, out, offset=0):
+        """
+        依次解码packets，从out的第offset个采样（每声道）开始写入，
+        out为C连续的一维int16数组，多声道时交错存放。返回写入的采样数（每声道）
+        """
+        import ctypes
+        from opuslib.exceptions import OpusError
+
+        if out.dtype.itemsize != 2 or out.dtype.kind != 'i' or not out.flags.c_contiguous:
+            raise ValueError("out must be a C-contiguous int16 array")
+        if not out.flags.writeable:
+            raise ValueError("out must be writeable")
+        decode = self._api.decoder.libopus_decode
+        pointer_type = self._api.c_int16_pointer
+        state = self._state
+        capacity = len(out) // self.channels
+        frame_bytes = 2 * self.channels
+        base = out.ctypes.data
+        pos = offset
+        for packet in packets:
+            space = min(capacity - pos, self.max_frame_size)
+            if space <= 0:
+                raise ValueError("output buffer is full")
+            pcm = ctypes.cast(base + pos * frame_bytes, pointer_type)
+            result = decode(state, packet, len(packet), pcm, space, 0)
+            if result < 0:
+                raise OpusError(result)
+            pos += result
+        return pos - offset
+
+    def decode_all(self, packets, progress=None, batch=500):
+        """
+        解码全部数据包，返回int16数组（多声道时为 采样数 x 声道数）。
+        输出长度由TOC字节算出，一次分配。progress不为None时分批解码，
+        每批结束后调用 progress(这一批的数据包数)
+        """
+        import numpy as np
+
+        packets = packets if isinstance(packets, list) else list(packets)
+        samples = sum(opus_packet_samples(p) for p in packets) * self.sample_rate // 48000
+        out = np.empty((samples + self.max_frame_size) * self.channels, dtype=np.int16)
+        if progress is None:
+            count = self.decode_into(packets, out)
+        else:
+            count = 0
+            for i in range(0, len(packets), batch):
+                chunk = packets[i:i + batch]
+                count += self.decode_into(chunk, out, count)
+                progress(len(chunk))
+        out = out[:count * self.channels]
+        return out.reshape(-1, self.channels) if self.channels > 1 else out
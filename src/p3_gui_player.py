@@ -2,11 +2,14 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
 import time
-import opuslib
 import struct
 import numpy as np
 import sounddevice as sd
 import os
+from pathlib import Path
+from p3_probe import probe_p3, is_valid
+from p3_format import OpusBatchDecoder, read_p3_header, p3_data_end, p3_duration
+from p3_playlist import Playlist, VirtualPlaylistView
 
 
 def play_p3_file(input_file, stop_event=None, pause_event=None):
@@ -15,12 +18,15 @@ def play_p3_file(input_file, stop_event=None, pause_event=None):
     p3格式: [1字节类型, 1字节保留, 2字节长度, Opus数据]
     """
     # 初始化Opus解码器
-    sample_rate = 16000  # 采样率固定为16000Hz
-    channels = 1  # 单声道
-    decoder = opuslib.Decoder(sample_rate, channels)
-    
-    # 帧大小 (60ms)
-    frame_size = int(sample_rate * 60 / 1000)
+    # v1文件固定为16kHz单声道，P3v2从文件头读取
+    with open(input_file, 'rb') as f:
+        info = read_p3_header(f)
+        data_end = p3_data_end(info, os.fstat(f.fileno()).st_size)
+    sample_rate = info["sample_rate"]
+    channels = info["channels"]
+    decoder = OpusBatchDecoder(sample_rate, channels)
+    # 解码结果直接写入这个缓冲区，不为每个数据包分配新的内存
+    pcm_buffer = np.empty(decoder.max_frame_size * channels, dtype=np.int16)
     
     # 打开音频流
     stream = sd.OutputStream(
@@ -33,6 +39,7 @@ def play_p3_file(input_file, stop_event=None, pause_event=None):
     try:
         with open(input_file, 'rb') as f:
             print(f"正在播放: {input_file}")
+            f.seek(info["data_offset"])
             
             while True:
                 if stop_event and stop_event.is_set():
@@ -42,7 +49,9 @@ def play_p3_file(input_file, stop_event=None, pause_event=None):
                     time.sleep(0.1)
                     continue
 
-                # 读取头部 (4字节)
+                # 读取头部 (4字节)，P3v2读到索引为止
+                if f.tell() + 4 > data_end:
+                    break
                 header = f.read(4)
                 if not header or len(header) < 4:
                     break
@@ -56,16 +65,13 @@ def play_p3_file(input_file, stop_event=None, pause_event=None):
                     break
                 
                 # 解码Opus数据
-                pcm_data = decoder.decode(opus_data, frame_size)
-                
-                # 将字节转换为numpy数组
-                audio_array = np.frombuffer(pcm_data, dtype=np.int16)
+                samples = decoder.decode_into((opus_data,), pcm_buffer)
                 
                 # 播放音频
-                stream.write(audio_array)
+                stream.write(pcm_buffer[:samples * channels])
                 
                 # 等待一帧的时间
-                time.sleep(60 / 1000)  # 60ms
+                time.sleep(info["frame_duration"] / 1000)
             
             # 播放结束后添加0.5秒静音，避免破音
             silence = np.zeros(int(sample_rate / 2), dtype=np.int16)
@@ -87,8 +93,8 @@ class P3PlayerApp:
         self.root.geometry("680x600")  # 调整窗口大小
 
         # 初始化变量
-        self.playlist = []
-        self.current_index = 0
+        self.playlist = Playlist()
+        self.current_id = None  # 当前播放的条目id
         self.is_playing = False
         self.is_paused = False
         self.stop_event = threading.Event()
@@ -108,19 +114,23 @@ class P3PlayerApp:
         # 文件操作按钮
         ttk.Button(file_frame, text="添加文件", command=self.add_file,
                   width=12).grid(row=0, column=0, padx=5, pady=2)
-        ttk.Button(file_frame, text="移除选中", command=self.remove_selected,
+        ttk.Button(file_frame, text="添加目录", command=self.add_directory,
                   width=12).grid(row=0, column=1, padx=5, pady=2)
-        ttk.Button(file_frame, text="清空列表", command=self.clear_files,
+        ttk.Button(file_frame, text="移除选中", command=self.remove_selected,
                   width=12).grid(row=0, column=2, padx=5, pady=2)
-
-        # 文件列表（使用Treeview）
-        self.tree = ttk.Treeview(file_frame, columns=("selected", "filename"), 
-                               show="headings", height=8)
-        self.tree.heading("selected", text="选中", anchor=tk.W)
-        self.tree.heading("filename", text="文件名", anchor=tk.W)
-        self.tree.column("selected", width=60, anchor=tk.W)
-        self.tree.column("filename", width=600, anchor=tk.W)
-        self.tree.grid(row=1, column=0, columnspan=3, sticky="nsew", padx=5, pady=2)
+        ttk.Button(file_frame, text="清空列表", command=self.clear_files,
+                  width=12).grid(row=0, column=3, padx=5, pady=2)
+
+        # 文件列表（只渲染可见行，几千个文件也不卡）
+        self.view = VirtualPlaylistView(file_frame, self.playlist, [
+            ("selected", "选中", 60),
+            ("filename", "文件名", 360),
+            ("duration", "时长", 80),
+            ("packets", "数据包", 70),
+            ("status", "状态", 70),
+        ], self.playlist_row)
+        self.view.grid(row=1, column=0, columnspan=4, padx=5, pady=2)
+        self.tree = self.view.tree
         self.tree.bind("<ButtonRelease-1>", self.on_tree_click)
 
         # 控制按钮
@@ -154,42 +164,69 @@ class P3PlayerApp:
         if region == "cell":
             col = self.tree.identify_column(event.x)
             item = self.tree.identify_row(event.y)
-            if col == "#1":  # 点击的是选中列
-                current_val = self.tree.item(item, "values")[0]
-                new_val = "[√]" if current_val == "[ ]" else "[ ]"
-                self.tree.item(item, values=(new_val, self.tree.item(item, "values")[1]))
+            entry = self.view.entry_at(item)
+            if col == "#1" and entry is not None:  # 点击的是选中列
+                entry.checked = not entry.checked
+                self.view.refresh_entry(entry.id)
 
     def add_file(self):
         files = filedialog.askopenfilenames(filetypes=[("P3 文件", "*.p3")])
         if files:
-            for file in files:
-                self.playlist.append(file)
-                self.tree.insert("", tk.END, values=("[ ]", os.path.basename(file)), tags=(file,))
+            self.playlist.extend(files)
+            self.view.refresh()
+
+    def add_directory(self):
+        """添加目录（包括子目录）中的所有p3文件"""
+        directory = filedialog.askdirectory()
+        if directory:
+            files = sorted(str(f) for f in Path(directory).rglob("*.p3"))
+            self.playlist.extend(files)
+            self.view.refresh()
+            self.update_status(f"已添加 {len(files)} 个文件", "blue")
+
+    def playlist_row(self, entry):
+        """
+        生成播放列表中一行的内容，第一次显示时读取时长等信息。
+        P3v2文件只读文件头，v1文件需要扫描数据包头部
+        """
+        if entry.info is None:
+            try:
+                header = p3_duration(entry.path)
+                if header is not None:
+                    # 文件头中的时长，不检查数据包是否损坏
+                    entry.info = (f"{header[0]:.2f}s", header[1], "未扫描")
+                else:
+                    info = probe_p3(entry.path)
+                    duration = f"{info['duration']:.2f}s"
+                    status = "正常" if is_valid(info) else "已损坏"
+                    entry.info = (duration, info["packets"], status)
+            except (OSError, ValueError):
+                # 读取失败或文件头损坏（如header_size不合法、版本不支持）
+                entry.info = ("-", "-", "无法读取")
+        return ("[√]" if entry.checked else "[ ]", os.path.basename(entry.path)) + entry.info
 
     def remove_selected(self):
         """移除选中的文件"""
-        to_remove = []
-        for item in self.tree.get_children():
-            if self.tree.item(item, "values")[0] == "[√]":
-                to_remove.append(item)
-        
-        for item in reversed(to_remove):
-            file_path = self.tree.item(item, "tags")[0]
-            if file_path == self.playlist[self.current_index]:  # 检查是否正在播放的文件
-                self.stop()  # 如果是，则停止播放
-            elif self.playlist.index(file_path) < self.current_index:  # 如果文件在当前播放文件之前
-                self.current_index -= 1  # 调整 current_index
-            self.tree.delete(item)
-            self.playlist.remove(file_path)
+        to_remove = set(self.playlist.checked())
+        if not to_remove:
+            return
+        if self.current_id in to_remove:
+            if self.is_playing or self.is_paused:
+                self.stop()  # 正在播放的文件被移除时停止播放
+            # 当前文件改为它后面第一个没有被移除的文件
+            position = self.playlist.index(self.current_id)
+            following = (e.id for e in self.playlist.entries[position:] if e.id not in to_remove)
+            self.current_id = next(following, None)
+        self.playlist.remove(to_remove)
+        self.view.refresh()
 
     def clear_files(self):
         """清空所有文件"""
         if self.is_playing or self.is_paused:
             self.stop()  # 如果正在播放，则停止播放
-        for item in self.tree.get_children():
-            self.tree.delete(item)
         self.playlist.clear()
-        self.current_index = 0  # 重置 current_index
+        self.current_id = None
+        self.view.refresh()
 
     def update_status(self, status_text, color="blue"):
         """更新状态标签的内容"""
@@ -210,16 +247,15 @@ class P3PlayerApp:
                 self.play_thread = None
 
             # 检查是否有选中的文件
-            selected_items = self.tree.selection()
-            if selected_items:
-                self.current_index = self.tree.index(selected_items[0])  # 更新为选中文件的索引
+            if self.view.selected_id in self.playlist:
+                self.current_id = self.view.selected_id
 
-            # 检查 current_index 是否有效
-            if self.current_index >= len(self.playlist):
-                self.current_index = 0  # 如果无效，则重置为 0
+            # 当前文件已被移除时从第一个开始
+            if self.current_id not in self.playlist:
+                self.current_id = self.playlist[0].id
 
             # 更新状态标签
-            self.update_status(f"正在播放：{os.path.basename(self.playlist[self.current_index])}", "green")
+            self.update_status(f"正在播放：{os.path.basename(self.playlist.get(self.current_id).path)}", "green")
 
             # 启动新的播放线程
             self.is_playing = True
@@ -237,21 +273,12 @@ class P3PlayerApp:
                 time.sleep(0.1)
                 continue
 
-            # 检查当前索引是否有效
-            if self.current_index >= len(self.playlist):
-                if self.loop_playback.get():  # 如果勾选了循环播放
-                    self.current_index = 0  # 回到第一首
-                else:
-                    break  # 否则停止播放
-
-            file = self.playlist[self.current_index]
-            if file not in self.playlist:  # 检查文件是否仍在播放列表中
+            entry = self.playlist.get(self.current_id)
+            if entry is None:  # 检查文件是否仍在播放列表中
                 break  # 如果文件被移除，则停止播放
 
-            self.tree.selection_clear()
-            self.tree.selection_set(self.tree.get_children()[self.current_index])
-            self.tree.focus(self.tree.get_children()[self.current_index])
-            play_p3_file(file, self.stop_event, self.pause_event)
+            self.view.select(entry.id)  # 选中并滚动到正在播放的文件
+            play_p3_file(entry.path, self.stop_event, self.pause_event)
 
             if self.stop_event.is_set():
                 break
@@ -259,10 +286,12 @@ class P3PlayerApp:
             if not self.loop_playback.get():  # 如果没有勾选循环播放
                 break  # 播放完当前文件后停止
 
-            self.current_index += 1
-            if self.current_index >= len(self.playlist):
-                if self.loop_playback.get():  # 如果勾选了循环播放
-                    self.current_index = 0  # 回到第一首
+            if self.current_id not in self.playlist:  # 播放期间被移除
+                break
+            position = self.playlist.index(self.current_id) + 1
+            if position >= len(self.playlist):
+                position = 0  # 循环播放，回到第一首
+            self.current_id = self.playlist[position].id
 
         self.is_playing = False
         self.is_paused = False
@@ -276,7 +305,7 @@ class P3PlayerApp:
                 self.update_status("播放已暂停", "orange")
             else:
                 self.pause_event.clear()
-                self.update_status(f"正在播放：{os.path.basename(self.playlist[self.current_index])}", "green")
+                self.update_status(f"正在播放：{os.path.basename(self.playlist.get(self.current_id).path)}", "green")
 
     def stop(self):
         if self.is_playing or self.is_paused:
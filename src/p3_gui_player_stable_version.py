@@ -7,6 +7,7 @@ import struct
 import numpy as np
 import sounddevice as sd
 import os
+from p3_format import read_p3_header, p3_data_end
 
 
 def play_p3_file(input_file, stop_event=None, pause_event=None):
@@ -15,8 +16,12 @@ def play_p3_file(input_file, stop_event=None, pause_event=None):
     p3格式: [1字节类型, 1字节保留, 2字节长度, Opus数据]
     """
     # 初始化Opus解码器
-    sample_rate = 16000  # 采样率固定为16000Hz
-    channels = 1  # 单声道
+    # v1文件固定为16kHz单声道，P3v2从文件头读取
+    with open(input_file, 'rb') as f:
+        info = read_p3_header(f)
+        data_end = p3_data_end(info, os.fstat(f.fileno()).st_size)
+    sample_rate = info["sample_rate"]
+    channels = info["channels"]
     decoder = opuslib.Decoder(sample_rate, channels)
     
     # 帧大小 (60ms)
@@ -33,6 +38,7 @@ def play_p3_file(input_file, stop_event=None, pause_event=None):
     try:
         with open(input_file, 'rb') as f:
             print(f"正在播放: {input_file}")
+            f.seek(info["data_offset"])
             
             while True:
                 if stop_event and stop_event.is_set():
@@ -42,7 +48,9 @@ def play_p3_file(input_file, stop_event=None, pause_event=None):
                     time.sleep(0.1)
                     continue
 
-                # 读取头部 (4字节)
+                # 读取头部 (4字节)，P3v2读到索引为止
+                if f.tell() + 4 > data_end:
+                    break
                 header = f.read(4)
                 if not header or len(header) < 4:
                     break
@@ -65,7 +73,7 @@ def play_p3_file(input_file, stop_event=None, pause_event=None):
                 stream.write(audio_array)
                 
                 # 等待一帧的时间
-                time.sleep(60 / 1000)  # 60ms
+                time.sleep(info["frame_duration"] / 1000)
             
             # 播放结束后添加0.5秒静音，避免破音
             silence = np.zeros(int(sample_rate / 2), dtype=np.int16)
@@ -0,0 +1,246 @@
+# P3 与 OGG(Opus) 之间的无损互转
+# 两者都是 16kHz 单声道 60ms 的 Opus 数据包，只需要重新封装，不需要解码再编码
+import os
+import sys
+import struct
+import random
+import zlib
+import argparse
+from p3_format import (SAMPLE_RATE, CHANNELS, read_p3_packets,
+                       write_p3_packets, opus_packet_samples)
+
+# P3 没有记录编码器的预跳过采样数。P3数据包都由libopus编码，开头是编码器
+# 6.5ms的lookahead，即48kHz下312个采样，和opusenc、ffmpeg写入的值相同。
+# 导出OGG时写入这个值让播放器跳过这段采样
+PRE_SKIP = 312
+# 每个OGG页最多容纳的时长（48kHz采样数），与ffmpeg的默认值一致，约1秒
+MAX_PAGE_GRANULE = 48000
+VENDOR = b'xiaozhi p3_ogg_remux'
+
+OGG_PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+FLAG_CONTINUED = 0x01
+FLAG_BOS = 0x02
+FLAG_EOS = 0x04
+
+
+# OGG的CRC32（多项式0x04C11DB7，初值0，不反转）和zlib.crc32的区别只是位序、
+# 初值和结果取反：把每个字节按位反转后用zlib计算，再把结果按位反转，
+# 整个计算都在C代码中完成
+_BIT_REVERSE = bytes(int(f'{i:08b}'[::-1], 2) for i in range(256))
+
+
+def ogg_crc(data):
+    """
+    OGG页校验和（多项式0x04C11DB7，初值0，不反转）
+    """
+    crc = zlib.crc32(bytes(data).translate(_BIT_REVERSE), 0xffffffff) ^ 0xffffffff
+    return int(f'{crc:032b}'[::-1], 2)
+
+
+def _ogg_page(header_type, granule, serial, seqno, packets):
+    segments = bytearray()
+    for p in packets:
+        segments += b'\xff' * (len(p) // 255)
+        segments.append(len(p) % 255)
+    if len(segments) > 255:
+        raise ValueError("too many segments in one ogg page")
+    page = bytearray(OGG_PAGE_HEADER.pack(b'OggS', 0, header_type, granule,
+                                          serial, seqno, 0, len(segments)))
+    page += segments
+    for p in packets:
+        page += p
+    struct.pack_into('<I', page, 22, ogg_crc(page))
+    return page
+
+
+def _segment_count(packet):
+    return len(packet) // 255 + 1
+
+
+def p3_packets_to_ogg(packets, serial=None, pre_skip=PRE_SKIP):
+    """
+    把Opus数据包封装为OGG Opus文件内容。OpusHead中写入pre_skip，最后一页
+    的granule为全部数据包的采样数：P3不记录末尾补齐的静音，不裁剪末尾
+    """
+    if serial is None:
+        serial = random.getrandbits(32)
+
+    opus_head = struct.pack('<8sBBHIhB', b'OpusHead', 1, CHANNELS, pre_skip,
+                            SAMPLE_RATE, 0, 0)
+    opus_tags = struct.pack('<8sI', b'OpusTags', len(VENDOR)) + VENDOR + \
+        struct.pack('<I', 0)
+
+    pages = [_ogg_page(FLAG_BOS, 0, serial, 0, [opus_head]),
+             _ogg_page(0, 0, serial, 1, [opus_tags])]
+    seqno = 2
+    granule = 0
+    page_packets = []
+    page_segments = 0
+    page_start = 0
+
+    for i, packet in enumerate(packets):
+        nseg = _segment_count(packet)
+        if page_packets and (page_segments + nseg > 255 or
+                             granule - page_start >= MAX_PAGE_GRANULE):
+            pages.append(_ogg_page(0, granule, serial, seqno, page_packets))
+            seqno += 1
+            page_packets = []
+            page_segments = 0
+            page_start = granule
+        page_packets.append(packet)
+        page_segments += nseg
+        granule += opus_packet_samples(packet)
+
+    # 最后一页带上EOS标记，即使没有音频数据也要结束逻辑流
+    pages.append(_ogg_page(FLAG_EOS, granule, serial, seqno, page_packets))
+    return b''.join(pages)
+
+
+def iter_ogg_packets(data):
+    """
+    遍历OGG文件中的全部数据包（包括OpusHead和OpusTags），返回
+    (数据包, 数据包结束所在页的granule)
+    """
+    view = memoryview(data)
+    offset = 0
+    pending = []
+    stream_serial = None
+    while offset + OGG_PAGE_HEADER.size <= len(view):
+        (capture, version, header_type, granule, serial, seqno, crc,
+         nseg) = OGG_PAGE_HEADER.unpack_from(view, offset)
+        if capture != b'OggS':
+            raise ValueError(f"invalid ogg page at offset {offset}")
+        lacing = view[offset + OGG_PAGE_HEADER.size:
+                      offset + OGG_PAGE_HEADER.size + nseg]
+        pos = offset + OGG_PAGE_HEADER.size + nseg
+        end = pos + sum(lacing)
+        if len(lacing) < nseg or end > len(view):
+            raise ValueError(f"truncated ogg page at offset {offset}")
+        # 校验和按校验和字段为0的整页计算
+        page = bytearray(view[offset:end])
+        page[22:26] = b'\0\0\0\0'
+        if ogg_crc(page) != crc:
+            raise ValueError(f"ogg page checksum mismatch at offset {offset}")
+        if stream_serial is None:
+            stream_serial = serial
+        elif serial != stream_serial:
+            raise ValueError(f"ogg page at offset {offset} belongs to another "
+                             f"logical stream, multiplexed or chained ogg is not supported")
+        if not header_type & FLAG_CONTINUED:
+            pending = []
+        for lace in lacing:
+            pending.append(view[pos:pos + lace])
+            pos += lace
+            if lace < 255:
+                yield b''.join(pending), granule
+                pending = []
+        offset = pos
+
+
+def ogg_to_p3_packets(data):
+    """
+    从OGG Opus文件内容中取出音频数据包。按OpusHead的pre-skip和最后一页的
+    granule裁剪：完全落在pre-skip内和最后granule之后的数据包被丢弃。
+    只能按整个数据包裁剪，剩余不足一个数据包的部分仍会被播放，
+    开头剩余的采样数和PRE_SKIP不同时给出提示
+    """
+    packets = iter_ogg_packets(data)
+    head, _ = next(packets, (b'', 0))
+    if not head.startswith(b'OpusHead') or len(head) < 19:
+        raise ValueError("not an ogg opus stream")
+    if head[9] != CHANNELS:
+        raise ValueError(f"only mono stream is supported, got {head[9]} channels")
+    pre_skip, = struct.unpack_from('<H', head, 10)
+    next(packets, None)  # OpusTags
+
+    result = []
+    samples = []
+    end = None
+    for packet, granule in packets:
+        result.append(packet)
+        samples.append(opus_packet_samples(packet))
+        end = granule
+    total = sum(samples)
+    if end is None or end < 0:  # 没有音频或最后一页没有granule，不裁剪末尾
+        end = total
+
+    first = 0
+    while first < len(result) and samples[first] <= pre_skip:
+        pre_skip -= samples[first]
+        first += 1
+    last = len(result)
+    while last > first and total - samples[last - 1] >= end:
+        total -= samples[last - 1]
+        last -= 1
+    if first or last < len(result):
+        print(f"Trimmed {first} leading and {len(result) - last} trailing packets "
+              f"outside the playable range", file=sys.stderr)
+    result, samples = result[first:last], samples[first:last]
+    if result and pre_skip != PRE_SKIP:
+        print(f"Warning: {pre_skip} samples of pre-skip (48kHz) remain, P3 can't "
+              f"record it and players assume {PRE_SKIP}", file=sys.stderr)
+
+    odd = sum(1 for n in samples if n != 2880)
+    if odd:
+        print(f"Warning: {odd} of {len(result)} packets are not 60ms, "
+              f"the device may not play them correctly", file=sys.stderr)
+    return result
+
+
+def remux_file(input_file, output_file, p3_version=1):
+    """
+    根据扩展名判断方向，完成单个文件的互转，p3_version为输出P3文件的版本
+    """
+    if input_file.lower().endswith('.p3'):
+        data = p3_packets_to_ogg(read_p3_packets(input_file))
+        with open(output_file, 'wb') as f:
+            f.write(data)
+    else:
+        with open(input_file, 'rb') as f:
+            data = f.read()
+        write_p3_packets(output_file, ogg_to_p3_packets(data), p3_version)
+
+
+def remux_dir(input_dir, output_dir, to_ext=None, p3_version=1):
+    """
+    转换目录中的全部P3/OGG文件，to_ext为None时每个文件都转为另一种格式
+    """
+    opposite = {'.p3': '.ogg', '.ogg': '.p3'}
+    os.makedirs(output_dir, exist_ok=True)
+    count = 0
+    for name in sorted(os.listdir(input_dir)):
+        base, ext = os.path.splitext(name)
+        target = opposite.get(ext.lower())
+        if target is None or to_ext is not None and target != to_ext:
+            continue
+        try:
+            remux_file(os.path.join(input_dir, name),
+                       os.path.join(output_dir, base + target), p3_version)
+            count += 1
+        except Exception as e:
+            print(f"转换失败: {name}: {str(e)}", file=sys.stderr)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='P3与OGG(Opus)互转，只重新封装数据包，不重新编码')
+    parser.add_argument('input', help='输入的p3/ogg文件或目录')
+    parser.add_argument('output', help='输出文件或目录')
+    parser.add_argument('--to', choices=['ogg', 'p3'],
+                        help='目录模式下只转换为这种格式（默认: 每个文件转为另一种格式）')
+    parser.add_argument('--p3v2', action='store_true',
+                        help='输出带文件头和索引的P3v2（默认: P3 v1）')
+    args = parser.parse_args()
+
+    p3_version = 2 if args.p3v2 else 1
+    if os.path.isdir(args.input):
+        to_ext = '.' + args.to if args.to else None
+        count = remux_dir(args.input, args.output, to_ext, p3_version)
+        print(f"done {count} files")
+    else:
+        remux_file(args.input, args.output, p3_version)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# 大播放列表的数据结构和只渲染可见行的列表控件
+# 几千上万个文件的语音包也能快速添加、删除和滚动
+import itertools
+import tkinter as tk
+from tkinter import ttk
+
+
+class PlaylistEntry:
+    __slots__ = ("id", "path", "checked", "info")
+
+    def __init__(self, entry_id, path):
+        self.id = entry_id
+        self.path = path
+        self.checked = False
+        # 显示用的信息，第一次显示时才读取
+        self.info = None
+
+
+class Playlist:
+    """
+    有序的播放列表，每个条目有唯一id。按id取条目和取位置都是O(1)，
+    批量添加为O(k)，批量删除为O(n)，不会在循环里反复查找和删除
+    """
+
+    def __init__(self):
+        self.entries = []
+        self._by_id = {}
+        self._pos = {}
+        self._ids = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def __contains__(self, entry_id):
+        return entry_id in self._by_id
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def get(self, entry_id):
+        return self._by_id.get(entry_id)
+
+    def index(self, entry_id):
+        return self._pos[entry_id]
+
+    def extend(self, paths):
+        """在末尾批量添加文件，返回新条目的id列表"""
+        ids = []
+        for path in paths:
+            entry = PlaylistEntry(next(self._ids), path)
+            self._by_id[entry.id] = entry
+            self._pos[entry.id] = len(self.entries)
+            self.entries.append(entry)
+            ids.append(entry.id)
+        return ids
+
+    def remove(self, entry_ids):
+        """批量删除条目，只重建一次位置索引"""
+        entry_ids = set(entry_ids) & self._by_id.keys()
+        if not entry_ids:
+            return
+        self.entries = [e for e in self.entries if e.id not in entry_ids]
+        for entry_id in entry_ids:
+            del self._by_id[entry_id]
+        self._pos = {e.id: i for i, e in enumerate(self.entries)}
+
+    def clear(self):
+        self.entries = []
+        self._by_id.clear()
+        self._pos.clear()
+
+    def checked(self):
+        return [e.id for e in self.entries if e.checked]
+
+
+class VirtualPlaylistView:
+    """
+    只为可见的行创建Treeview条目的播放列表控件，滚动时把可见区域对应的
+    播放列表条目填进这些行，所以列表多长都不影响添加和滚动的速度。
+    row_values(entry) 返回一行各列的内容，只对显示出来的条目调用。
+    """
+
+    def __init__(self, parent, playlist, columns, row_values, height=8):
+        self.playlist = playlist
+        self.row_values = row_values
+        self.top = 0
+        self.rows = []
+        self.row_height = 20
+        self.selected_id = None
+
+        self.tree = ttk.Treeview(parent, columns=[c for c, _, _ in columns],
+                                 show="headings", height=height, selectmode="browse")
+        for column, text, width in columns:
+            self.tree.heading(column, text=text, anchor=tk.W)
+            self.tree.column(column, width=width, anchor=tk.W)
+        self.scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.on_scroll)
+
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<MouseWheel>", self.on_wheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll_to(self.top - 3) or "break")
+        self.tree.bind("<Button-5>", lambda e: self.scroll_to(self.top + 3) or "break")
+        self.tree.bind("<Up>", lambda e: self.move_selection(-1) or "break")
+        self.tree.bind("<Down>", lambda e: self.move_selection(1) or "break")
+        self.tree.bind("<Prior>", lambda e: self.scroll_to(self.top - len(self.rows)) or "break")
+        self.tree.bind("<Next>", lambda e: self.scroll_to(self.top + len(self.rows)) or "break")
+        self._set_row_count(height)
+
+    def grid(self, row, column, **kw):
+        self.tree.grid(row=row, column=column, sticky="nsew", **kw)
+        self.scrollbar.grid(row=row, column=column + kw.get("columnspan", 1), sticky="ns")
+
+    def _set_row_count(self, count):
+        count = max(count, 1)
+        while len(self.rows) < count:
+            self.rows.append(self.tree.insert("", tk.END, values=()))
+        while len(self.rows) > count:
+            self.tree.delete(self.rows.pop())
+        self.refresh()
+
+    def on_resize(self, event):
+        bbox = self.tree.bbox(self.rows[0])
+        if bbox:
+            header, self.row_height = bbox[1], bbox[3]
+        else:
+            header = self.row_height
+        self._set_row_count((event.height - header) // self.row_height)
+
+    def entry_at(self, row_item):
+        """Treeview行对应的播放列表条目，空行返回None"""
+        if row_item not in self.rows:
+            return None
+        index = self.top + self.rows.index(row_item)
+        return self.playlist[index] if index < len(self.playlist) else None
+
+    def refresh(self):
+        """重新填充所有可见行"""
+        total = len(self.playlist)
+        self.top = max(0, min(self.top, total - len(self.rows)))
+        selected_row = None
+        for i, row in enumerate(self.rows):
+            index = self.top + i
+            if index < total:
+                entry = self.playlist[index]
+                self.tree.item(row, values=self.row_values(entry))
+                if entry.id == self.selected_id:
+                    selected_row = row
+            else:
+                self.tree.item(row, values=())
+        if selected_row is not None:
+            if self.tree.selection() != (selected_row,):
+                self.tree.selection_set(selected_row)
+        elif self.tree.selection():
+            self.tree.selection_remove(*self.tree.selection())
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + len(self.rows)) / total))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def refresh_entry(self, entry_id):
+        """只更新一个条目所在的行（如果它可见）"""
+        if entry_id not in self.playlist:
+            return
+        i = self.playlist.index(entry_id) - self.top
+        if 0 <= i < len(self.rows):
+            self.tree.item(self.rows[i], values=self.row_values(self.playlist[i + self.top]))
+
+    def scroll_to(self, top):
+        self.top = top
+        self.refresh()
+
+    def see(self, entry_id):
+        """滚动到条目可见"""
+        index = self.playlist.index(entry_id)
+        if index < self.top:
+            self.scroll_to(index)
+        elif index >= self.top + len(self.rows):
+            self.scroll_to(index - len(self.rows) + 1)
+
+    def select(self, entry_id):
+        self.selected_id = entry_id
+        if entry_id in self.playlist:
+            self.see(entry_id)
+        self.refresh()
+
+    def move_selection(self, step):
+        if not len(self.playlist):
+            return
+        if self.selected_id in self.playlist:
+            index = self.playlist.index(self.selected_id) + step
+        else:
+            index = self.top
+        index = max(0, min(index, len(self.playlist) - 1))
+        self.select(self.playlist[index].id)
+
+    def on_select(self, event):
+        selection = self.tree.selection()
+        entry = self.entry_at(selection[0]) if selection else None
+        if entry is not None:
+            self.selected_id = entry.id
+
+    def on_scroll(self, *args):
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * len(self.playlist)))
+        elif args[0] == "scroll":
+            step = int(args[1]) * (len(self.rows) if args[2] == "pages" else 1)
+            self.scroll_to(self.top + step)
+
+    def on_wheel(self, event):
+        # Windows每格delta为120，macOS为1
+        step = -event.delta // 120 if abs(event.delta) >= 120 else -event.delta
+        self.scroll_to(self.top + step * 3)
+        return "break"
@@ -0,0 +1,195 @@
+# 快速检查P3文件：只扫描数据包头部和TOC字节，不解码音频
+import os
+import sys
+import json
+import argparse
+from p3_format import (PACKET_HEADER, FRAME_DURATION, P3V2_HEADER,
+                       opus_frame_samples, opus_frame_count, parse_p3_header,
+                       p3_data_end, read_p3_index)
+
+# 60ms 对应 48kHz 下的采样数
+PACKET_SAMPLES = 48 * FRAME_DURATION
+
+
+def check_opus_packet(packet, expected=PACKET_SAMPLES):
+    """
+    按RFC 6716 3.2节校验Opus数据包的帧长度（code 3 VBR数据包逐个读取
+    3.2.5节的帧长度字段），合法时返回None，否则返回原因
+    """
+    size = len(packet)
+    if size == 0:
+        return "empty packet"
+    code = packet[0] & 0x03
+    if code == 1 and (size - 1) % 2:
+        return "odd payload for two CBR frames"
+    if code == 2:
+        if size < 2:
+            return "missing frame length"
+        n = 1 if packet[1] < 252 else 2
+        if size < 1 + n:
+            return "missing frame length"
+        first = packet[1] if n == 1 else packet[2] * 4 + packet[1]
+        if first > size - 1 - n:
+            return "frame length exceeds packet"
+    if code == 3:
+        if size < 2:
+            return "missing frame count"
+        count = opus_frame_count(packet)
+        if count == 0:
+            return "zero frame count"
+        if count * opus_frame_samples(packet[0]) > 5760:
+            return "packet longer than 120ms"
+        vbr, has_padding = packet[1] & 0x80, packet[1] & 0x40
+        pos = 2
+        padding = 0
+        while has_padding:
+            if pos >= size:
+                return "truncated padding length"
+            p = packet[pos]
+            pos += 1
+            padding += 254 if p == 255 else p
+            has_padding = p == 255
+        payload = size - pos - padding
+        if payload < 0:
+            return "padding exceeds packet"
+        if not vbr and payload % count:
+            return "CBR payload not divisible by frame count"
+        if vbr:
+            # M-1个帧长度（1或2字节），最后一帧占用剩下的数据
+            total = 0
+            for _ in range(count - 1):
+                if pos >= size - padding:
+                    return "truncated frame length"
+                n = 1 if packet[pos] < 252 else 2
+                if pos + n > size - padding:
+                    return "truncated frame length"
+                total += packet[pos] if n == 1 else packet[pos + 1] * 4 + packet[pos]
+                pos += n
+            if total > size - pos - padding:
+                return "frame lengths exceed packet"
+    samples = opus_frame_count(packet) * opus_frame_samples(packet[0])
+    if samples != expected:
+        return f"packet duration {samples / 48:g}ms, expected {expected / 48:g}ms"
+    return None
+
+
+def probe_p3(input_file):
+    """
+    返回P3文件的时长、数据包统计和损坏情况
+    """
+    with open(input_file, 'rb') as f:
+        data = f.read()
+
+    header = parse_p3_header(data[:P3V2_HEADER.size])
+    frame_duration = header["frame_duration"]
+    unpack_from = PACKET_HEADER.unpack_from
+    end = p3_data_end(header, len(data))
+    offset = header["data_offset"]
+    offsets = []
+    sizes = []
+    invalid = []
+    while offset + 4 <= end:
+        _, _, opus_len = unpack_from(data, offset)
+        if offset + 4 + opus_len > end:
+            break
+        error = check_opus_packet(data[offset + 4:offset + 4 + opus_len],
+                                  48 * frame_duration)
+        if error:
+            invalid.append({"index": len(sizes), "offset": offset,
+                            "error": error})
+        offsets.append(offset)
+        sizes.append(opus_len)
+        offset += 4 + opus_len
+
+    count = len(sizes)
+    duration = count * frame_duration / 1000
+    payload = sum(sizes)
+
+    # P3v2文件头中的数据包数和索引要和实际的数据包一致
+    header_errors = []
+    if header["packets"] is not None and header["packets"] != count:
+        header_errors.append(f"header says {header['packets']} packets, found {count}")
+    if header["index_offset"]:
+        index = read_p3_index(data, header)
+        if index is None:
+            header_errors.append("packet index is missing or damaged")
+        elif index != offsets:
+            header_errors.append("packet index does not match the packets")
+    return {
+        "file": str(input_file),
+        "version": header["version"],
+        "loudness": header["loudness"],
+        "header_errors": header_errors,
+        "size": len(data),
+        "packets": count,
+        "duration": duration,
+        "bitrate": int(payload * 8 / duration) if duration else 0,
+        "min_packet": min(sizes) if sizes else 0,
+        "max_packet": max(sizes) if sizes else 0,
+        "avg_packet": payload / count if count else 0,
+        "invalid": invalid,
+        "truncated": end - offset,
+    }
+
+
+def is_valid(info):
+    if "error" in info:
+        return False
+    return (info["packets"] > 0 and not info["invalid"] and not info["truncated"]
+            and not info["header_errors"])
+
+
+def _collect_files(inputs):
+    for name in inputs:
+        if os.path.isdir(name):
+            for root, _, files in os.walk(name):
+                for f in sorted(files):
+                    if f.lower().endswith('.p3'):
+                        yield os.path.join(root, f)
+        else:
+            yield name
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检查P3文件的时长、码率和损坏情况')
+    parser.add_argument('inputs', nargs='+', help='P3文件或目录')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出')
+    args = parser.parse_args()
+
+    results = []
+    for f in _collect_files(args.inputs):
+        try:
+            results.append(probe_p3(f))
+        except (OSError, ValueError) as e:
+            # 无法读取的文件记为不合格，继续检查其余文件
+            results.append({"file": str(f), "error": str(e)})
+    bad = [r for r in results if not is_valid(r)]
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        for r in results:
+            if "error" in r:
+                print(f"ERR {r['file']}")
+                print(f"      unreadable: {r['error']}")
+                continue
+            status = "OK" if is_valid(r) else "BAD"
+            print(f"{status:4}{r['duration']:8.2f}s {r['packets']:6d} pkts "
+                  f"{r['bitrate'] / 1000:6.1f}kbps "
+                  f"{r['min_packet']}/{r['avg_packet']:.0f}/{r['max_packet']}B  "
+                  f"v{r['version']}  {r['file']}")
+            for e in r["invalid"]:
+                print(f"      packet {e['index']} @ {e['offset']}: {e['error']}")
+            for e in r["header_errors"]:
+                print(f"      {e}")
+            if r["truncated"]:
+                print(f"      {r['truncated']} trailing bytes truncated")
+            if not r["packets"]:
+                print("      no audio packets")
+        print(f"{len(results)} files, {len(bad)} invalid")
+
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+# 常驻的音频转P3服务
+# 启动时加载librosa等依赖并预热重采样器，之后通过本地HTTP接口接收WAV/MP3，边编码边返回P3数据
+#
+# 用法:
+#   python p3_server.py [--host 127.0.0.1] [--port 8765] [--workers 4] [--queue 16]
+#   curl --data-binary @input.mp3 "http://127.0.0.1:8765/convert?format=mp3&lufs=-16" -o output.p3
+import os
+import sys
+import asyncio
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import soundfile as sf
+from convert_audio_to_p3 import load_audio, encode_pcm_to_packets
+
+MAX_BODY_SIZE = 64 * 1024 * 1024
+# 请求头的数量和总长度上限，超过时返回431
+MAX_HEADERS = 64
+MAX_HEADER_BYTES = 16 * 1024
+# 每个请求最多缓存的数据包数量，客户端读取过慢时编码线程会在这里等待
+PACKET_QUEUE_SIZE = 32
+SUPPORTED_FORMATS = ('wav', 'mp3', 'ogg', 'flac')
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 411: "Length Required",
+    413: "Payload Too Large", 431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class ConvertJob:
+
+    def __init__(self, body, suffix, target_lufs):
+        self.body = body
+        self.suffix = suffix
+        self.target_lufs = target_lufs
+        self.packets = asyncio.Queue(maxsize=PACKET_QUEUE_SIZE)
+        self.cancelled = False
+
+
+class P3Server:
+
+    def __init__(self, workers=4, queue_size=16, max_body_size=MAX_BODY_SIZE):
+        self.max_body_size = max_body_size
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.workers = workers
+        # 正在编码和排队的请求总数上限，超过后直接返回503
+        self.max_jobs = workers + queue_size
+        self.active_jobs = 0
+        self.jobs = asyncio.Queue()
+        self.loop = None
+
+    def warm_up(self):
+        """预热: 触发librosa重采样器和Opus编码器的初始化"""
+        tone = np.sin(np.linspace(0, 440 * 2 * np.pi, 44100)).astype(np.float32)
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
+            temp_path = tmp.name
+        try:
+            sf.write(temp_path, tone, 44100)
+            audio = load_audio(temp_path)
+            for _ in encode_pcm_to_packets(audio):
+                pass
+        finally:
+            os.unlink(temp_path)
+
+    def run_job(self, job):
+        """在工作线程中执行: 解码上传的音频并逐包编码"""
+        if job.cancelled:
+            return
+
+        def put(item):
+            if job.cancelled:
+                return False
+            asyncio.run_coroutine_threadsafe(job.packets.put(item), self.loop).result()
+            return True
+
+        with tempfile.NamedTemporaryFile(suffix=job.suffix, delete=False) as tmp:
+            tmp.write(job.body)
+            temp_path = tmp.name
+        job.body = None
+        try:
+            audio = load_audio(temp_path, job.target_lufs)
+            for packet in encode_pcm_to_packets(audio):
+                if not put(packet):
+                    return
+            put(None)
+        except Exception as e:
+            put(e)
+        finally:
+            os.unlink(temp_path)
+
+    async def worker(self):
+        while True:
+            job = await self.jobs.get()
+            try:
+                await self.loop.run_in_executor(self.pool, self.run_job, job)
+            finally:
+                self.active_jobs -= 1
+                self.jobs.task_done()
+
+    async def send_response(self, writer, status, message):
+        body = (message + "\n").encode()
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+            f"Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            await self.handle_request(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, ValueError):
+            # 连接断开，或者客户端发送了超过StreamReader上限的行
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+        except ValueError:
+            return await self.send_response(writer, 400, "request line too long")
+        if len(request_line) != 3:
+            return await self.send_response(writer, 400, "invalid request")
+        method, target, _ = request_line
+
+        headers = {}
+        header_bytes = 0
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                return await self.send_response(writer, 431, "header line too long")
+            if line in (b'\r\n', b'\n', b''):
+                break
+            header_bytes += len(line)
+            if len(headers) >= MAX_HEADERS or header_bytes > MAX_HEADER_BYTES:
+                return await self.send_response(writer, 431, "too many or too large headers")
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        url = urlsplit(target)
+        if url.path != '/convert':
+            return await self.send_response(writer, 404, "not found")
+        if method != 'POST':
+            return await self.send_response(writer, 405, "use POST")
+
+        query = parse_qs(url.query)
+        fmt = query.get('format', ['wav'])[0].lower()
+        if fmt not in SUPPORTED_FORMATS:
+            return await self.send_response(writer, 400, f"unsupported format: {fmt}")
+        lufs = query.get('lufs', ['none'])[0]
+        try:
+            target_lufs = None if lufs == 'none' else float(lufs)
+        except ValueError:
+            return await self.send_response(writer, 400, f"invalid lufs: {lufs}")
+
+        if 'content-length' not in headers:
+            return await self.send_response(writer, 411, "Content-Length required")
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            length = -1
+        if length < 0:
+            return await self.send_response(writer, 400, "invalid Content-Length")
+        if length > self.max_body_size:
+            return await self.send_response(writer, 413, "upload too large")
+
+        # 读取上传内容之前先检查并占用名额，服务繁忙时不接收请求体
+        if self.active_jobs >= self.max_jobs:
+            writer.write(b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\n"
+                         b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+            return await writer.drain()
+        self.active_jobs += 1
+        try:
+            body = await reader.readexactly(length)
+        except BaseException:
+            self.active_jobs -= 1
+            raise
+
+        job = ConvertJob(body, '.' + fmt, target_lufs)
+        self.jobs.put_nowait(job)
+
+        try:
+            first = await job.packets.get()
+            if isinstance(first, Exception):
+                return await self.send_response(writer, 400, f"convert failed: {first}")
+
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n"
+                         b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+            chunk = [first]
+            while True:
+                # 合并已经编码好的数据包，减少小块写入
+                while isinstance(chunk[-1], bytes) and not job.packets.empty():
+                    chunk.append(job.packets.get_nowait())
+                end = chunk[-1]
+                data = b''.join(p for p in chunk if isinstance(p, bytes))
+                if data:
+                    writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    await writer.drain()
+                if end is None:
+                    break
+                if isinstance(end, Exception):
+                    # 已经开始返回数据，只能断开连接让客户端知道转换失败
+                    print(f"convert failed: {end}", file=sys.stderr)
+                    return
+                chunk = [await job.packets.get()]
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            job.cancelled = True
+            # 唤醒可能正在等待队列空位的编码线程
+            while not job.packets.empty():
+                job.packets.get_nowait()
+
+    async def serve(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        print("Warming up...")
+        await self.loop.run_in_executor(self.pool, self.warm_up)
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on http://{host}:{port}/convert")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for w in workers:
+                w.cancel()
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local HTTP service converting audio to P3')
+    parser.add_argument('--host', default='127.0.0.1', help='Listen address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='Listen port (default: 8765)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4,
+                        help='Number of encoding threads')
+    parser.add_argument('--queue', type=int, default=16,
+                        help='Max pending requests before returning 503')
+    parser.add_argument('--max-upload-mb', type=int, default=MAX_BODY_SIZE // (1024 * 1024),
+                        help='Largest accepted upload in MB, larger ones get 413 (default: 64)')
+    args = parser.parse_args()
+
+    try:
+        server = P3Server(args.workers, args.queue, args.max_upload_mb * 1024 * 1024)
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
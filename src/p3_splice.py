@@ -0,0 +1,273 @@
+# 按数据包拼接P3文件，用预先录好的片段（数字、单位、名字）组装语音提示
+# 拼接只是把各片段的数据包依次排列，不解码也不重新编码；
+# 可选在每个接缝处做几个数据包的交叉淡化，只有这几个数据包需要解码再编码
+#
+# 用法:
+#   python p3_splice.py <输出P3文件> <片段P3文件>... [--crossfade N] [--p3v2]
+import os
+import sys
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from p3_format import (SAMPLE_RATE, CHANNELS, FRAME_DURATION, PACKET_HEADER, P3Writer,
+                       read_p3_file, pack_p3_packet)
+
+# 交叉淡化时，前一个片段末尾的数据包前面多解码的数据包数，让解码器状态收敛
+CROSSFADE_PREROLL = 5
+# 片段缓存默认占用的内存上限
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class Fragment:
+    """
+    一个拼接用的片段：文件信息和带4字节P3头部的数据包。
+    key用于缓存接缝处交叉淡化的结果，不是从文件读取的片段为None
+    """
+    __slots__ = ("key", "sample_rate", "channels", "frame_duration", "packets", "size")
+
+    def __init__(self, packets, sample_rate, channels, frame_duration, key=None):
+        self.key = key
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_duration = frame_duration
+        self.packets = tuple(packets)
+        self.size = sum(len(p) for p in self.packets)
+
+    @classmethod
+    def from_file(cls, input_file, key=None):
+        header, packets = read_p3_file(input_file)
+        return cls([pack_p3_packet(p) for p in packets], header["sample_rate"],
+                   header["channels"], header["frame_duration"], key)
+
+    @classmethod
+    def from_opus(cls, packets, sample_rate=SAMPLE_RATE, channels=CHANNELS,
+                  frame_duration=FRAME_DURATION):
+        """由不带P3头部的Opus数据包创建片段"""
+        return cls([pack_p3_packet(p) for p in packets], sample_rate, channels, frame_duration)
+
+    @property
+    def format(self):
+        return self.sample_rate, self.channels, self.frame_duration
+
+    def opus(self, start, end):
+        """返回 packets[start:end] 去掉P3头部后的Opus数据"""
+        return [p[PACKET_HEADER.size:] for p in self.packets[start:end]]
+
+
+class FragmentCache:
+    """
+    常用片段的内存缓存，按最近使用淘汰，总大小不超过max_bytes。
+    每次取用时检查文件的大小和修改时间，文件被替换后自动重新读取。
+    同时缓存接缝处交叉淡化编码出的数据包，重复组装同样的句子时不再编码
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._fragments = OrderedDict()
+        self._joins = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def get(self, input_file):
+        path = os.path.abspath(input_file)
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            fragment = self._fragments.get(path)
+            if fragment is not None and fragment.key == key:
+                self._fragments.move_to_end(path)
+                return fragment
+        fragment = Fragment.from_file(path, key)
+        with self._lock:
+            old = self._fragments.pop(path, None)
+            if old is not None:
+                self.size -= old.size
+            self._fragments[path] = fragment
+            self.size += fragment.size
+            self._evict()
+        return fragment
+
+    def get_join(self, key):
+        with self._lock:
+            packets = self._joins.get(key)
+            if packets is not None:
+                self._joins.move_to_end(key)
+            return packets
+
+    def put_join(self, key, packets):
+        with self._lock:
+            self._joins[key] = packets
+            self.size += sum(len(p) for p in packets)
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes and (self._joins or len(self._fragments) > 1):
+            # 先淘汰接缝，它们可以用片段重新算出来
+            if self._joins:
+                _, packets = self._joins.popitem(last=False)
+                self.size -= sum(len(p) for p in packets)
+            else:
+                _, fragment = self._fragments.popitem(last=False)
+                self.size -= fragment.size
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+            self._joins.clear()
+            self.size = 0
+
+
+def load_fragments(fragments, cache=None):
+    """
+    把文件路径换成Fragment，有cache时从缓存读取
+    """
+    return [f if isinstance(f, Fragment) else
+            (cache.get(f) if cache is not None else Fragment.from_file(f))
+            for f in fragments]
+
+
+def crossfade_join(a, b, count, preroll=CROSSFADE_PREROLL):
+    """
+    把a末尾的count个数据包和b开头的count个数据包解码后线性交叉淡化，
+    再编码为count个带P3头部的数据包，拼接后整体缩短count个数据包的时长。
+    编码器先用a在接缝前的preroll个数据包的音频预热，这些数据包丢弃；
+    输入再提前编码器的lookahead个采样，让重新编码的数据包解码后和
+    两边原样保留的数据包在时间上对齐。需要opuslib和numpy
+    """
+    import numpy as np
+    import opuslib
+    from p3_format import OpusBatchDecoder
+
+    sample_rate, channels, frame_duration = a.format
+    frame_size = sample_rate * frame_duration // 1000
+    length = count * frame_size
+    start = len(a.packets) - count
+    first = max(0, start - preroll)
+
+    def fit(pcm, size, pad_front=False):
+        pcm = pcm.reshape(-1, channels).astype(np.float32)
+        if len(pcm) >= size:
+            return pcm[-size:] if pad_front else pcm[:size]
+        pad = np.zeros((size - len(pcm), channels), np.float32)
+        return np.concatenate([pad, pcm] if pad_front else [pcm, pad])
+
+    decoder = OpusBatchDecoder(sample_rate, channels)
+    prime = fit(decoder.decode_all(a.opus(first, start)), (start - first) * frame_size, True)
+    tail = fit(decoder.decode_all(a.opus(start, len(a.packets))), length, True)
+    # b多解码一个数据包，补足提前lookahead后末尾缺少的采样
+    head = OpusBatchDecoder(sample_rate, channels).decode_all(b.opus(0, count + 1))
+    head, after = fit(head, length), fit(head.reshape(-1, channels)[length:], frame_size)
+
+    fade = np.linspace(0.0, 1.0, length, dtype=np.float32)[:, None]
+    mixed = tail * (1 - fade) + head * fade
+
+    encoder = opuslib.Encoder(sample_rate, channels, opuslib.APPLICATION_AUDIO)
+    lookahead = encoder.lookahead
+    signal = np.concatenate([prime, mixed, after])[lookahead:]
+    signal = np.clip(signal, -32768, 32767).astype(np.int16)
+    packets = [encoder.encode(signal[i:i + frame_size].tobytes(), frame_size)
+               for i in range(0, len(prime) + length, frame_size)]
+    return tuple(pack_p3_packet(p) for p in packets[len(prime) // frame_size:])
+
+
+def splice(fragments, crossfade=0, cache=None):
+    """
+    按顺序拼接片段，返回带P3头部的数据包列表。fragments中可以是文件路径
+    （有cache时从缓存读取）或Fragment。crossfade大于0时在每个接缝处做
+    crossfade个数据包的交叉淡化，片段不足时该接缝直接拼接
+    """
+    fragments = load_fragments(fragments, cache)
+    if not fragments:
+        return []
+    if any(f.format != fragments[0].format for f in fragments):
+        raise ValueError("fragments have different sample rate, channels or frame duration")
+
+    if crossfade <= 0:
+        packets = []
+        for f in fragments:
+            packets += f.packets
+        return packets
+
+    packets = list(fragments[0].packets)
+    # 输出末尾还保持原样的数据包数，前一个接缝已经改写了a的开头时不能再淡化a的末尾
+    intact = len(packets)
+    for a, b in zip(fragments, fragments[1:]):
+        if intact < crossfade or len(b.packets) < crossfade:
+            packets += b.packets
+            intact = len(b.packets)
+            continue
+        key = (a.key, b.key, crossfade)
+        joined = None
+        if cache is not None and a.key is not None and b.key is not None:
+            joined = cache.get_join(key)
+            if joined is None:
+                joined = crossfade_join(a, b, crossfade)
+                cache.put_join(key, joined)
+        else:
+            joined = crossfade_join(a, b, crossfade)
+        del packets[len(packets) - crossfade:]
+        packets += joined
+        packets += b.packets[crossfade:]
+        intact = len(b.packets) - crossfade
+    return packets
+
+
+def splice_to_bytes(fragments, crossfade=0, cache=None):
+    """
+    拼接片段并返回v1格式的P3数据，可以直接发送给设备
+    """
+    return b''.join(splice(fragments, crossfade, cache))
+
+
+def splice_files(output_file, fragments, crossfade=0, cache=None, version=1):
+    """
+    拼接片段并写入P3文件，version为2时写P3v2文件头和索引
+    """
+    fragments = load_fragments(fragments, cache)
+    packets = splice(fragments, crossfade, cache)
+    if fragments:
+        sample_rate, channels, frame_duration = fragments[0].format
+    else:
+        sample_rate, channels, frame_duration = SAMPLE_RATE, CHANNELS, FRAME_DURATION
+    with open(output_file, 'wb') as f, \
+            P3Writer(f, version, sample_rate=sample_rate, channels=channels,
+                     frame_duration=frame_duration) as writer:
+        for p in packets:
+            writer.write_packed(p)
+    return len(packets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按数据包拼接P3文件')
+    parser.add_argument('output', help='输出的p3文件')
+    parser.add_argument('fragments', nargs='+', help='按顺序拼接的p3片段')
+    parser.add_argument('--crossfade', type=int, default=0,
+                        help='每个接缝处交叉淡化的数据包数（默认: 0，直接拼接；需要opuslib）')
+    parser.add_argument('--p3v2', action='store_true', help='输出P3v2格式')
+    parser.add_argument('--bench', type=int, default=0, metavar='N',
+                        help='从缓存重复组装N次并输出平均耗时')
+    args = parser.parse_args()
+
+    cache = FragmentCache()
+    try:
+        count = splice_files(args.output, args.fragments, args.crossfade, cache,
+                             2 if args.p3v2 else 1)
+    except (OSError, ValueError) as e:
+        print(f"拼接失败: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+    print(f"{len(args.fragments)} fragments, {count} packets -> {args.output}")
+
+    if args.bench > 0:
+        start = time.perf_counter()
+        for _ in range(args.bench):
+            splice_to_bytes(args.fragments, args.crossfade, cache)
+        elapsed = (time.perf_counter() - start) / args.bench
+        print(f"assembly from cache: {elapsed * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
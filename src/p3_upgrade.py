@@ -0,0 +1,73 @@
+# P3 v1 与 P3v2 互转
+# 只改变封装：v1转v2时加上文件头和数据包索引，v2转v1时去掉，数据包内容不变
+#
+# 用法:
+#   python p3_upgrade.py <输入文件或目录> <输出文件或目录> [--to 1|2] [--measure]
+import os
+import sys
+import argparse
+from p3_format import (SAMPLE_RATE, CHANNELS, FRAME_DURATION, read_p3_file,
+                       write_p3_packets)
+
+
+def measure_loudness(packets, sample_rate, channels):
+    """
+    解码并测量整体响度(LUFS)，需要opuslib和pyloudnorm
+    """
+    import numpy as np
+    import pyloudnorm as pyln
+    from p3_format import OpusBatchDecoder
+
+    pcm = OpusBatchDecoder(sample_rate, channels).decode_all(packets)
+    return float(pyln.Meter(sample_rate).integrated_loudness(pcm.astype(np.float32) / 32768))
+
+
+def convert_file(input_file, output_file, version=2, measure=False):
+    """
+    转换单个文件，返回输入文件的版本。转为v2时保留原文件头中的响度，
+    measure为True且响度未知时解码测量
+    """
+    header, packets = read_p3_file(input_file)
+    loudness = header["loudness"]
+    if version == 2 and loudness is None and measure and packets:
+        loudness = measure_loudness(packets, header["sample_rate"], header["channels"])
+    if version == 1 and (header["sample_rate"], header["channels"],
+                         header["frame_duration"]) != (SAMPLE_RATE, CHANNELS, FRAME_DURATION):
+        raise ValueError("P3 v1 only holds 16kHz mono 60ms packets")
+    write_p3_packets(output_file, packets, version, loudness,
+                     sample_rate=header["sample_rate"], channels=header["channels"],
+                     frame_duration=header["frame_duration"])
+    return header["version"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='P3 v1 与 P3v2 互转')
+    parser.add_argument('input', help='输入的p3文件或目录')
+    parser.add_argument('output', help='输出文件或目录')
+    parser.add_argument('--to', type=int, choices=[1, 2], default=2,
+                        help='输出的版本（默认: 2）')
+    parser.add_argument('--measure', action='store_true',
+                        help='转为v2时解码测量响度写入文件头（需要opuslib和pyloudnorm）')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.input):
+        os.makedirs(args.output, exist_ok=True)
+        files = [(os.path.join(args.input, name), os.path.join(args.output, name))
+                 for name in sorted(os.listdir(args.input)) if name.lower().endswith('.p3')]
+    else:
+        files = [(args.input, args.output)]
+
+    failed = 0
+    for input_file, output_file in files:
+        try:
+            version = convert_file(input_file, output_file, args.to, args.measure)
+            print(f"v{version} -> v{args.to}: {os.path.basename(input_file)}")
+        except Exception as e:
+            failed += 1
+            print(f"转换失败: {os.path.basename(input_file)}: {str(e)}", file=sys.stderr)
+    print(f"done {len(files) - failed} files")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,27 @@
 # 播放p3格式的音频文件
-import opuslib
+import os
 import struct
 import numpy as np
 import sounddevice as sd
 import time
 import argparse
+from p3_format import OpusBatchDecoder, read_p3_header, p3_data_end, seek_p3_packet
 
-def play_p3_file(input_file):
+def play_p3_file(input_file, start=0):
     """
-    播放p3格式的音频文件
+    播放p3格式的音频文件，从第start秒开始
     p3格式: [1字节类型, 1字节保留, 2字节长度, Opus数据]
     """
     # 初始化Opus解码器
-    sample_rate = 16000  # 采样率固定为16000Hz
-    channels = 1  # 单声道
-    decoder = opuslib.Decoder(sample_rate, channels)
-    
-    # 帧大小 (60ms)
-    frame_size = int(sample_rate * 60 / 1000)
+    # v1文件固定为16kHz单声道，P3v2从文件头读取
+    with open(input_file, 'rb') as f:
+        info = read_p3_header(f)
+        data_end = p3_data_end(info, os.fstat(f.fileno()).st_size)
+    sample_rate = info["sample_rate"]
+    channels = info["channels"]
+    decoder = OpusBatchDecoder(sample_rate, channels)
+    # 解码结果直接写入这个缓冲区，不为每个数据包分配新的内存
+    pcm_buffer = np.empty(decoder.max_frame_size * channels, dtype=np.int16)
     
     # 打开音频流
     stream = sd.OutputStream(
@@ -30,9 +34,13 @@ def play_p3_file(input_file):
     try:
         with open(input_file, 'rb') as f:
             print(f"正在播放: {input_file}")
+            # P3v2有索引时直接跳到开始的数据包，否则逐个跳过数据包头部
+            seek_p3_packet(f, info, int(start * 1000) // info["frame_duration"], data_end)
             
             while True:
-                # 读取头部 (4字节)
+                # 读取头部 (4字节)，P3v2读到索引为止
+                if f.tell() + 4 > data_end:
+                    break
                 header = f.read(4)
                 if not header or len(header) < 4:
                     break
@@ -46,16 +54,13 @@ def play_p3_file(input_file):
                     break
                 
                 # 解码Opus数据
-                pcm_data = decoder.decode(opus_data, frame_size)
-                
-                # 将字节转换为numpy数组
-                audio_array = np.frombuffer(pcm_data, dtype=np.int16)
+                samples = decoder.decode_into((opus_data,), pcm_buffer)
                 
                 # 播放音频
-                stream.write(audio_array)
+                stream.write(pcm_buffer[:samples * channels])
                 
                 # 等待一帧的时间
-                time.sleep(60 / 1000)  # 60ms
+                time.sleep(info["frame_duration"] / 1000)
             
             # 播放结束后添加0.5秒静音，避免破音
             silence = np.zeros(int(sample_rate / 2), dtype=np.int16)
@@ -72,9 +77,11 @@ def play_p3_file(input_file):
 def main():
     parser = argparse.ArgumentParser(description='播放p3格式的音频文件')
     parser.add_argument('input_file', help='输入的p3文件路径')
+    parser.add_argument('--start', type=float, default=0,
+                        help='从第几秒开始播放（默认: 0）')
     args = parser.parse_args()
     
-    play_p3_file(args.input_file)
+    play_p3_file(args.input_file, args.start)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Check the builtin palette quantizer's dithering against PIL's Floyd-Steinberg
+#
+# usage:
+#   python -m pytest test_quantize.py
+import numpy as np
+from PIL import Image, ImageFilter
+
+from LVGLImage import PaletteQuantizer
+
+
+def _gradient(w=96, h=64):
+    """
+    Opaque RGBA test image with smooth gradients that band without dithering
+    """
+    x = np.linspace(0, 255, w)[None, :]
+    y = np.linspace(0, 255, h)[:, None]
+    rgb = np.stack([np.broadcast_to(x, (h, w)),
+                    np.broadcast_to(y, (h, w)),
+                    (x + y) / 2 * np.ones((h, w))], axis=2)
+    alpha = np.full((h, w, 1), 255)
+    return np.concatenate([rgb, alpha], axis=2).round().astype(np.uint8)
+
+
+def _pil_floyd_steinberg(rgba, palette):
+    """
+    Dither with PIL to the same palette, return RGB values
+    """
+    pal_img = Image.new('P', (1, 1))
+    # unused entries repeat the first color so PIL can't pick extra colors
+    flat = palette[:, :3].ravel().tolist()
+    pal_img.putpalette(flat + flat[:3] * (256 - len(palette)))
+    rgb = Image.fromarray(rgba[..., :3])
+    out = rgb.quantize(palette=pal_img, dither=Image.Dither.FLOYDSTEINBERG)
+    return np.asarray(out.convert('RGB')).astype(np.float64)
+
+
+def _blurred_mse(a, b):
+    """
+    Error as seen from a distance, the quantity dithering is meant to lower
+    """
+    def blur(x):
+        img = Image.fromarray(x.astype(np.uint8))
+        return np.asarray(img.filter(ImageFilter.GaussianBlur(1.5))).astype(np.float64)
+    return float(((blur(a) - blur(b))**2).mean())
+
+
+def test_dither_matches_pil():
+    rgba = _gradient()
+    original = rgba[..., :3].astype(np.float64)
+    for ncolors in (4, 16, 64):
+        quantizer = PaletteQuantizer(ncolors, dither=True)
+        palette = quantizer.build_palette([rgba], ncolors)
+        dithered = palette[quantizer.remap(rgba, palette)][..., :3].astype(np.float64)
+        quantizer.dither = False
+        plain = palette[quantizer.remap(rgba, palette)][..., :3].astype(np.float64)
+        reference = _pil_floyd_steinberg(rgba, palette)
+
+        mse = float(((original - dithered)**2).mean())
+        ref_mse = float(((original - reference)**2).mean())
+        # same algorithm, pixel error within 10% of PIL's
+        assert mse <= ref_mse * 1.1 + 1, (ncolors, mse, ref_mse)
+        # and it actually diffuses: smoother than no dithering, like PIL
+        assert _blurred_mse(original, dithered) < _blurred_mse(original, plain), ncolors
+        assert _blurred_mse(original, dithered) <= _blurred_mse(original, reference) * 1.1 + 1
+
+
+def test_dither_keeps_transparent_pixels():
+    rgba = _gradient(32, 32)
+    rgba[:, :8, 3] = 0
+    quantizer = PaletteQuantizer(16, dither=True)
+    palette, indices = quantizer.quantize(rgba)
+    alpha = np.array([c[3] for c in palette])[indices]
+    assert (alpha[:, :8] == 0).all()
+    assert (alpha[:, 8:] > 0).all()
+
+
+if __name__ == "__main__":
+    test_dither_matches_pil()
+    test_dither_keeps_transparent_pixels()
+    print("ok")
@@ -0,0 +1,67 @@
+import sys
+import queue
+import tkinter as tk
+
+
+class TkLogSink:
+    """
+    线程安全的日志输出，可以替换sys.stdout。
+    write只把消息放进队列，任何线程都可以调用；主线程每interval毫秒
+    把队列里的消息一次性写入Text控件并滚动到底部，只保留最后max_lines行，
+    批量转换再长，每条日志的开销也不变。
+    """
+
+    def __init__(self, text_widget, max_lines=2000, interval=100, echo=True):
+        self.text_widget = text_widget
+        self.max_lines = max_lines
+        self.interval = interval
+        # pythonw下没有控制台，sys.stdout为None
+        self.original_stdout = sys.stdout if echo else None
+        self.pending = queue.SimpleQueue()
+        self.text_widget.after(self.interval, self._flush_pending)
+
+    def install(self):
+        """把sys.stdout重定向到这个日志输出"""
+        sys.stdout = self
+        return self
+
+    def write(self, message):
+        if not message:
+            return
+        self.pending.put(message)
+        if self.original_stdout is not None:
+            self.original_stdout.write(message)
+
+    def flush(self):
+        if self.original_stdout is not None:
+            self.original_stdout.flush()
+
+    def clear(self):
+        self.text_widget.delete(1.0, tk.END)
+
+    def _flush_pending(self):
+        messages = []
+        while True:
+            try:
+                messages.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+
+        if messages:
+            text = "".join(messages)
+            # 一批超过上限时只插入最后max_lines行
+            if text.count("\n") > self.max_lines:
+                text = "\n".join(text.split("\n")[-self.max_lines - 1:])
+            try:
+                self.text_widget.insert(tk.END, text)
+                lines = int(self.text_widget.index("end-1c").split(".")[0])
+                if lines > self.max_lines:
+                    self.text_widget.delete(1.0, f"{lines - self.max_lines + 1}.0")
+                self.text_widget.see(tk.END)
+            except tk.TclError:  # 窗口已关闭
+                return
+
+        try:
+            self.text_widget.after(self.interval, self._flush_pending)
+        except tk.TclError:
+            pass
@@ -2,7 +2,7 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
 import threading
-import sys
+from tk_log import TkLogSink
 import ffmpeg
 
 class AudioConverterApp:
@@ -146,20 +146,8 @@ class AudioConverterApp:
             self.output_dir.set(path)
 
     def redirect_output(self):
-        class StdoutRedirector:
-            def __init__(self, text_widget):
-                self.text_widget = text_widget
-                self.original_stdout = sys.stdout
-
-            def write(self, message):
-                self.text_widget.insert(tk.END, message)
-                self.text_widget.see(tk.END)
-                self.original_stdout.write(message)
-
-            def flush(self):
-                self.original_stdout.flush()
-
-        sys.stdout = StdoutRedirector(self.log_text)
+        # 后台线程/进程的输出先进队列，再由主线程批量写入日志框
+        self.log_sink = TkLogSink(self.log_text).install()
 
     def start_conversion(self, convert_all):
         """开始转换"""